@@ -0,0 +1,502 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from core.dbpf import *
+from standin import StandInServer, add_emulator_arguments, get_emulator
+
+
+def make_payload(rnd, size, ratio):
+	"""Returns `size` bytes that QFS-compress to roughly `ratio` of their size (`1` is incompressible)."""
+
+	block = 256
+	noise = max(0, min(block, int(block * ratio)))
+
+	payload = bytearray()
+	while len(payload) < size:
+		payload += rnd.getrandbits(8 * noise).to_bytes(noise, "little") if noise else b""
+		payload += bytes([rnd.getrandbits(8)]) * (block - noise)
+
+	return bytes(payload[:size])
+
+
+def make_SC4ReadRegionalCity(x, y, size, name, mayor, guid):
+	"""Returns a region view subfile (v1.13) for a city tile."""
+
+	data = struct.pack("<2H", 1, 13)
+	data += struct.pack("<7L", x, y, size, size, 1000, 200, 300)
+	data += bytes(4)
+	data += bytes([100, 2, 0])
+	data += struct.pack("<L", guid)
+	data += bytes(20)
+	data += bytes([1])
+	for text in (name, "", mayor):
+		text = text.encode()
+		data += struct.pack("<L", len(text)) + text
+
+	return data
+
+
+def make_cSC4BudgetSimulator(funds):
+	"""Returns a budget subfile holding the total funds."""
+
+	return bytes(14) + struct.pack("<q", funds)
+
+
+def make_bitmap(width, height, color=(255, 0, 0)):
+	"""Returns a 24-bit bitmap of a single color, as a region's `config.bmp` (red tiles are small cities)."""
+
+	row = bytes(reversed(color)) * width
+	row += bytes(-len(row) % 4)
+	pixels = row * height
+
+	header = b"BM" + struct.pack("<L2HL", 54 + len(pixels), 0, 0, 54)
+	header += struct.pack("<3l2H6L", 40, width, height, 1, 24, 0, len(pixels), 2835, 2835, 0, 0)
+
+	return header + pixels
+
+
+def make_region_entry(rnd, mayors, claimed):
+	"""Returns a random region database entry for a city tile, claimed by one of `mayors` with a probability of `claimed`."""
+
+	if rnd.random() >= claimed:
+		return None
+
+	residential, commercial, industrial = (rnd.randrange(0, 100000) for _ in range(3))
+
+	return {
+		"owner": rnd.choice(mayors),
+		"modified": (datetime.now() - timedelta(minutes=rnd.expovariate(1 / 600))).strftime("%Y-%m-%d %H:%M:%S"),
+		"size": 1,
+		"locked": False,
+		"mayor_name": "Mayor",
+		"city_name": "City",
+		"residential_population": residential,
+		"commercial_population": commercial,
+		"industrial_population": industrial,
+		"population": residential + commercial + industrial,
+		"mayor_rating": rnd.randrange(0, 100),
+		"total_funds": rnd.randrange(-100000, 1000000),
+		"gamemode": "mayor",
+	}
+
+
+def write_archive(filename, rnd, args, subfiles=()):
+	"""Writes a DBPF archive of `args.entries` random subfiles, plus the given `(type, group, instance, data)` subfiles."""
+
+	size = 0
+
+	with DBPFWriter(filename, instance2=args.instance2) as writer:
+
+		for type_id, group_id, instance_id, data in subfiles:
+			writer.add(type_id, group_id, instance_id, data, compress=True)
+			size += len(data)
+
+		for instance_id in range(args.entries):
+			data = make_payload(rnd, max(1, int(rnd.expovariate(1 / args.size))), args.ratio)
+			writer.add(rnd.getrandbits(32), rnd.getrandbits(32), instance_id, data, compress=rnd.random() < args.compressed, instance_id2=rnd.getrandbits(32) if args.instance2 else 0)
+			size += len(data)
+
+	return size
+
+
+def corpus(args):
+	"""Generates synthetic plugins and savegames."""
+
+	rnd = random.Random(args.seed)
+
+	start = time.perf_counter()
+	total = 0
+
+	# Plugins
+	plugins_path = os.path.join(args.output, "Plugins")
+	os.makedirs(plugins_path, exist_ok=True)
+	for number in range(args.plugins):
+		total += write_archive(os.path.join(plugins_path, f"synthetic_{number:04d}.dat"), rnd, args)
+
+	# Savegames, laid out on a grid of small tiles
+	region_path = os.path.join(args.output, "Regions", "Synthetic")
+	os.makedirs(region_path, exist_ok=True)
+	columns = max(1, int(args.savegames ** 0.5))
+	mayors = [f"{rnd.getrandbits(128):032x}" for _ in range(args.mayors)]
+	region_database = {}
+	for number in range(args.savegames):
+		x, y = (number % columns) * 2, (number // columns) * 2
+		subfiles = [
+			(0xCA027EDB, 0xCA027EE1, 0, make_SC4ReadRegionalCity(x, y, 1, f"City {number}", "Mayor", rnd.getrandbits(32))),
+			(0xE990BE01, 0xE990BE02, 0, make_cSC4BudgetSimulator(rnd.randrange(-100000, 1000000))),
+		]
+		total += write_archive(os.path.join(region_path, f"City - ({x:03d}-{y:03d}).sc4"), rnd, args, subfiles)
+		region_database[f"{x}_{y}"] = make_region_entry(rnd, mayors, args.claimed)
+
+	# Region config and database, as the server keeps them
+	rows = -(-args.savegames // columns)
+	with open(os.path.join(region_path, "config.bmp"), "wb") as file:
+		file.write(make_bitmap(columns * 2, rows * 2))
+	os.makedirs(os.path.join(region_path, "_Database"), exist_ok=True)
+	with open(os.path.join(region_path, "_Database", "region.json"), "w") as file:
+		json.dump(region_database, file, indent=4)
+
+	print(f"Wrote {args.plugins} plugins and {args.savegames} savegames ({total / 1e6:.1f} MB uncompressed) to \"{args.output}\" in {time.perf_counter() - start:.2f} seconds.")
+
+
+def find_archives(paths):
+	"""Yields the DBPF archives in the given paths. Directories are searched recursively."""
+
+	for path in paths:
+		if os.path.isdir(path):
+			for directory, subdirectories, filenames in os.walk(path):
+				subdirectories.sort()
+				for filename in sorted(filenames):
+					if os.path.splitext(filename)[1].lower() in (".dat", ".sc4", ".sc4lot", ".sc4desc", ".sc4model"):
+						yield os.path.join(directory, filename)
+		else:
+			yield path
+
+
+def report(name, seconds, count, size=None):
+
+	line = f"{name:<28} {seconds:9.3f} s  {count / seconds if seconds else 0:12.0f} /s"
+	if size is not None:
+		line += f"  {size / seconds / 1e6 if seconds else 0:9.1f} MB/s"
+	print(line)
+
+
+def dbpf(args):
+	"""Times index parsing, decompression and savegame scanning."""
+
+	filenames = list(find_archives(args.paths))
+
+	# Index parsing
+	start = time.perf_counter()
+	entries = 0
+	for filename in filenames:
+		with DBPF(filename, memory_map=args.memory_map, verbose=False) as archive:
+			entries += archive.index.count
+	report(f"index ({entries} entries)", time.perf_counter() - start, len(filenames))
+
+	# Decompression
+	start = time.perf_counter()
+	subfiles = 0
+	size = 0
+	for filename in filenames:
+		with DBPF(filename, memory_map=args.memory_map, verbose=False) as archive:
+			for tgi, data in archive.iter_subfiles():
+				subfiles += 1
+				size += len(data)
+	report(f"decompress ({subfiles} subfiles)", time.perf_counter() - start, subfiles, size)
+
+	# Compression
+	if args.compress:
+		start = time.perf_counter()
+		subfiles = 0
+		size = 0
+		for filename in filenames:
+			with DBPF(filename, memory_map=args.memory_map, verbose=False) as archive:
+				for tgi, data in archive.iter_subfiles():
+					qfs_compress(data)
+					subfiles += 1
+					size += len(data)
+		report(f"compress ({subfiles} subfiles)", time.perf_counter() - start, subfiles, size)
+
+	# Savegame scanning
+	savegames = [filename for filename in filenames if filename.lower().endswith(".sc4")]
+	if savegames:
+		start = time.perf_counter()
+		errors = sum(1 for result in scan_savegames(savegames, workers=args.workers) if "error" in result)
+		report(f"scan ({errors} failed)", time.perf_counter() - start, len(savegames))
+
+
+def setup_client(launch_path, args):
+	"""Imports the client and sets it up to run headless, with default settings and its launch directory at `launch_path`."""
+
+	import sc4mpclient
+
+	sc4mpclient.SC4MP_LAUNCHPATH = str(launch_path)
+	sc4mpclient.sc4mp_ui = None
+	sc4mpclient.sc4mp_servers_database = {}
+
+	sc4mpclient.sc4mp_config = {section_name: dict(section_items) for section_name, section_items in sc4mpclient.SC4MP_CONFIG_DEFAULTS}
+	sc4mpclient.sc4mp_config["GENERAL"].update({
+		"custom_plugins": False,
+		"ignore_risky_file_warnings": True,
+		"transfer_compression": not getattr(args, "no_compression", False),
+		"download_streams": getattr(args, "streams", 4),
+	})
+
+	for directory in ["_Cache", "_Database", "_Salvage", "_Temp/ServerList", "Plugins/client", "Plugins/server", "Regions"]:
+		(Path(launch_path) / directory).mkdir(parents=True, exist_ok=True)
+
+	sc4mpclient.sc4mp_cache_index = sc4mpclient.CacheIndex(Path(launch_path) / "_Cache")
+
+	return sc4mpclient
+
+
+def connect(sc4mpclient, address):
+	"""Fetches and authenticates with a server, as the client does before loading it."""
+
+	target = sc4mpclient.Server(*address)
+	target.fetch()
+	target.password = ""
+	target.authenticate()
+
+	return target
+
+
+def load_server(sc4mpclient, target, retries):
+	"""Loads the plugins and regions of a server, retrying failed loads. Returns the number of failures."""
+
+	failures = 0
+
+	while True:
+		try:
+			loader = sc4mpclient.ServerLoader(None, target)
+			loader.load("plugins")
+			loader.load("regions")
+			return failures
+		except Exception as e:
+			failures += 1
+			print(f"[WARNING] Load failed! {e}")
+			if failures > retries:
+				raise
+
+
+def load(args):
+	"""Times loading the plugins and regions of an emulated stand-in server, with an empty cache and then a full one."""
+
+	with tempfile.TemporaryDirectory() as launch_path, StandInServer(args.root, sessions=not args.legacy, compression=not args.no_compression, emulator=get_emulator(args)) as server:
+
+		sc4mpclient = setup_client(launch_path, args)
+		target = connect(sc4mpclient, server.address)
+
+		files = sum(len(file_table) for file_table in server.file_tables.values())
+		size = sum(entry[1] for file_table in server.file_tables.values() for entry in file_table)
+
+		for run in range(args.runs):
+			start = time.perf_counter()
+			failures = load_server(sc4mpclient, target, args.retries)
+			report(f"{'warm' if run else 'cold'} load ({failures} failed)", time.perf_counter() - start, files, size)
+
+		print(f"{server.connections} connections, {server.emulator.drops} dropped, requests: {server.requests}")
+
+
+def save(args):
+	"""Times pushing savegames to an emulated stand-in server."""
+
+	with tempfile.TemporaryDirectory() as launch_path, StandInServer(args.root, sessions=not args.legacy, compression=not args.no_compression, emulator=get_emulator(args)) as server:
+
+		sc4mpclient = setup_client(launch_path, args)
+		target = connect(sc4mpclient, server.address)
+
+		# The savegames to push come from the region loaded from the server
+		load_server(sc4mpclient, target, args.retries)
+		save_city_paths = sorted((Path(launch_path) / "Regions").glob("*/*.sc4"))[:args.cities]
+		if not save_city_paths:
+			raise ValueError(f"No savegames in \"{args.root}\".")
+		size = sum(path.stat().st_size for path in save_city_paths)
+
+		# Skip the constructor, which launches the game
+		monitor = sc4mpclient.GameMonitor.__new__(sc4mpclient.GameMonitor)
+		monitor.server = target
+		monitor.PREFIX = ""
+		monitor.ui = None
+		monitor.overlay_ui = None
+
+		failures = 0
+		start = time.perf_counter()
+		for push in range(args.pushes):
+			try:
+				monitor.push_save(save_city_paths)
+			except Exception as e:
+				failures += 1
+				print(f"[WARNING] Save push failed! {e}")
+		report(f"push ({failures} failed)", time.perf_counter() - start, args.pushes, size * args.pushes)
+
+		print(f"{server.connections} connections, {server.emulator.drops} dropped, requests: {server.requests}")
+
+
+class CrawlState:
+	"""The parts of a `ServerList` used by its `ServerFetcher` threads, without the UI."""
+
+
+	def __init__(self, addresses):
+
+		self.end = False
+		self.pause = False
+
+		self.servers = {}
+		self.unfetched_servers = list(addresses)
+		self.saved_servers = {}
+		self.fetched_servers = []
+		self.tried_servers = []
+
+		self.offline_server_count = 0
+
+		self.server_fetchers = 0
+
+
+def crawl(args):
+	"""Times crawling a mesh of emulated stand-in servers that list each other, as the server list does."""
+
+	rnd = random.Random(args.seed)
+
+	with tempfile.TemporaryDirectory() as launch_path:
+
+		servers = [StandInServer(args.root, sessions=not args.legacy, server_id=f"standin{number}", emulator=get_emulator(args)).start() for number in range(args.servers)]
+
+		try:
+
+			# Each server lists the next one and a few random others, so most are only found by crawling
+			addresses = [server.address for server in servers]
+			for number, server in enumerate(servers):
+				server.server_list = [addresses[(number + 1) % len(addresses)]] + rnd.sample(addresses, min(args.links - 1, len(addresses)))
+
+			sc4mpclient = setup_client(launch_path, args)
+			state = CrawlState(addresses[:1])
+
+			start = time.perf_counter()
+			while state.unfetched_servers or state.server_fetchers > 0:
+				while state.fetched_servers:
+					fetched_server = state.fetched_servers.pop(0)
+					state.servers[fetched_server.server_id] = fetched_server
+				if state.unfetched_servers and state.server_fetchers < args.threads:
+					unfetched_server = state.unfetched_servers.pop(0)
+					if unfetched_server not in state.tried_servers:
+						state.tried_servers.append(unfetched_server)
+						state.server_fetchers += 1
+						sc4mpclient.ServerFetcher(state, sc4mpclient.Server(*unfetched_server)).start()
+				else:
+					time.sleep(.001)
+			seconds = time.perf_counter() - start
+			state.end = True
+
+			while state.fetched_servers:
+				fetched_server = state.fetched_servers.pop(0)
+				state.servers[fetched_server.server_id] = fetched_server
+
+			report(f"crawl ({len(state.tried_servers) - len(state.servers)} failed)", seconds, len(state.tried_servers))
+			requests = {}
+			for server in servers:
+				for command, count in server.requests.items():
+					requests[command] = requests.get(command, 0) + count
+			print(f"{len(state.servers)} of {len(servers)} servers found, {sum(server.connections for server in servers)} connections, {sum(server.emulator.drops for server in servers)} dropped, requests: {requests}")
+
+		finally:
+
+			for server in servers:
+				server.stop()
+
+
+def probe(args):
+	"""Times fetching and pinging a stand-in server many times, on threads and on one event loop."""
+
+	import sc4mpclient
+
+	sc4mpclient.sc4mp_servers_database = {}
+
+	with tempfile.TemporaryDirectory() as root, StandInServer(root, sessions=not args.legacy, emulator=get_emulator(args)) as server:
+
+		addresses = [server.address] * args.probes
+
+		# Threads, as the server list does
+		def fetch(address):
+			target = sc4mpclient.Server(*address)
+			try:
+				target.fetch()
+				return target.ping() is not None
+			finally:
+				if target.sessions is not None:
+					target.sessions.close()
+
+		start = time.perf_counter()
+		with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+			successes = sum(executor.map(fetch, addresses))
+		report(f"threads ({args.probes - successes} failed)", time.perf_counter() - start, args.probes)
+
+		# One event loop
+		start = time.perf_counter()
+		results = asyncio.run(sc4mpclient.probe_servers(addresses, concurrency=args.concurrency))
+		failures = sum(1 for target, error in results if error is not None)
+		report(f"asyncio ({failures} failed)", time.perf_counter() - start, args.probes)
+
+		print(f"{server.connections} connections, requests: {server.requests}")
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Generates synthetic SimCity 4 data and benchmarks the client against it.")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+
+	parser_corpus = subparsers.add_parser("corpus", help="generate synthetic plugins and savegames")
+	parser_corpus.add_argument("output", help="directory to write the `Plugins` and `Regions` folders to")
+	parser_corpus.add_argument("--plugins", type=int, default=10, help="number of plugin archives")
+	parser_corpus.add_argument("--savegames", type=int, default=16, help="number of savegames")
+	parser_corpus.add_argument("--entries", type=int, default=1000, help="number of random subfiles per archive")
+	parser_corpus.add_argument("--size", type=int, default=4096, help="mean subfile size in bytes (exponentially distributed)")
+	parser_corpus.add_argument("--ratio", type=float, default=0.5, help="approximate compressed to uncompressed size ratio of the subfiles")
+	parser_corpus.add_argument("--compressed", type=float, default=0.5, help="fraction of the subfiles to compress")
+	parser_corpus.add_argument("--instance2", action="store_true", help="write v7.1 indexes (with a second instance ID)")
+	parser_corpus.add_argument("--mayors", type=int, default=8, help="number of mayors in the region database")
+	parser_corpus.add_argument("--claimed", type=float, default=0.75, help="fraction of the city tiles claimed in the region database")
+	parser_corpus.add_argument("--seed", type=int, default=0, help="random seed")
+	parser_corpus.set_defaults(function=corpus)
+
+	parser_dbpf = subparsers.add_parser("dbpf", help="time index parsing, decompression and savegame scanning")
+	parser_dbpf.add_argument("paths", nargs="+", help="archives, or directories to search recursively")
+	parser_dbpf.add_argument("--memory-map", action="store_true", help="memory-map the archives")
+	parser_dbpf.add_argument("--compress", action="store_true", help="also time QFS compression of every subfile")
+	parser_dbpf.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes for the savegame scan")
+	parser_dbpf.set_defaults(function=dbpf)
+
+	parser_probe = subparsers.add_parser("probe", help="time server probes (info and ping) against a local stand-in server, on threads and with asyncio")
+	parser_probe.add_argument("--probes", type=int, default=1000, help="number of probes")
+	parser_probe.add_argument("--threads", type=int, default=25, help="number of threads for the threaded path (the server list uses 25)")
+	parser_probe.add_argument("--concurrency", type=int, default=1000, help="maximum concurrent probes for the asyncio path")
+	parser_probe.add_argument("--legacy", action="store_true", help="make the stand-in server speak only the legacy protocol")
+	add_emulator_arguments(parser_probe)
+	parser_probe.set_defaults(function=probe)
+
+	parser_load = subparsers.add_parser("load", help="time loading the plugins and regions of a local stand-in server")
+	parser_load.add_argument("root", help="directory with the `Plugins` and `Regions` folders to serve (eg. one written by the `corpus` command)")
+	parser_load.add_argument("--runs", type=int, default=2, help="number of loads, the first one with an empty cache")
+	parser_load.add_argument("--streams", type=int, default=4, help="number of parallel download streams")
+	parser_load.add_argument("--retries", type=int, default=10, help="number of times to retry a failed load")
+	parser_load.add_argument("--legacy", action="store_true", help="make the stand-in server speak only the legacy protocol")
+	parser_load.add_argument("--no-compression", action="store_true", help="disable transfer compression")
+	add_emulator_arguments(parser_load)
+	parser_load.set_defaults(function=load)
+
+	parser_save = subparsers.add_parser("save", help="time pushing savegames to a local stand-in server")
+	parser_save.add_argument("root", help="directory with the `Plugins` and `Regions` folders to serve (eg. one written by the `corpus` command)")
+	parser_save.add_argument("--pushes", type=int, default=10, help="number of save pushes")
+	parser_save.add_argument("--cities", type=int, default=1, help="number of savegames in each push")
+	parser_save.add_argument("--retries", type=int, default=10, help="number of times to retry a failed load")
+	parser_save.add_argument("--legacy", action="store_true", help="make the stand-in server speak only the legacy protocol")
+	parser_save.add_argument("--no-compression", action="store_true", help="disable transfer compression")
+	add_emulator_arguments(parser_save)
+	parser_save.set_defaults(function=save)
+
+	parser_crawl = subparsers.add_parser("crawl", help="time crawling a mesh of local stand-in servers, as the server list does")
+	parser_crawl.add_argument("root", help="directory with the `Plugins` and `Regions` folders to serve (eg. one written by the `corpus` command)")
+	parser_crawl.add_argument("--servers", type=int, default=50, help="number of stand-in servers")
+	parser_crawl.add_argument("--links", type=int, default=3, help="number of other servers on each server's list")
+	parser_crawl.add_argument("--threads", type=int, default=25, help="maximum concurrent server fetchers (the server list uses 25)")
+	parser_crawl.add_argument("--legacy", action="store_true", help="make the stand-in servers speak only the legacy protocol")
+	add_emulator_arguments(parser_crawl)
+	parser_crawl.set_defaults(function=crawl)
+
+	args = parser.parse_args()
+	args.function(args)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,181 +1,513 @@
+import array
+import concurrent.futures
 import io
+import json
+import mmap
+import os
 import struct
+import sys
+import threading
+import time
 
 
-class DBPF:
-	"""TODO include credits to original php file"""
+DBPF_HEADER_FORMAT = "<4s2L12s10L32s"
+DBPF_HEADER_SIZE = struct.calcsize(DBPF_HEADER_FORMAT)
 
+UINT32_TYPECODE = "I" if array.array("I").itemsize == 4 else "L"
 
-	def __init__(self, filename, offset=0, error_callback=None, require_identifier=True):
-		"""TODO"""
+DBPF_DIRECTORY_TYPE_ID = 0xE86B1EEF
+DBPF_DIRECTORY_GROUP_ID = 0xE86B1EEF
+DBPF_DIRECTORY_INSTANCE_ID = 0x286B1F03
 
-		print(f'Parsing "{filename}"...')
+DBPF_READ_AHEAD_SIZE = 16 * 1024 * 1024
 
-		self.filename = filename
-		self.offset = offset
-		self.show_error = error_callback
-		self.require_identifier = require_identifier
+QFS_MAX_OFFSET = 131072
+QFS_MAX_COPY = 1028
 
-		self.NONSENSE_BYTE_OFFSET = 9
+SC4SAVEGAME_CACHE_VERSION = 1
 
-		# Open file to read bytes
-		self.file = open(self.filename, 'rb')
 
-		# Advance to offset
-		if self.offset > 0:
-			self.file.seek(self.offset)
+class QFSError(Exception):
+	"""Raised when a QFS stream is malformed. Holds the output decoded before the error."""
 
-		# Read the identifier
-		self.identifier = self.file.read(4).decode()		# Always "DBPF"
-		if self.require_identifier and self.identifier != "DBPF":
-			raise Exception()
 
-		# Read the header
-		self.majorVersion = self.read_UL4()					# Always 1
-		self.minorVersion = self.read_UL4()					# Always 0
-		self.reserved = self.file.read(12)
-		self.dateCreated = self.read_UL4()
-		self.dateModified = self.read_UL4()
-		self.indexMajorVersion = self.read_UL4()
-		self.indexCount = self.read_UL4()
-		self.indexOffset = self.read_UL4()
-		self.indexSize = self.read_UL4()
-		self.holesCount = self.read_UL4()
-		self.holesOffset = self.read_UL4()
-		self.holesSize = self.read_UL4()
-		self.indexMinorVersion = self.read_UL4() - 1
-		self.reserved2 = self.file.read(32)
-		self.header_end = self.file.tell()
-
-		# Seek to index table
-		self.file.seek(offset + self.indexOffset)
-
-		# Read index table
-		self.indexData = []
-		for index in range(0, self.indexCount):
-			self.indexData.append({})
-			self.indexData[index]['typeID'] = self.read_ID()
-			self.indexData[index]['groupID'] = self.read_ID()
-			self.indexData[index]['instanceID'] = self.read_ID()
-			if (self.indexMajorVersion == 7) and (self.indexMinorVersion == 1):
-				self.indexData[index]['instanceID2'] = self.read_ID()
-			self.indexData[index]['offset'] = self.read_UL4()
-			self.indexData[index]['filesize'] = self.read_UL4()
-			#self.indexData[index]['compressed'] = #TODO
-			#self.indexData[index]['truesize'] = #TODO
+	def __init__(self, message, partial=b"", remaining=0):
 
-		#print(f"DBPF v{self.majorVersion}.{self.minorVersion}")
+		super().__init__(message)
 
-	
-	def close(self):
+		self.partial = partial
+		self.remaining = remaining
 
-		self.file.close()
 
+def qfs_decompress(data):
+	"""
+	Decompresses a QFS-compressed DBPF subfile.
 
-	def decompress(self, length):
+	The subfile starts with its compressed size (4 bytes), followed by the QFS 
+	header: a flags byte, the `0xFB` magic byte and the uncompressed size 
+	(3 bytes big-endian, or 4 bytes if the `0x80` flag is set). The output is 
+	decoded into a preallocated `bytearray` of the declared size, and 
+	back-references are copied as slices.
+	"""
 
-		buf = ""			# TODO what does this do?
-		answer = bytes()	# TODO what does this do?
-		answerlen = 0		# TODO what does this do?
-		numplain = ""		# TODO what does this do?
-		numcopy = ""		# TODO what does this do?
-		offset = ""			# TODO what does this do?
+	length = len(data)
 
-		try:
+	# Read the QFS header
+	if length < 9 or data[5] != 0xFB:
+		raise QFSError("Invalid QFS header.", remaining=length)
+	flags = data[4]
+	if flags & 0x80:
+		size = int.from_bytes(data[6:10], "big")
+		position = 10
+	else:
+		size = int.from_bytes(data[6:9], "big")
+		position = 9
+	if flags & 0x01:
+		position += 4 if flags & 0x80 else 3
+
+	# Preallocate the output (the memoryview prevents the bytearray from being resized by mismatched slice assignments)
+	answer = bytearray(size)
+	view = memoryview(answer)
+	answerlen = 0
+
+	try:
+
+		while position < length:
+
+			# Read control char
+			cc = data[position]
+
+			if cc >= 252:	#0xFC
 
-			# Read until there's nothing left to read
-			while length > 0:
-				
-				# Read control char
-				cc = self.read_UL1(self.file) #TODO Line causes errors on older versions of DBPF but doesn't seem to affect anything. Always fails with 9 bytes remaining.
-				length -= 1
+				numplain = cc & 3										#3 = 0x03
+				numcopy = 0
+				offset = 0
 
-				# For development
-				#print(f"Control char is {cc}, length remaining is {length}.")
+				position += 1
 
-				if cc >= 252:	#0xFC
+			elif cc >= 224:	#0xE0
 
-					numplain = cc & 3										#3 = 0x03
-					numplain = length if numplain > length else numplain
-					
-					numcopy = 0
-					offset = 0
+				numplain = (cc - 223) << 2								#223 = 0xdf
+				numcopy = 0
+				offset = 0
 
-				elif cc >= 224:	#0xE0
+				position += 1
 
-					numplain = (cc - 223) << 2								#223 = 0xdf
+			elif cc >= 192:	#0xC0
 
-					numcopy = 0
-					offset = 0
+				byte1 = data[position + 1]
+				byte2 = data[position + 2]
+				byte3 = data[position + 3]
 
-				elif cc >= 192:	#0xC0
+				numplain = cc & 3										#3 = 0x03
+				numcopy = ((cc & 12) << 6) + 5 + byte3 					#12 = 0x0c
+				offset = ((cc & 16) << 12) + (byte1 << 8) + byte2 		#16 = 0x10
 
-					length -= 3
+				position += 4
 
-					byte1 = self.read_UL1(self.file)
-					byte2 = self.read_UL1(self.file)
-					byte3 = self.read_UL1(self.file)
+			elif cc >= 128: #0x80
 
-					numplain = cc & 3										#3 = 0x03
-					
-					numcopy = ((cc & 12) << 6) + 5 + byte3 					#12 = 0x0c
-					offset = ((cc & 16) << 12) + (byte1 << 8) + byte2 		#16 = 0x10
+				byte1 = data[position + 1]
+				byte2 = data[position + 2]
 
-				elif cc >= 128: #0x80
+				numplain = (byte1 & 192) >> 6 							#192 = 0xc0
+				numcopy = (cc & 63) + 4 								#63 = 0x3f
+				offset = ((byte1 & 63) << 8) + byte2 					#63 = 0x3f
 
-					length -= 2
+				position += 3
 
-					byte1 = self.read_UL1(self.file)
-					byte2 = self.read_UL1(self.file)
+			else:
+
+				byte1 = data[position + 1]
 
-					numplain = (byte1 & 192) >> 6 							#192 = 0xc0
+				numplain = cc & 3 										#3 = 0x03
+				numcopy = ((cc & 28) >> 2) + 3 							#28 = 0x1c
+				offset = ((cc & 96) << 3) + byte1 						#96 = 0x60
 
-					numcopy = (cc & 63) + 4 								#63 = 0x3f
-					offset = ((byte1 & 63) << 8) + byte2 					#63 = 0x3f
+				position += 2
+
+			# Copy the plain bytes
+			if numplain > 0:
+				view[answerlen:answerlen + numplain] = data[position:position + numplain]
+				position += numplain
+				answerlen += numplain
 
+			# Copy the back-reference (`offset` 0 is the last byte written)
+			if numcopy > 0:
+				fromoffset = answerlen - (offset + 1)
+				if fromoffset < 0:
+					raise ValueError("Back-reference before the start of the output.")
+				if offset + 1 >= numcopy:
+					view[answerlen:answerlen + numcopy] = view[fromoffset:fromoffset + numcopy]
 				else:
+					# Overlapping copies repeat the last `offset + 1` bytes
+					pattern = bytes(view[fromoffset:answerlen])
+					view[answerlen:answerlen + numcopy] = (pattern * (numcopy // len(pattern) + 1))[:numcopy]
+				answerlen += numcopy
 
-					length -= 1
+			# Stop control chars end the stream
+			if cc >= 252 or answerlen >= size:
+				break
+
+	except (IndexError, ValueError) as e:
+
+		view.release()
+		raise QFSError(str(e), partial=answer[:answerlen], remaining=length - position) from e
+
+	view.release()
+
+	if answerlen < size:
+		raise QFSError("Unexpected end of QFS stream.", partial=answer[:answerlen], remaining=length - position)
+
+	return answer
+
+
+def qfs_compress(data, window=QFS_MAX_OFFSET, max_chain=16):
+	"""
+	Compresses data to a QFS-compressed DBPF subfile readable by 
+	`qfs_decompress`.
+
+	Uses greedy LZ77 matching over a hash table of 4-byte prefixes, keeping 
+	up to `max_chain` candidate positions per prefix within `window` bytes.
+	"""
+
+	data = bytes(data)
+	length = len(data)
+
+	output = bytearray()
+	chains = {}
+
+	literal_start = 0
+	position = 0
+
+	def flush_literals(end, keep):
+		"""Writes the pending literals up to `end` in blocks of 4, leaving `keep` or less for the next control char."""
+		nonlocal literal_start
+		while end - literal_start > keep:
+			count = min(112, (end - literal_start) & ~3)
+			output.append(0xE0 + (count >> 2) - 1)
+			output.extend(data[literal_start:literal_start + count])
+			literal_start += count
+
+	while position + 4 <= length:
+
+		# Find the longest match among the previous positions with the same prefix
+		key = data[position:position + 4]
+		candidates = chains.get(key)
+		best_length = 0
+		best_offset = 0
+		if candidates:
+			for candidate in reversed(candidates):
+				offset = position - candidate
+				if offset > window:
+					break
+				maximum = min(QFS_MAX_COPY, length - position)
+				if best_length >= maximum or data[candidate:candidate + best_length + 1] != data[position:position + best_length + 1]:
+					continue
+				# Binary search for the match length (slices compare in C)
+				low, high = best_length + 1, maximum
+				while low < high:
+					middle = (low + high + 1) >> 1
+					if data[candidate:candidate + middle] == data[position:position + middle]:
+						low = middle
+					else:
+						high = middle - 1
+				best_length = low
+				best_offset = offset
+				if best_length >= maximum:
+					break
+
+		# Skip matches too short for their offset
+		offset = best_offset - 1
+		if best_length < 3 or (offset >= 1024 and best_length < 4) or (offset >= 16384 and best_length < 5):
+			best_length = 0
+
+		# Remember this position
+		if candidates is None:
+			chains[key] = [position]
+		else:
+			candidates.append(position)
+			if len(candidates) > max_chain:
+				del candidates[0]
+
+		if best_length == 0:
+			position += 1
+			continue
+
+		# Write the literals, then the back-reference with the last 0 to 3 literals
+		flush_literals(position, 3)
+		numplain = position - literal_start
+		if best_length <= 10 and offset < 1024:
+			output.append(((offset >> 3) & 0x60) | ((best_length - 3) << 2) | numplain)
+			output.append(offset & 0xFF)
+		elif best_length <= 67 and offset < 16384:
+			output.append(0x80 | (best_length - 4))
+			output.append((numplain << 6) | (offset >> 8))
+			output.append(offset & 0xFF)
+		else:
+			output.append(0xC0 | ((offset >> 12) & 0x10) | (((best_length - 5) >> 6) & 0x0C) | numplain)
+			output.append((offset >> 8) & 0xFF)
+			output.append(offset & 0xFF)
+			output.append((best_length - 5) & 0xFF)
+		output.extend(data[literal_start:position])
+
+		# Index the copied positions too, so later data can refer to them
+		for copied in range(position + 1, min(position + best_length, length - 3)):
+			key = data[copied:copied + 4]
+			candidates = chains.get(key)
+			if candidates is None:
+				chains[key] = [copied]
+			else:
+				candidates.append(copied)
+				if len(candidates) > max_chain:
+					del candidates[0]
 
-					byte1 = self.read_UL1(self.file)
+		position += best_length
+		literal_start = position
 
-					numplain = cc & 3 										#3 = 0x03
+	# Write the remaining literals and the stop control char
+	flush_literals(length, 3)
+	output.append(0xFC | (length - literal_start))
+	output.extend(data[literal_start:])
 
-					numcopy = ((cc & 28) >> 2) + 3 							#28 = 0x1c
-					offset = ((cc & 96) << 3) + byte1 						#96 = 0x60
+	# Write the header
+	if length < 1 << 24:
+		header = b"\x10\xFB" + length.to_bytes(3, "big")
+	else:
+		header = b"\x90\xFB" + length.to_bytes(4, "big")
 
-				length -= numplain
+	return struct.pack("<L", 4 + len(header) + len(output)) + header + output
 
-				# This section basically copies the parts of the string to the end of the buffer:
-				if numplain > 0:
 
-					buf = self.file.read(numplain)
+def qfs_uncompressed_size(data):
+	"""Returns the uncompressed size stored in the header of a QFS-compressed subfile."""
 
-					answer += buf
+	if data[4] & 0x80:
+		return int.from_bytes(data[6:10], "big")
+	else:
+		return int.from_bytes(data[6:9], "big")
 
-				fromoffset = len(answer) - (offset + 1)  # 0 == last char
-				for index in range(numcopy):
 
-					#print(str(answer))
-					#print(str(cc))
-					#print(str(offset))
-					#print(str(fromoffset))
-					
-					#TODO remove try and except block. decompression algorithm breaks with a control char of 206. the offset becomes larger than the length of the answer, causing a negative fromindex and an indexing error. for now it does not seem to affect city coordinates
-					try:
-						answer = answer + (answer[fromoffset + index]).to_bytes(1, 'little') #substr(fromoffset + index, 1)
-					except Exception as e:
-						#show_error(e) #TODO
-						return io.BytesIO(answer)
-					
-				answerlen += numplain
-				answerlen += numcopy
+class DBPFIndex:
+	"""
+	The index table of a DBPF archive, stored as compact integer columns.
+
+	The table is decoded in one step, and hash lookups by TGI and by type 
+	are built the first time they are needed.
+	"""
+
+
+	def __init__(self, data, count, instance2=False):
+
+		fields = 6 if instance2 else 5
+
+		# Decode the whole table at once, then split it into columns
+		table = array.array(UINT32_TYPECODE)
+		table.frombytes(data[:len(data) - len(data) % 4])
+		if sys.byteorder == "big":
+			table.byteswap()
+		count = min(count, len(table) // fields)
+		del table[count * fields:]
+
+		self.count = count
+		self.instance2 = instance2
+
+		self.type_ids = table[0::fields]
+		self.group_ids = table[1::fields]
+		self.instance_ids = table[2::fields]
+		self.instance_ids2 = table[3::fields] if instance2 else None
+		self.offsets = table[fields - 2::fields]
+		self.sizes = table[fields - 1::fields]
+
+		# Set from the directory record by `load_directory` (`None` if the archive has no directory record)
+		self.compressed = None
+		self.truesizes = None
+
+		self._tgi_lookup = None
+		self._type_lookup = None
+
+
+	def load_directory(self, data):
+		"""Reads the directory record, which lists the compressed entries and their uncompressed sizes."""
+
+		fields = 5 if self.instance2 else 4
+
+		table = array.array(UINT32_TYPECODE)
+		table.frombytes(data[:len(data) - len(data) % (4 * fields)])
+		if sys.byteorder == "big":
+			table.byteswap()
+
+		self.compressed = bytearray(self.count)
+		self.truesizes = array.array(UINT32_TYPECODE, self.sizes)
 
+		for record in range(0, len(table), fields):
+			number = self.find(table[record], table[record + 1], table[record + 2])
+			if number is not None:
+				self.compressed[number] = 1
+				self.truesizes[number] = table[record + fields - 1]
+
+
+	@staticmethod
+	def entry_size(instance2=False):
+		"""Returns the size in bytes of an index entry."""
+		return 24 if instance2 else 20
+
+
+	def find(self, type_id, group_id, instance_id):
+		"""Returns the number of the first entry with the given TGI, or `None`."""
+		if self._tgi_lookup is None:
+			keys = zip(reversed(self.type_ids), reversed(self.group_ids), reversed(self.instance_ids))
+			self._tgi_lookup = dict(zip(keys, range(self.count - 1, -1, -1)))
+		return self._tgi_lookup.get((type_id, group_id, instance_id))
+
+
+	def find_type(self, type_id):
+		"""Returns the number of the first entry with the given type, or `None`."""
+		if self._type_lookup is None:
+			self._type_lookup = dict(zip(reversed(self.type_ids), range(self.count - 1, -1, -1)))
+		return self._type_lookup.get(type_id)
+
+
+	def get_entry(self, number):
+		"""Returns an entry as a dictionary with hex string IDs."""
+
+		entry = {
+			'typeID': f"{self.type_ids[number]:08x}",
+			'groupID': f"{self.group_ids[number]:08x}",
+			'instanceID': f"{self.instance_ids[number]:08x}",
+		}
+		if self.instance2:
+			entry['instanceID2'] = f"{self.instance_ids2[number]:08x}"
+		entry['offset'] = self.offsets[number]
+		entry['filesize'] = self.sizes[number]
+		if self.compressed is not None:
+			entry['compressed'] = bool(self.compressed[number])
+			entry['truesize'] = self.truesizes[number]
+
+		return entry
+
+
+class DBPF:
+	"""TODO include credits to original php file"""
+
+
+	def __init__(self, filename, offset=0, error_callback=None, require_identifier=True, memory_map=False, verbose=True):
+		"""TODO"""
+
+		if verbose:
+			print(f'Parsing "{filename}"...')
+
+		self.filename = filename
+		self.offset = offset
+		self.show_error = error_callback
+		self.require_identifier = require_identifier
+
+		# Open file to read bytes
+		self.file = open(self.filename, 'rb')
+
+		# Map the file into memory if requested, so fields and subfiles can be read without copying
+		self.map = None
+		self.view = None
+		if memory_map:
+			try:
+				self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+			except Exception:
+				self.file.close()
+				raise
+			self.view = memoryview(self.map)
+
+		# Read the header (closing the file if it is too short)
+		try:
+			(
+				identifier,
+				self.majorVersion,									# Always 1
+				self.minorVersion,									# Always 0
+				self.reserved,
+				self.dateCreated,
+				self.dateModified,
+				self.indexMajorVersion,
+				self.indexCount,
+				self.indexOffset,
+				self.indexSize,
+				self.holesCount,
+				self.holesOffset,
+				self.holesSize,
+				indexMinorVersion,
+				self.reserved2,
+			) = struct.unpack_from(DBPF_HEADER_FORMAT, self.read_bytes(self.offset, DBPF_HEADER_SIZE))
 		except Exception:
+			self.close()
+			raise
+		self.indexMinorVersion = indexMinorVersion - 1
+		self.header_end = self.offset + DBPF_HEADER_SIZE
 
-			self.show_error(f"An error occurred while decompressing \"{self.filename}\" with {length} bytes remaining.")
+		# Check the identifier
+		self.identifier = identifier.decode(errors="replace")	# Always "DBPF"
+		if self.require_identifier and self.identifier != "DBPF":
+			self.close()
+			raise Exception()
+
+		# The index table is read the first time it is needed
+		self._index = None
+		self._indexData = None
+
+		#print(f"DBPF v{self.majorVersion}.{self.minorVersion}")
+
+
+	def __enter__(self):
+
+		return self
 
-		return io.BytesIO(answer)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+
+		self.close()
+
+	
+	def close(self):
+
+		# Release the memory map (slices still held by the caller keep it alive until they are garbage collected)
+		if self.map is not None:
+			self.view.release()
+			try:
+				self.map.close()
+			except BufferError:
+				pass
+
+		self.file.close()
+
+
+	def read_bytes(self, offset, size):
+		"""Returns `size` bytes starting at `offset`. In memory-mapped mode, this is a zero-copy `memoryview` slice of the file."""
+
+		if self.view is not None:
+			return self.view[offset:offset + size]
+		
+		self.file.seek(offset)
+		return self.file.read(size)
+
+
+	def decompress(self, length):
+		"""Decompresses the QFS-compressed subfile of the given length starting at the current file position."""
+
+		return self.decompress_bytes(self.file.read(length))
+
+
+	def decompress_bytes(self, data):
+		"""Decompresses a QFS-compressed subfile held in memory."""
+
+		return io.BytesIO(self.decompress_buffer(data))
+
+
+	def decompress_buffer(self, data):
+		"""Decompresses a QFS-compressed subfile held in memory to a `bytearray`. On errors, returns the data decoded up to the error."""
+
+		try:
+			return qfs_decompress(data)
+		except QFSError as e:
+			if self.show_error is not None:
+				self.show_error(f"An error occurred while decompressing \"{self.filename}\" with {e.remaining} bytes remaining.")
+			return e.partial
 
 
 	def read_UL1(self, file=None):
@@ -232,11 +564,32 @@ class DBPF:
 		return file.read(4)[::-1].hex()
 
 
+	@property
+	def index(self):
+		"""The index table as a `DBPFIndex`. Read on first use."""
+		if self._index is None:
+			instance2 = (self.indexMajorVersion == 7) and (self.indexMinorVersion == 1)
+			entry_size = DBPFIndex.entry_size(instance2)
+			self._index = DBPFIndex(self.read_bytes(self.offset + self.indexOffset, self.indexCount * entry_size), self.indexCount, instance2)
+			directory = self._index.find_type(DBPF_DIRECTORY_TYPE_ID)
+			if directory is not None:
+				self._index.load_directory(self.read_bytes(self._index.offsets[directory], self._index.sizes[directory]))
+		return self._index
+
+
+	@property
+	def indexData(self):
+		"""The index table as a list of dictionaries with hex string IDs. Built on first use."""
+		if self._indexData is None:
+			self._indexData = [self.index.get_entry(number) for number in range(self.index.count)]
+		return self._indexData
+
+
 	def get_indexData_entry_by_type_ID(self, type_id):
 		"""TODO"""
-		for entry in self.indexData:
-			if entry['typeID'] == type_id:
-				return entry
+		number = self.index.find_type(int(type_id, 16))
+		if number is not None:
+			return self.index.get_entry(number)
 
 
 	def goto_subfile(self, type_id):
@@ -259,12 +612,233 @@ class DBPF:
 		pass
 
 
-	def decompress_subfile(self, type_id):
-		"""TODO"""
+	def decompress_subfile(self, type_id, group_id=None, instance_id=None):
+		"""Returns the contents of a subfile as a bytes stream, decompressing it only if it is compressed."""
 		#print('Decompressing "' + type_id + '"...')
-		self.goto_subfile(type_id)
-		self.file.read(self.NONSENSE_BYTE_OFFSET)
-		return self.decompress(self.get_subfile_size(type_id))
+		number = self.find_subfile(type_id, group_id, instance_id)
+		data = self.read_bytes(self.index.offsets[number], self.index.sizes[number])
+		if self.is_compressed(number):
+			return self.decompress_bytes(data)
+		else:
+			return io.BytesIO(data)
+
+
+	def get_subfile(self, type_id, group_id=None, instance_id=None):
+		"""Returns the raw bytes of a subfile. In memory-mapped mode, this is a zero-copy `memoryview` slice."""
+		number = self.find_subfile(type_id, group_id, instance_id)
+		return self.read_bytes(self.index.offsets[number], self.index.sizes[number])
+
+
+	def find_subfile(self, type_id, group_id=None, instance_id=None):
+		"""Returns the number of the index entry for a subfile, matching the type only unless the group and instance are given."""
+		if group_id is None or instance_id is None:
+			number = self.index.find_type(int(type_id, 16))
+		else:
+			number = self.index.find(int(type_id, 16), int(group_id, 16), int(instance_id, 16))
+		if number is None:
+			raise KeyError(f"Subfile {type_id} not found in \"{self.filename}\".")
+		return number
+
+
+	def iter_subfiles(self, type_id=None, decompress=True, max_resident_bytes=DBPF_READ_AHEAD_SIZE):
+		"""
+		Yields `((typeID, groupID, instanceID), data)` for each subfile in file 
+		offset order, optionally only those of the given type. `data` is a 
+		`memoryview`, decompressed unless `decompress` is `False`.
+
+		Subfiles stored next to each other are read together, holding at most 
+		`max_resident_bytes` of raw data at a time (a single subfile larger 
+		than that is read on its own). In memory-mapped mode, the raw data are 
+		slices of the map and nothing is read ahead.
+		"""
+
+		index = self.index
+
+		# Pick the entries and sort them by offset
+		numbers = range(index.count)
+		if type_id is not None:
+			type_id = int(type_id, 16)
+			numbers = [number for number in numbers if index.type_ids[number] == type_id]
+		numbers = sorted(numbers, key=index.offsets.__getitem__)
+
+		position = 0
+		while position < len(numbers):
+
+			# Group the following entries that fit in the read-ahead window
+			start = index.offsets[numbers[position]]
+			end = start + index.sizes[numbers[position]]
+			last = position + 1
+			if self.view is None:
+				while last < len(numbers):
+					entry_end = index.offsets[numbers[last]] + index.sizes[numbers[last]]
+					if max(end, entry_end) - start > max_resident_bytes:
+						break
+					end = max(end, entry_end)
+					last += 1
+			else:
+				last = len(numbers)
+
+			# Read the window (or map the whole file)
+			if self.view is None:
+				window = memoryview(self.read_bytes(start, end - start))
+			else:
+				window = self.view
+				start = 0
+
+			# Yield the subfiles in the window
+			for number in numbers[position:last]:
+				offset = index.offsets[number] - start
+				data = window[offset:offset + index.sizes[number]]
+				if decompress and self.is_compressed(number):
+					data = memoryview(self.decompress_buffer(data))
+				tgi = (f"{index.type_ids[number]:08x}", f"{index.group_ids[number]:08x}", f"{index.instance_ids[number]:08x}")
+				yield tgi, data
+				del data
+
+			del window
+			position = last
+
+
+	def is_compressed(self, number):
+		"""Checks if a subfile is compressed using the directory record, or if there is none, by looking for the QFS magic byte."""
+		if self.index.compressed is not None:
+			return bool(self.index.compressed[number])
+		header = self.read_bytes(self.index.offsets[number] + 4, 2)
+		return len(header) == 2 and header[1] == 0xFB
+
+
+class DBPFWriter:
+	"""
+	Writes a DBPF archive with a v7.0 index (or v7.1 if `instance2` is set), 
+	and a directory record listing the compressed subfiles.
+
+	Subfiles are written to disk as they are added, and the index and header 
+	are written by `close`.
+	"""
+
+
+	def __init__(self, filename, instance2=False, date=None):
+
+		self.filename = filename
+		self.instance2 = instance2
+		self.date = int(time.time()) if date is None else date
+
+		self.entries = []
+		self.directory = []
+
+		# Leave room for the header
+		self.file = open(self.filename, "wb")
+		self.file.write(bytes(DBPF_HEADER_SIZE))
+
+
+	def __enter__(self):
+
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+
+		self.close()
+
+
+	def add(self, type_id, group_id, instance_id, data, compress=False, instance_id2=0):
+		"""Adds a subfile, QFS-compressing it if `compress` is set. IDs are integers or hex strings."""
+
+		if compress:
+			self.add_raw(type_id, group_id, instance_id, qfs_compress(data), truesize=len(data), instance_id2=instance_id2)
+		else:
+			self.add_raw(type_id, group_id, instance_id, data, instance_id2=instance_id2)
+
+
+	def add_raw(self, type_id, group_id, instance_id, data, truesize=None, instance_id2=0):
+		"""Adds a subfile as it is. If `truesize` is given, the data are already QFS-compressed and listed in the directory record."""
+
+		tgi = tuple(int(id, 16) if isinstance(id, str) else id for id in (type_id, group_id, instance_id, instance_id2))
+
+		offset = self.file.tell()
+		self.file.write(data)
+
+		self.entries.append(tgi + (offset, len(data)))
+		if truesize is not None:
+			self.directory.append(tgi + (truesize,))
+
+
+	def add_subfiles(self, dbpf, type_id=None):
+		"""Copies the subfiles of a `DBPF` archive (optionally only those of the given type) without decompressing them."""
+
+		index = dbpf.index
+
+		numbers = range(index.count)
+		if type_id is not None:
+			type_id = int(type_id, 16)
+			numbers = [number for number in numbers if index.type_ids[number] == type_id]
+
+		for number in sorted(numbers, key=index.offsets.__getitem__):
+
+			# The directory record is rebuilt on close
+			if index.type_ids[number] == DBPF_DIRECTORY_TYPE_ID:
+				continue
+
+			data = dbpf.read_bytes(index.offsets[number], index.sizes[number])
+
+			truesize = None
+			if dbpf.is_compressed(number):
+				truesize = index.truesizes[number] if index.truesizes is not None else qfs_uncompressed_size(data)
+
+			instance_id2 = index.instance_ids2[number] if index.instance2 else 0
+
+			self.add_raw(index.type_ids[number], index.group_ids[number], index.instance_ids[number], data, truesize=truesize, instance_id2=instance_id2)
+
+
+	def close(self):
+		"""Writes the directory record, the index and the header, then closes the file."""
+
+		if self.file is None:
+			return
+
+		try:
+
+			# Write the directory record
+			if self.directory:
+				if self.instance2:
+					data = b"".join(struct.pack("<5L", *record) for record in self.directory)
+				else:
+					data = b"".join(struct.pack("<4L", type_id, group_id, instance_id, truesize) for type_id, group_id, instance_id, instance_id2, truesize in self.directory)
+				self.add_raw(DBPF_DIRECTORY_TYPE_ID, DBPF_DIRECTORY_GROUP_ID, DBPF_DIRECTORY_INSTANCE_ID, data)
+
+			# Write the index
+			index_offset = self.file.tell()
+			for type_id, group_id, instance_id, instance_id2, offset, size in self.entries:
+				if self.instance2:
+					self.file.write(struct.pack("<6L", type_id, group_id, instance_id, instance_id2, offset, size))
+				else:
+					self.file.write(struct.pack("<5L", type_id, group_id, instance_id, offset, size))
+			index_size = self.file.tell() - index_offset
+
+			# Write the header (the index minor version is stored plus one, as in the game's own v7.1 archives)
+			self.file.seek(0)
+			self.file.write(struct.pack(
+				DBPF_HEADER_FORMAT,
+				b"DBPF",
+				1,
+				0,
+				bytes(12),
+				self.date,
+				self.date,
+				7,
+				len(self.entries),
+				index_offset,
+				index_size,
+				0,
+				0,
+				0,
+				2 if self.instance2 else 0,
+				bytes(32),
+			))
+
+		finally:
+			self.file.close()
+			self.file = None
 
 
 class SC4Config(DBPF):
@@ -277,20 +851,45 @@ class SC4Config(DBPF):
 	
 	def get_simcity_4_cfg(self):
 
-		data = self.decompress_subfile("a9dd6e06")
+		data = self.decompress_subfile("a9dd6e06").getvalue()
 
 		self.simcity_4_cfg = {}
 
-		data.seek(110)														# 0x06E
-		self.simcity_4_cfg["LastCityName"] = self.read_nullstring(data)
+		self.simcity_4_cfg["LastCityName"] = unpack_nullstring(data, 110)		# 0x06E
+		self.simcity_4_cfg["LastMayorName"] = unpack_nullstring(data, 622)		# 0x26E
+		self.simcity_4_cfg["LastRegionName"] = unpack_nullstring(data, 3774)		# 0xEBE
 
-		data.seek(622)														# 0x26E
-		self.simcity_4_cfg["LastMayorName"] = self.read_nullstring(data)
+		return self.simcity_4_cfg
 
-		data.seek(3774)														# 0xEBE
-		self.simcity_4_cfg["LastRegionName"] = self.read_nullstring(data)
 
-		return self.simcity_4_cfg
+class SC4ConfigCache:
+	"""Keeps the values last parsed from a `SimCity 4.cfg` file, and only parses the file again when its signature changes."""
+
+
+	def __init__(self, error_callback=None):
+
+		self.show_error = error_callback
+
+		self.lock = threading.Lock()
+
+		self.filename = None
+		self.signature = None
+		self.simcity_4_cfg = None
+
+
+	def get_simcity_4_cfg(self, filename):
+
+		signature = get_file_signature(filename)
+
+		with self.lock:
+
+			if filename != self.filename or signature != self.signature:
+				with SC4Config(filename, error_callback=self.show_error) as config:
+					self.simcity_4_cfg = config.get_simcity_4_cfg()
+				self.filename = filename
+				self.signature = signature
+
+			return dict(self.simcity_4_cfg)
 
 
 class SC4Savegame(DBPF):
@@ -396,40 +995,217 @@ class SC4Savegame(DBPF):
 		return self.cSC4BudgetSimulator
 
 
-if __name__ == "__main__":
+class SC4SavegameCache:
+	"""
+	A persistent cache of data decoded from savegames.
 
-	import sys
+	Entries are keyed by path and invalidated when the file signature (size, 
+	modification time and inode) changes, or when `SC4SAVEGAME_CACHE_VERSION` 
+	is bumped after a change to the savegame parser.
+	"""
 
-	def error(e):
-		print(f"{e}")
 
-	filename = sys.argv[1]
+	def __init__(self, filename, error_callback=None):
 
-	if filename.endswith(".sc4"):
+		self.filename = filename
+		self.show_error = error_callback
 
-		savegame = SC4Savegame(filename, 0, error)
+		self.lock = threading.Lock()
 
-		print(savegame.indexData)
+		self.modified = False
 
-		print(savegame.indexOffset)
+		self.savegames = self.load()
 
-		with open("SC4ReadRegionalCity.sc4", "wb") as file:
-			file.write(savegame.decompress_subfile("ca027edb").read())
 
-		with open("cSC4BudgetSimulator.sc4", "wb") as file:
-			file.write(savegame.decompress_subfile("e990be01").read())
+	def load(self):
+		"""Loads the cache file, discarding it if it was written by another version of the parser."""
 
-		print(savegame.get_SC4ReadRegionalCity())
-		print(savegame.get_cSC4BudgetSimulator())
+		try:
+			with open(self.filename, "r") as file:
+				data = json.load(file)
+		except (OSError, ValueError):
+			return {}
+
+		if not isinstance(data, dict) or data.get("version") != SC4SAVEGAME_CACHE_VERSION:
+			return {}
+
+		# Forget savegames that no longer exist
+		savegames = data.get("savegames", {})
+		existing = {path: entry for path, entry in savegames.items() if os.path.exists(path)}
+		if len(existing) < len(savegames):
+			self.modified = True
+
+		return existing
+
+
+	def save(self):
+		"""Writes the cache file, if entries were added or dropped since it was last written."""
+
+		with self.lock:
+			if not self.modified:
+				return
+			data = {"version": SC4SAVEGAME_CACHE_VERSION, "savegames": {path: dict(entry) for path, entry in self.savegames.items()}}
+			self.modified = False
+
+		try:
+			temp_filename = f"{self.filename}.tmp"
+			with open(temp_filename, "w") as file:
+				json.dump(data, file)
+			os.replace(temp_filename, self.filename)
+		except Exception as e:
+			if self.show_error is not None:
+				self.show_error(f"An error occurred while writing the savegame cache to \"{self.filename}\".\n\n{e}")
+
+
+	def get(self, filename, subfile):
+		"""
+		Returns the decoded subfile (eg. `"SC4ReadRegionalCity"`) of a savegame, 
+		parsing the savegame only if it changed since it was cached. New 
+		entries are kept in memory until `save` is called.
+		"""
+
+		key = os.path.abspath(filename)
+		signature = get_file_signature(filename)
+
+		with self.lock:
+			entry = self.savegames.get(key)
+			if entry is not None and entry["signature"] == signature and subfile in entry:
+				return dict(entry[subfile])
+
+		errors = []
+
+		def error_callback(e):
+			errors.append(e)
+			if self.show_error is not None:
+				self.show_error(e)
+
+		with SC4Savegame(filename, error_callback=error_callback) as savegame:
+			data = getattr(savegame, f"get_{subfile}")()
+
+		# Do not cache what was decoded from a savegame that could not be fully parsed
+		if len(errors) > 0:
+			return dict(data)
+
+		with self.lock:
+			entry = self.savegames.get(key)
+			if entry is None or entry["signature"] != signature:
+				entry = {"signature": signature}
+				self.savegames[key] = entry
+			entry[subfile] = data
+			self.modified = True
+
+		return dict(data)
+
+
+	def get_SC4ReadRegionalCity(self, filename):
+
+		return self.get(filename, "SC4ReadRegionalCity")
+
+
+	def get_cSC4BudgetSimulator(self, filename):
+
+		return self.get(filename, "cSC4BudgetSimulator")
+
+
+def unpack_nullstring(buffer, offset=0):
+	"""Returns the null-terminated string starting at `offset` in a buffer."""
+
+	end = buffer.find(b"\x00", offset)
+	if end < 0:
+		end = len(buffer)
+
+	return bytes(buffer[offset:end]).decode()
 
-	elif filename.endswith(".cfg"):
 
-		cfg = SC4Config(filename, 0, error)
+def get_file_signature(filename):
+	"""Returns the size, modification time and inode of a file, which change whenever the file is rewritten."""
 
-		print(cfg.get_simcity_4_cfg())
+	stat = os.stat(filename)
 
-		#print(f"{dbpf.majorVersion}.{dbpf.minorVersion}")
+	return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
 
-		#for entry in dbpf.indexData:
-		#	with open(f"{entry['typeID']}.cfg", "wb") as file:
-		#		file.write(dbpf.decompress_subfile(entry["typeID"]).read())
\ No newline at end of file
+
+def read_SC4ReadRegionalCity(filename, error_callback=None):
+	"""Reads the region view subfile of a savegame, closing the file before returning."""
+
+	with SC4Savegame(filename, error_callback=error_callback) as savegame:
+		return savegame.get_SC4ReadRegionalCity()
+
+
+def scan_savegame(filename):
+	"""Returns the region view data and total funds of a savegame, along with the time it took to read them."""
+
+	start = time.perf_counter()
+
+	result = {"path": str(filename)}
+	warnings = []
+
+	try:
+		with SC4Savegame(filename, error_callback=warnings.append, memory_map=True, verbose=False) as savegame:
+			result.update(savegame.get_SC4ReadRegionalCity())
+			try:
+				result.update(savegame.get_cSC4BudgetSimulator())
+			except Exception as e:
+				warnings.append(f"Unable to read the budget subfile. {e}")
+	except Exception as e:
+		result["error"] = str(e)
+
+	if warnings:
+		result["warnings"] = warnings
+
+	result["seconds"] = round(time.perf_counter() - start, 6)
+
+	return result
+
+
+def find_savegames(paths):
+	"""Yields the savegames in the given paths. Directories (eg. `Regions`) are searched recursively."""
+
+	for path in paths:
+		if os.path.isdir(path):
+			for directory, subdirectories, filenames in os.walk(path):
+				subdirectories.sort()
+				for filename in sorted(filenames):
+					if filename.lower().endswith(".sc4"):
+						yield os.path.join(directory, filename)
+		else:
+			yield path
+
+
+def scan_savegames(paths, workers=None):
+	"""Scans the savegames in the given paths in a process pool, yielding the results in order as they become available."""
+
+	filenames = list(find_savegames(paths))
+
+	if workers == 1 or len(filenames) < 2:
+		yield from map(scan_savegame, filenames)
+		return
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+		yield from executor.map(scan_savegame, filenames, chunksize=4)
+
+
+def main():
+
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Scans SimCity 4 savegames and prints the location, size, population, names and funds of each city as JSON lines.")
+	parser.add_argument("paths", nargs="+", help="savegames, or directories to search recursively (eg. `Regions`)")
+	parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes (defaults to the number of CPUs)")
+	args = parser.parse_args()
+
+	start = time.perf_counter()
+	count = 0
+	errors = 0
+
+	for result in scan_savegames(args.paths, workers=args.workers):
+		print(json.dumps(result), flush=True)
+		count += 1
+		if "error" in result:
+			errors += 1
+
+	print(f"Scanned {count} savegames in {time.perf_counter() - start:.2f} seconds ({errors} failed).", file=sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
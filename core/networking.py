@@ -1,11 +1,666 @@
+import asyncio
+import concurrent.futures
+import errno
+import os
+import selectors
 import socket
 import json
 import struct
+import threading
 import time
+import zlib
+from contextlib import contextmanager
+
+try:
+	import lzma
+except ImportError:
+	lzma = None
 
 
 SC4MP_BUFFER_SIZE = 4096
 
+SC4MP_RECV_BUFFER_SIZE = 256 * 1024
+SC4MP_SEND_FILE_CHUNK_SIZE = 1024 * 1024
+SC4MP_RATE_LIMITED_MIN_CHUNK_SIZE = 64 * 1024
+
+SC4MP_RESOLVER_TTL = 300
+SC4MP_CONNECT_ATTEMPT_DELAY = .25
+
+SC4MP_CODEC_IDS = {None: 0, "zlib": 1, "lzma": 2}
+SC4MP_CODEC_NAMES = {codec_id: codec for codec, codec_id in SC4MP_CODEC_IDS.items()}
+
+SC4MP_COMPRESSION_MIN_SIZE = 1024
+SC4MP_LZMA_MAX_SIZE = 8 * 1024 * 1024
+SC4MP_INCOMPRESSIBLE_EXTENSIONS = [".7z", ".gif", ".gz", ".jpeg", ".jpg", ".mp3", ".ogg", ".png", ".rar", ".xz", ".zip"]
+SC4MP_LZMA_EXTENSIONS = [".bmp", ".html", ".ini", ".json", ".txt", ".xml"]
+
+SC4MP_FILE_TABLE_ENCODINGS = ["json", "binary"]
+SC4MP_FILE_TABLE_MAGIC = b"SC4FT\x01"
+SC4MP_MAX_FILE_TABLE_SIZE = 64 * 1024 * 1024
+
+
+class ConnectionClosed(ConnectionError):
+	"""Raised when the peer closes the connection before the expected data arrives."""
+
+
+class FileTableTooLarge(ValueError):
+	"""Raised when a received file table is larger than the size it was allowed."""
+
+
+class FrameReader:
+	"""
+	Reads length-prefixed frames and raw byte streams from a socket with
+	`recv_into`, so incoming data is not copied or concatenated.
+
+	If `timeout` is given, every read must finish within `timeout` seconds of
+	the reader being created (or of the last `set_deadline`), on top of the
+	socket's own timeout for each `recv`. The reader never reads past the data
+	it was asked for, so it can be mixed with plain `recv` calls.
+	"""
+
+
+	def __init__(self, s, timeout=None, buffer_size=SC4MP_RECV_BUFFER_SIZE):
+
+		self.s = s
+		self.socket_timeout = s.gettimeout()
+		self.buffer_size = buffer_size
+		self.buffer = None
+
+		self.set_deadline(timeout)
+
+
+	def set_deadline(self, timeout):
+		"""Sets the time in seconds from now by which reads must finish (or no deadline if `None`)."""
+
+		self.deadline = None if timeout is None else time.monotonic() + timeout
+
+
+	def recv_into(self, view):
+		"""Receives up to `len(view)` bytes into `view`, returning the number of bytes received."""
+
+		# Shorten the socket timeout to the time left before the deadline
+		if self.deadline is not None:
+			remaining = self.deadline - time.monotonic()
+			if remaining <= 0:
+				raise socket.timeout("Deadline exceeded.")
+			if self.socket_timeout is None or remaining < self.socket_timeout:
+				self.s.settimeout(remaining)
+				try:
+					count = self.s.recv_into(view)
+				finally:
+					self.s.settimeout(self.socket_timeout)
+			else:
+				count = self.s.recv_into(view)
+		else:
+			count = self.s.recv_into(view)
+
+		if count == 0:
+			raise ConnectionClosed("Connection closed by peer.")
+
+		return count
+
+
+	def recv_exactly(self, size):
+		"""Returns exactly `size` bytes as a `bytearray`."""
+
+		data = bytearray(size)
+		view = memoryview(data)
+
+		position = 0
+		while position < size:
+			position += self.recv_into(view[position:])
+
+		return data
+
+
+	def recv_chunks(self, size, rate_limiter=None):
+		"""
+		Yields `size` bytes as `memoryview` chunks of a reused buffer, each 
+		valid until the next one is yielded. If given, `rate_limiter` is 
+		charged with each chunk, and caps their size.
+		"""
+
+		if self.buffer is None:
+			self.buffer = memoryview(bytearray(self.buffer_size))
+
+		remaining = size
+		while remaining > 0:
+			chunk_size = self.buffer_size if rate_limiter is None else rate_limiter.get_chunk_size(self.buffer_size)
+			count = self.recv_into(self.buffer[:min(remaining, chunk_size)])
+			remaining -= count
+			if rate_limiter is not None:
+				rate_limiter.consume(count)
+			yield self.buffer[:count]
+
+
+	def recv_file(self, size, *files, callback=None):
+		"""Receives `size` bytes and writes them to each of the given files, calling `callback` with the length of each chunk."""
+
+		for chunk in self.recv_chunks(size):
+			for file in files:
+				file.write(chunk)
+			if callback is not None:
+				callback(len(chunk))
+
+
+	def recv_compressed(self, stats=None, callback=None, rate_limiter=None):
+		"""
+		Yields the decompressed chunks of a stream sent by `send_compressed`, 
+		calling `callback` with the length of each block as it arrives. If 
+		given, `rate_limiter` is charged with the blocks as they are read.
+		"""
+
+		codec = SC4MP_CODEC_NAMES.get(self.recv_exactly(1)[0], "unknown")
+		if codec not in SC4MP_CODEC_IDS:
+			raise ValueError(f"Unsupported codec \"{codec}\".")
+
+		decompressor = get_decompressor(codec)
+
+		raw_size = 0
+		wire_size = 0
+		seconds = 0
+
+		while True:
+
+			length = struct.unpack("<I", self.recv_exactly(4))[0]
+			if length == 0:
+				break
+
+			if rate_limiter is None:
+				data = self.recv_exactly(length)
+			else:
+				data = bytearray()
+				for chunk in self.recv_chunks(length, rate_limiter):
+					data += chunk
+			wire_size += length
+			if callback is not None:
+				callback(length)
+
+			if decompressor is None:
+				raw_size += length
+				yield data
+				continue
+
+			# Decompress in bounded steps, so a small block cannot expand into a huge buffer
+			start = time.process_time()
+			chunk = decompressor.decompress(data, self.buffer_size)
+			while True:
+				seconds += time.process_time() - start
+				if chunk:
+					raw_size += len(chunk)
+					yield chunk
+				start = time.process_time()
+				if codec == "zlib" and decompressor.unconsumed_tail:
+					chunk = decompressor.decompress(decompressor.unconsumed_tail, self.buffer_size)
+				elif codec == "lzma" and not decompressor.needs_input and not decompressor.eof:
+					chunk = decompressor.decompress(b"", self.buffer_size)
+				else:
+					break
+
+		if stats is not None:
+			stats.add(codec, raw_size, wire_size, seconds)
+
+
+	def recv_file_chunks(self, size, compressed=False, stats=None, callback=None, rate_limiter=None):
+		"""
+		Yields the chunks of a file of `size` bytes, sent as it is or (if 
+		`compressed`) by `send_compressed`, calling `callback` with the number 
+		of bytes read from the socket for each, and charging them to 
+		`rate_limiter` if given.
+		"""
+
+		if not compressed:
+			for chunk in self.recv_chunks(size, rate_limiter):
+				if callback is not None:
+					callback(len(chunk))
+				yield chunk
+			return
+
+		received = 0
+		for chunk in self.recv_compressed(stats, callback, rate_limiter):
+			received += len(chunk)
+			if received > size:
+				break
+			yield chunk
+
+		if received != size:
+			raise ConnectionError(f"Expected {size} bytes, received {received}.")
+
+
+	def recv_json(self, length_encoding="I"):
+		"""Receives a JSON frame sent by `send_json`."""
+
+		length = struct.unpack(length_encoding, self.recv_exactly(struct.calcsize(length_encoding)))[0]
+
+		return json.loads(self.recv_exactly(length))
+
+
+	def recv_file_table(self, encoding="json", compressed=False, stats=None, max_size=SC4MP_MAX_FILE_TABLE_SIZE):
+		"""
+		Receives a file table sent by `send_file_table`, raising 
+		`FileTableTooLarge` as soon as it exceeds `max_size` bytes once 
+		decompressed.
+		"""
+
+		if compressed:
+			chunks = []
+			size = 0
+			for chunk in self.recv_compressed(stats):
+				size += len(chunk)
+				if size > max_size:
+					raise FileTableTooLarge(f"File table exceeds {max_size} bytes.")
+				chunks.append(chunk)
+			data = b"".join(chunks)
+		else:
+			length = struct.unpack("I", self.recv_exactly(4))[0]
+			if length > max_size:
+				raise FileTableTooLarge(f"File table of {length} bytes exceeds {max_size} bytes.")
+			data = self.recv_exactly(length)
+
+		if encoding == "binary":
+			return decode_file_table(data)
+		else:
+			return json.loads(data)
+
+
+class CompressionStats:
+	"""Totals of the data sent or received with each codec, and the CPU time spent (de)compressing it. Thread-safe."""
+
+
+	def __init__(self):
+
+		self.codecs = {}
+		self.lock = threading.Lock()
+
+
+	def add(self, codec, raw_size, wire_size, seconds):
+
+		with self.lock:
+			totals = self.codecs.setdefault(codec or "none", [0, 0, 0, 0.0])
+			totals[0] += 1
+			totals[1] += raw_size
+			totals[2] += wire_size
+			totals[3] += seconds
+
+
+	def __str__(self):
+
+		with self.lock:
+			return ", ".join(
+				f"{codec}: {files} streams, {raw_size / 1e6:.1f} MB -> {wire_size / 1e6:.1f} MB ({100 * wire_size / raw_size if raw_size else 100:.0f}%), {seconds:.2f} s CPU"
+				for codec, (files, raw_size, wire_size, seconds) in sorted(self.codecs.items())
+			)
+
+
+class RateLimiter:
+	"""
+	A token bucket that caps the combined rate of the transfers sharing it at 
+	`rate` bytes per second (unlimited if `None` or `0`), allowing bursts of 
+	`burst` seconds' worth of bytes. Thread-safe.
+
+	The bucket only holds the rate over time. To also keep each burst short, 
+	transfers must charge it before sending each chunk (or as soon as each 
+	is received), in chunks no larger than `get_chunk_size` returns.
+	"""
+
+
+	def __init__(self, rate=None, burst=.25):
+
+		self.rate = rate or None
+		self.burst = burst
+		self.tokens = 0
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+
+	def set_rate(self, rate):
+
+		with self.lock:
+			rate = rate or None
+			if rate != self.rate:
+				self.rate = rate
+				self.tokens = 0
+				self.updated = time.monotonic()
+
+
+	def get_chunk_size(self, chunk_size):
+		"""Returns `chunk_size`, capped to a burst's worth of bytes (but no less than `SC4MP_RATE_LIMITED_MIN_CHUNK_SIZE`) if the rate is limited."""
+
+		rate = self.rate
+		if rate is None:
+			return chunk_size
+
+		return min(chunk_size, max(SC4MP_RATE_LIMITED_MIN_CHUNK_SIZE, int(rate * self.burst)))
+
+
+	def consume(self, size):
+		"""Takes `size` bytes out of the bucket, then waits until it is no longer in debt."""
+
+		with self.lock:
+			if self.rate is None:
+				return
+			now = time.monotonic()
+			self.tokens = min(self.rate * self.burst, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			self.tokens -= size
+			delay = -self.tokens / self.rate
+
+		if delay > 0:
+			time.sleep(delay)
+
+
+	def limit(self, chunks):
+		"""Yields the chunks from an iterable, no faster than the rate."""
+
+		for chunk in chunks:
+			self.consume(len(chunk))
+			yield chunk
+
+
+def get_codecs():
+	"""Returns the names of the supported codecs (`lzma` is missing from some Python builds)."""
+
+	return ["zlib", "lzma"] if lzma is not None else ["zlib"]
+
+
+def choose_codec(filename, size, codecs):
+	"""Returns the codec to send a file with, from those the peer accepts, or `None` to send it as it is."""
+
+	extension = os.path.splitext(str(filename))[1].lower()
+
+	if size < SC4MP_COMPRESSION_MIN_SIZE or extension in SC4MP_INCOMPRESSIBLE_EXTENSIONS:
+		return None
+	elif "lzma" in codecs and lzma is not None and extension in SC4MP_LZMA_EXTENSIONS and size <= SC4MP_LZMA_MAX_SIZE:
+		return "lzma"
+	elif "zlib" in codecs:
+		return "zlib"
+	else:
+		return None
+
+
+def get_compressor(codec):
+
+	if codec == "zlib":
+		return zlib.compressobj(6)
+	elif codec == "lzma":
+		return lzma.LZMACompressor(preset=6)
+	else:
+		return None
+
+
+def get_decompressor(codec):
+
+	if codec == "zlib":
+		return zlib.decompressobj()
+	elif codec == "lzma":
+		return lzma.LZMADecompressor()
+	else:
+		return None
+
+
+def read_chunks(file, buffer_size=SC4MP_RECV_BUFFER_SIZE):
+	"""Yields the contents of a file in chunks."""
+
+	while True:
+		data = file.read(buffer_size)
+		if not data:
+			break
+		yield data
+
+
+def send_file(s, file, offset=0, count=None, callback=None, chunk_size=SC4MP_SEND_FILE_CHUNK_SIZE, rate_limiter=None):
+	"""
+	Sends `count` bytes (or the rest) of an open file from `offset`. Uses 
+	`os.sendfile` where the platform has it, so the data never passes 
+	through Python, and large buffered reads elsewhere. `callback` is called 
+	with the number of bytes sent after each chunk of up to `chunk_size` 
+	bytes. If given, `rate_limiter` is charged with each chunk before it is 
+	sent, and caps their size.
+	"""
+
+	if count is None:
+		count = os.fstat(file.fileno()).st_size - offset
+
+	buffer = None
+
+	sent = 0
+	while sent < count:
+
+		size = min(chunk_size if rate_limiter is None else rate_limiter.get_chunk_size(chunk_size), count - sent)
+
+		if rate_limiter is not None:
+			rate_limiter.consume(size)
+
+		if hasattr(os, "sendfile"):
+			size = s.sendfile(file, offset + sent, size)
+		else:
+			if buffer is None:
+				buffer = memoryview(bytearray(min(chunk_size, count)))
+			file.seek(offset + sent)
+			size = file.readinto(buffer[:size])
+			s.sendall(buffer[:size])
+
+		if not size:
+			raise EOFError(f"Expected {count} bytes, the file ended after {sent}.")
+
+		sent += size
+
+		if callback is not None:
+			callback(size)
+
+
+def send_compressed(s, chunks, codec=None, stats=None, callback=None, rate_limiter=None):
+	"""
+	Sends the chunks from an iterable as a compressed stream: the codec id, 
+	then length-prefixed blocks, ending with an empty block. Calls 
+	`callback` with the length of each block before sending it. If given, 
+	`rate_limiter` is charged with each block before it is sent, and caps 
+	their size.
+	"""
+
+	compressor = get_compressor(codec)
+
+	raw_size = 0
+	wire_size = 0
+	seconds = 0
+
+	def send_block(data):
+		nonlocal wire_size
+		block_size = len(data) if rate_limiter is None else rate_limiter.get_chunk_size(len(data))
+		for position in range(0, len(data), block_size):
+			block = data[position:position + block_size]
+			wire_size += len(block)
+			if callback is not None:
+				callback(len(block))
+			if rate_limiter is not None:
+				rate_limiter.consume(len(block))
+			s.sendall(struct.pack("<I", len(block)) + block)
+
+	s.sendall(bytes([SC4MP_CODEC_IDS[codec]]))
+
+	for chunk in chunks:
+		raw_size += len(chunk)
+		if compressor is not None:
+			start = time.process_time()
+			chunk = compressor.compress(chunk)
+			seconds += time.process_time() - start
+		if chunk:
+			send_block(chunk)
+
+	if compressor is not None:
+		start = time.process_time()
+		chunk = compressor.flush()
+		seconds += time.process_time() - start
+		if chunk:
+			send_block(chunk)
+
+	s.sendall(struct.pack("<I", 0))
+
+	if stats is not None:
+		stats.add(codec, raw_size, wire_size, seconds)
+
+
+def encode_varints(values):
+	"""Encodes non-negative integers as LEB128 varints."""
+
+	data = bytearray()
+	for value in values:
+		while value > 0x7F:
+			data.append((value & 0x7F) | 0x80)
+			value >>= 7
+		data.append(value)
+
+	return data
+
+
+def decode_varints(data):
+	"""Decodes the LEB128 varints in `data`."""
+
+	# Small values are single bytes
+	if not data or max(data) < 0x80:
+		return list(data)
+
+	values = []
+	value = 0
+	shift = 0
+	for byte in data:
+		if byte < 0x80:
+			values.append(value | (byte << shift))
+			value = 0
+			shift = 0
+		else:
+			value |= (byte & 0x7F) << shift
+			shift += 7
+
+	if shift:
+		raise ValueError("Truncated varint.")
+
+	return values
+
+
+def get_common_prefix_length(a, b):
+	"""Returns the length of the common prefix of two strings."""
+
+	low = 0
+	high = min(len(a), len(b))
+	while low < high:
+		middle = (low + high + 1) // 2
+		if a[:middle] == b[:middle]:
+			low = middle
+		else:
+			high = middle - 1
+
+	return low
+
+
+def encode_file_table(file_table):
+	"""
+	Encodes a file table of `[md5, size, relpath]` entries in the binary 
+	format. After a magic number and the entry count come the 16-byte 
+	digests, then three varint columns, each prefixed by its length in bytes: 
+	the sizes, the number of characters each path shares with the one before 
+	it, and the number of characters that follow. Last come the UTF-8 
+	encoded remainders of the paths. Storing columns lets `decode_file_table` 
+	convert whole columns at once.
+	"""
+
+	prefixes = []
+	lengths = []
+	suffixes = []
+
+	previous = ""
+	for checksum, size, relpath in file_table:
+		prefix = get_common_prefix_length(previous, relpath)
+		prefixes.append(prefix)
+		lengths.append(len(relpath) - prefix)
+		suffixes.append(relpath[prefix:])
+		previous = relpath
+
+	data = bytearray(SC4MP_FILE_TABLE_MAGIC)
+	data += encode_varints([len(file_table)])
+	data += bytes.fromhex("".join(entry[0] for entry in file_table))
+	for column in ([entry[1] for entry in file_table], prefixes, lengths):
+		column = encode_varints(column)
+		data += encode_varints([len(column)])
+		data += column
+	data += "".join(suffixes).encode()
+
+	return bytes(data)
+
+
+def decode_file_table(data):
+	"""Decodes a file table encoded by `encode_file_table`, as a list of `(md5, size, relpath)` tuples."""
+
+	data = memoryview(data)
+
+	if data[:len(SC4MP_FILE_TABLE_MAGIC)] != SC4MP_FILE_TABLE_MAGIC:
+		raise ValueError("Invalid file table.")
+
+	position = len(SC4MP_FILE_TABLE_MAGIC)
+
+	def read_varint():
+		nonlocal position
+		value = 0
+		shift = 0
+		while True:
+			byte = data[position]
+			position += 1
+			value |= (byte & 0x7F) << shift
+			if byte < 0x80:
+				return value
+			shift += 7
+
+	try:
+
+		count = read_varint()
+
+		# Digests
+		checksums = data[position:position + 16 * count].hex(" ", -16).split()
+		position += 16 * count
+
+		# Sizes, prefix lengths and suffix lengths
+		columns = []
+		for _ in range(3):
+			length = read_varint()
+			columns.append(decode_varints(data[position:position + length]))
+			position += length
+
+	except IndexError:
+		raise ValueError("Truncated file table.") from None
+
+	sizes, prefixes, lengths = columns
+	if len(checksums) != count or any(len(column) != count for column in columns):
+		raise ValueError("Truncated file table.")
+
+	# Paths
+	suffixes = str(data[position:], "utf-8")
+	if sum(lengths) != len(suffixes):
+		raise ValueError("Invalid file table.")
+	paths = []
+	previous = ""
+	position = 0
+	for prefix, length in zip(prefixes, lengths):
+		previous = previous[:prefix] + suffixes[position:position + length]
+		position += length
+		paths.append(previous)
+
+	# Tuples are much cheaper to create than lists
+	return list(zip(checksums, sizes, paths))
+
+
+def send_file_table(s, file_table, encoding="json", compressed=False, stats=None):
+	"""Sends a file table in the given encoding, as a frame or (if `compressed`) as a zlib stream."""
+
+	if encoding == "binary":
+		data = encode_file_table(file_table)
+	else:
+		data = json.dumps(file_table).encode()
+
+	if compressed:
+		send_compressed(s, [data], "zlib", stats)
+	else:
+		s.sendall(struct.pack("I", len(data)) + data)
+
 
 def send_json(s, data, length_encoding="I"):
 
@@ -14,42 +669,613 @@ def send_json(s, data, length_encoding="I"):
 	s.sendall(struct.pack(length_encoding, len(data)) + data)
 
 
-def recv_json(s, length_encoding="I"):
+def recv_json(s, length_encoding="I", timeout=None):
 
-	length_header_size = struct.calcsize(length_encoding)
-	length_header = b""
+	return FrameReader(s, timeout=timeout).recv_json(length_encoding)
 
-	while len(length_header) < length_header_size:
 
-		new_data = s.recv(length_header_size - len(length_header))
+class ResolverCache:
+	"""
+	Caches the addresses of resolved hostnames for `ttl` seconds, so that 
+	connections to the same host (eg. the default server list's ports on one 
+	domain) share one lookup. A lookup already in progress is waited for 
+	rather than repeated. Failed lookups are not cached. Thread-safe.
+	"""
 
-		if new_data:
 
-			length_header += new_data
+	def __init__(self, ttl=SC4MP_RESOLVER_TTL):
 
-		else:
+		self.ttl = ttl
+		self.entries = {}
+		self.lookups = {}
+		self.lock = threading.Lock()
 
-			time.sleep(.1)
 
-	data_size = struct.unpack(length_encoding, length_header)[0]
-	data_size_read = 0
+	def get(self, host):
+		"""Returns the cached `getaddrinfo` results for a host, or `None` if they are missing or expired."""
 
-	data = b""
-	
-	while data_size_read < data_size:
+		with self.lock:
+			entry = self.entries.get(host)
+			if entry is not None and entry[0] > time.monotonic():
+				return entry[1]
+			return None
 
-		buffer_size = min(SC4MP_BUFFER_SIZE, data_size - data_size_read)
 
-		new_data = s.recv(buffer_size)
+	def resolve(self, host, port):
+		"""Returns the `getaddrinfo` results for a TCP connection to a host and port."""
 
-		if new_data:
+		while True:
 
-			data += new_data
-			
-			data_size_read += len(new_data)
+			with self.lock:
+				entry = self.entries.get(host)
+				if entry is not None and entry[0] > time.monotonic():
+					infos = entry[1]
+					break
+				lookup = self.lookups.get(host)
+				waiting = lookup is not None
+				if not waiting:
+					lookup = self.lookups[host] = threading.Event()
 
-		else:
-			
-			time.sleep(.1)
+			# Wait for the lookup in progress, then check the cache again
+			if waiting:
+				lookup.wait()
+				continue
+
+			try:
+				infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+				with self.lock:
+					self.entries[host] = (time.monotonic() + self.ttl, infos)
+			finally:
+				with self.lock:
+					del self.lookups[host]
+				lookup.set()
+
+			break
+
+		return [(family, type, proto, canonname, (sockaddr[0], port) + tuple(sockaddr[2:])) for family, type, proto, canonname, sockaddr in infos]
+
+
+resolver_cache = ResolverCache()
+
+
+def get_connect_order(infos):
+	"""Orders resolved addresses for connecting, alternating between address families, starting with the preferred one."""
+
+	families = {}
+	for info in infos:
+		families.setdefault(info[0], []).append(info)
+
+	ordered = []
+	queues = list(families.values())
+	while queues:
+		for queue in queues:
+			ordered.append(queue.pop(0))
+		queues = [queue for queue in queues if queue]
+
+	return ordered
+
+
+def create_connection(address, timeout=10, resolver=resolver_cache):
+	"""
+	Connects a socket to a host and port, resolving the host through the 
+	resolver cache. The addresses are tried in the order of 
+	`get_connect_order`, starting the next attempt whenever the current ones 
+	have not connected within `SC4MP_CONNECT_ATTEMPT_DELAY` seconds (or have 
+	failed), so the first address to connect wins ("happy eyeballs"). The 
+	whole attempt must finish within `timeout` seconds, which also becomes 
+	the socket's timeout.
+	"""
+
+	host, port = address[:2]
+
+	infos = get_connect_order(resolver.resolve(host, port))
+
+	deadline = time.monotonic() + timeout
+	next_attempt = time.monotonic()
+	pending = []
+	errors = []
+	selector = selectors.DefaultSelector()
+
+	try:
+
+		while infos or pending:
+
+			now = time.monotonic()
+			if now >= deadline:
+				raise socket.timeout("timed out")
+
+			# Start the next attempt
+			if infos and (not pending or now >= next_attempt):
+				family, type, proto, canonname, sockaddr = infos.pop(0)
+				s = None
+				try:
+					s = socket.socket(family, type, proto)
+					s.setblocking(False)
+					error = s.connect_ex(sockaddr)
+					if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK)):
+						raise OSError(error, os.strerror(error))
+				except OSError as e:
+					errors.append(e)
+					if s is not None:
+						s.close()
+					continue
+				selector.register(s, selectors.EVENT_WRITE)
+				pending.append(s)
+				next_attempt = now + SC4MP_CONNECT_ATTEMPT_DELAY
+
+			# Wait for an attempt to finish, or for the time to start the next one
+			wait = deadline - now
+			if infos:
+				wait = min(wait, max(0, next_attempt - now))
+			for key, events in selector.select(wait):
+				s = key.fileobj
+				selector.unregister(s)
+				pending.remove(s)
+				error = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+				if error == 0:
+					s.settimeout(timeout)
+					return s
+				errors.append(OSError(error, os.strerror(error)))
+				s.close()
+				next_attempt = now
+
+		raise errors[-1] if errors else OSError(f"No addresses for \"{host}\".")
+
+	finally:
+
+		for s in pending:
+			s.close()
+		selector.close()
+
+
+class SessionError(Exception):
+	"""Raised when the server refuses a session, or answers a session request with an error."""
+
+
+class Session:
+	"""
+	A persistent connection to a server using the session protocol.
+
+	The client sends `session` like any other command, and the server answers 
+	with a hello frame listing its capabilities. From then on, the client sends 
+	request frames (`{"id", "command", "args"}`) and the server answers each 
+	one with a response frame (`{"id", "result"}` or `{"id", "error"}`). For 
+	commands followed by a data stream (eg. `plugins`), the response frame is 
+	followed by the same exchange as in the legacy protocol, after which the 
+	connection is ready for the next request.
+	"""
+
+
+	def __init__(self, address, timeout=10):
+
+		self.address = address
+		self.timeout = timeout
+
+		self.s = create_connection(address, timeout=timeout)
+
+		try:
+			self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			self.s.sendall(b"session")
+			hello = recv_json(self.s, timeout=timeout)
+		except Exception:
+			self.s.close()
+			raise
+
+		if not isinstance(hello, dict) or "error" in hello:
+			self.s.close()
+			raise SessionError(hello.get("error", "Session refused.") if isinstance(hello, dict) else "Invalid hello frame.")
+
+		self.capabilities = hello.get("capabilities", [])
+
+		self.credentials = None
+		self.last_id = 0
+		self.rtt = None
+		self.last_used = time.monotonic()
+
+
+	def send_request(self, command, *args, options=None):
+		"""Sends a request frame, with any negotiation `options` (eg. `{"compression": ["zlib"]}`), and returns its id."""
+
+		self.last_id += 1
+		send_json(self.s, dict(options or {}, id=self.last_id, command=command, args=list(args)))
+
+		return self.last_id
+
+
+	def recv_response(self, request_id, timeout=None):
+		"""Receives the response frame to a request and returns its result."""
+
+		response = recv_json(self.s, timeout=self.timeout if timeout is None else timeout)
+
+		self.last_used = time.monotonic()
+
+		if response.get("id") != request_id:
+			raise SessionError(f"Expected response {request_id}, received {response.get('id')}.")
+		if "error" in response:
+			raise SessionError(response["error"])
+
+		return response.get("result")
+
+
+	def request(self, command, *args, options=None, timeout=None):
+		"""Sends a request and returns the result. The round-trip time in seconds is kept in `rtt`."""
+
+		start = time.perf_counter()
+
+		result = self.recv_response(self.send_request(command, *args, options=options), timeout=timeout)
+
+		self.rtt = time.perf_counter() - start
+
+		return result
+
+
+	def authenticate(self, credentials):
+		"""Binds a `(version, user_id, password)` tuple to the connection, if it is not already bound."""
+
+		if credentials is not None and credentials != self.credentials:
+			self.request("auth", *credentials)
+			self.credentials = credentials
+
+
+	def close(self):
+
+		try:
+			self.s.close()
+		except OSError:
+			pass
+
+
+class SessionPool:
+	"""
+	Keeps up to `max_idle` idle sessions to a server for reuse, closing those 
+	left idle for more than `idle_timeout` seconds. Thread-safe.
+	"""
+
+
+	def __init__(self, address, max_idle=4, idle_timeout=30, timeout=10):
+
+		self.address = address
+		self.max_idle = max_idle
+		self.idle_timeout = idle_timeout
+		self.timeout = timeout
+
+		self.idle = []
+		self.lock = threading.Lock()
+
+
+	def acquire(self):
+		"""Returns an idle session (or a new one), and whether it was reused."""
+
+		session = None
+		expired = []
+
+		with self.lock:
+			now = time.monotonic()
+			while self.idle:
+				candidate = self.idle.pop()
+				if now - candidate.last_used > self.idle_timeout:
+					expired.append(candidate)
+				else:
+					session = candidate
+					break
+
+		for candidate in expired:
+			candidate.close()
+
+		if session is not None:
+			return session, True
+
+		return Session(self.address, timeout=self.timeout), False
+
+
+	def release(self, session):
+		"""Returns a session to the pool once its last request has been completed."""
+
+		session.last_used = time.monotonic()
+
+		with self.lock:
+			if len(self.idle) < self.max_idle:
+				self.idle.append(session)
+				return
+
+		session.close()
+
+
+	def start(self, command, *args, credentials=None, options=None, timeout=None):
+		"""
+		Sends a request on a session authenticated with `credentials` and 
+		returns the session and the result. The caller must complete the 
+		exchange, then `release` the session (or close it if an error occurs).
+
+		Pooled sessions may have been closed by the server in the meantime, so 
+		the request is retried on another session if a reused one fails.
+		"""
+
+		session, reused = self.acquire()
+
+		while True:
+			try:
+				session.authenticate(credentials)
+				return session, session.request(command, *args, options=options, timeout=timeout)
+			except ConnectionError:
+				session.close()
+				if not reused:
+					raise
+			except BaseException:
+				session.close()
+				raise
+			session, reused = self.acquire()
+
+
+	def request(self, command, *args, credentials=None, timeout=None):
+		"""Sends a request on a pooled session and returns the result."""
+
+		session, result = self.start(command, *args, credentials=credentials, timeout=timeout)
+
+		self.release(session)
+
+		return result
+
+
+	@contextmanager
+	def stream(self, command, *args, credentials=None, options=None):
+		"""Sends a request followed by a data stream (eg. `plugins`), and yields the socket and the result to complete the exchange on."""
+
+		session, result = self.start(command, *args, credentials=credentials, options=options)
+
+		try:
+			yield session.s, result
+		except BaseException:
+			session.close()
+			raise
+
+		self.release(session)
+
+
+	def close(self):
+		"""Closes the idle sessions."""
+
+		with self.lock:
+			idle = self.idle
+			self.idle = []
+
+		for session in idle:
+			session.close()
+
+
+async def async_open_connection(address, resolver=resolver_cache):
+	"""Opens a stream connection like `create_connection`, on the event loop."""
+
+	host, port = address[:2]
+
+	loop = asyncio.get_running_loop()
+
+	# Resolve through the cache, off the event loop unless the host is cached
+	infos = resolver.get(host)
+	if infos is None:
+		infos = await loop.run_in_executor(None, resolver.resolve, host, port)
+	else:
+		infos = resolver.resolve(host, port)
+	infos = get_connect_order(infos)
+
+	async def attempt(info):
+		family, type, proto, canonname, sockaddr = info
+		s = socket.socket(family, type, proto)
+		try:
+			s.setblocking(False)
+			await loop.sock_connect(s, sockaddr)
+		except BaseException:
+			s.close()
+			raise
+		return s
+
+	# Start an attempt every `SC4MP_CONNECT_ATTEMPT_DELAY` seconds (or when one fails) until one connects
+	attempts = []
+	errors = []
+	s = None
+	try:
+		while s is None and (infos or attempts):
+			if infos:
+				attempts.append(asyncio.ensure_future(attempt(infos.pop(0))))
+			done, pending = await asyncio.wait(attempts, timeout=SC4MP_CONNECT_ATTEMPT_DELAY if infos else None, return_when=asyncio.FIRST_COMPLETED)
+			for task in done:
+				attempts.remove(task)
+				if task.exception() is not None:
+					errors.append(task.exception())
+				elif s is None:
+					s = task.result()
+				else:
+					task.result().close()
+	finally:
+		for task in attempts:
+			task.cancel()
+		for task in attempts:
+			try:
+				(await task).close()
+			except BaseException:
+				pass
+
+	if s is None:
+		raise errors[-1] if errors else OSError(f"No addresses for \"{host}\".")
+
+	return await asyncio.open_connection(sock=s)
+
+
+async def async_recv_exactly(reader, size):
+	"""Returns exactly `size` bytes from an `asyncio.StreamReader`."""
+
+	try:
+		return await reader.readexactly(size)
+	except asyncio.IncompleteReadError as e:
+		raise ConnectionClosed("Connection closed by peer.") from e
+
+
+async def async_send_json(writer, data, length_encoding="I"):
+
+	data = json.dumps(data).encode()
+
+	writer.write(struct.pack(length_encoding, len(data)) + data)
+	await writer.drain()
+
+
+async def async_recv_json(reader, length_encoding="I"):
+
+	length = struct.unpack(length_encoding, await async_recv_exactly(reader, struct.calcsize(length_encoding)))[0]
+
+	return json.loads(await async_recv_exactly(reader, length))
+
+
+async def async_close(writer):
+	"""Closes an `asyncio.StreamWriter`, ignoring errors from a connection that is already broken."""
+
+	writer.close()
+	try:
+		await writer.wait_closed()
+	except OSError:
+		pass
+
+
+class AsyncSession:
+	"""The `Session` protocol over asyncio streams. Requests must not overlap; cancelling one leaves the session unusable."""
+
+
+	def __init__(self, reader, writer, hello):
+
+		self.reader = reader
+		self.writer = writer
+
+		self.capabilities = hello.get("capabilities", [])
+
+		self.credentials = None
+		self.last_id = 0
+		self.rtt = None
+		self.broken = False
+
+
+	@classmethod
+	async def open(cls, address):
+
+		reader, writer = await async_open_connection(address)
+
+		try:
+			writer.write(b"session")
+			await writer.drain()
+			hello = await async_recv_json(reader)
+		except BaseException:
+			await async_close(writer)
+			raise
+
+		if not isinstance(hello, dict) or "error" in hello:
+			await async_close(writer)
+			raise SessionError(hello.get("error", "Session refused.") if isinstance(hello, dict) else "Invalid hello frame.")
+
+		return cls(reader, writer, hello)
+
+
+	async def request(self, command, *args):
+		"""Sends a request and returns the result. The round-trip time in seconds is kept in `rtt`."""
+
+		self.last_id += 1
+		request_id = self.last_id
+
+		start = time.perf_counter()
+
+		try:
+			await async_send_json(self.writer, {"id": request_id, "command": command, "args": list(args)})
+			response = await async_recv_json(self.reader)
+		except BaseException:
+			self.broken = True
+			raise
+
+		self.rtt = time.perf_counter() - start
+
+		if response.get("id") != request_id:
+			self.broken = True
+			raise SessionError(f"Expected response {request_id}, received {response.get('id')}.")
+		if "error" in response:
+			raise SessionError(response["error"])
+
+		return response.get("result")
+
+
+	async def authenticate(self, credentials):
+		"""Binds a `(version, user_id, password)` tuple to the connection, if it is not already bound."""
+
+		if credentials is not None and credentials != self.credentials:
+			await self.request("auth", *credentials)
+			self.credentials = credentials
+
+
+	async def close(self):
+
+		self.broken = True
+
+		await async_close(self.writer)
+
+
+class EventLoopThread(threading.Thread):
+	"""Runs an asyncio event loop in a daemon thread, so blocking code can call coroutines."""
+
+
+	def __init__(self):
+
+		super().__init__(name="EventLoopThread", daemon=True)
+
+		self.loop = asyncio.new_event_loop()
+
+
+	def run(self):
+
+		asyncio.set_event_loop(self.loop)
+		self.loop.run_forever()
+
+
+	def call(self, coroutine, timeout=None):
+		"""Runs a coroutine on the loop and returns its result, cancelling it if `timeout` expires."""
+
+		future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+		try:
+			return future.result(timeout)
+		except concurrent.futures.TimeoutError:
+			future.cancel()
+			raise socket.timeout("Deadline exceeded.")
+
+
+_event_loop_thread = None
+_event_loop_thread_lock = threading.Lock()
+
+
+def get_event_loop_thread():
+	"""Returns the shared `EventLoopThread`, starting it on first use."""
+
+	global _event_loop_thread
+
+	with _event_loop_thread_lock:
+		if _event_loop_thread is None:
+			_event_loop_thread = EventLoopThread()
+			_event_loop_thread.start()
+
+	return _event_loop_thread
+
+
+class SyncFacade:
+	"""Exposes the coroutine methods of an object as blocking methods that run on the shared event loop thread."""
+
+
+	def __init__(self, target):
+
+		self.target = target
+
+
+	def __getattr__(self, name):
+
+		attribute = getattr(self.target, name)
+
+		if not asyncio.iscoroutinefunction(attribute):
+			return attribute
+
+		def call(*args, **kwargs):
+			return get_event_loop_thread().call(attribute(*args, **kwargs))
 
-	return json.loads(data.decode())
\ No newline at end of file
+		return call
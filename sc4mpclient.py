@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
 import configparser
 import ctypes
+import errno
 import hashlib
+import heapq
 import inspect
 import json
 import math
@@ -22,6 +26,7 @@ import tkinter as tk
 import tkinter.font as tkfont
 import traceback
 import webbrowser
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 from tkinter import Menu, filedialog, messagebox, ttk
@@ -34,6 +39,11 @@ try:
 except ImportError:
 	sc4mp_has_pil = False
 
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
 from core.config import *
 from core.dbpf import *
 from core.networking import *
@@ -70,6 +80,19 @@ SC4MP_PORT = 7240 #SC4MP_SERVERS[0][1]
 
 SC4MP_BUFFER_SIZE = 4096
 
+SC4MP_FILE_TABLE_DEADLINE = 60
+SC4MP_SERVER_LIST_DEADLINE = 10
+
+SC4MP_DOWNLOAD_STREAM_MIN_SIZE = 4000000
+
+SC4MP_CHECKSUM_RETRIES = 2
+
+SC4MP_CACHE_INDEX_VERSION = 2
+SC4MP_CACHE_INDEX_SAVE_INTERVAL = 10
+SC4MP_CACHE_PART_MAX_AGE = 86400
+
+SC4MP_FICLONE = 0x40049409
+
 SC4MP_DELAY = .1
 
 SC4MP_LAUNCHERMAP_ENABLED = False  #TODO replace with config setting eventually
@@ -107,6 +130,11 @@ SC4MP_CONFIG_DEFAULTS = [
 
 		("sync_simcity_4_cfg", True),
 
+		("transfer_compression", True),
+		("download_streams", 4),
+		("foreground_rate_limit", 0),	# KB/s, 0 for unlimited
+		("background_rate_limit", 0),	# KB/s, 0 for unlimited
+
 	]),
 	("STORAGE", [
 
@@ -164,6 +192,10 @@ sc4mp_game_monitor_y = 40
 
 sc4mp_beta = None
 
+sc4mp_sc4_cfg_cache = SC4ConfigCache(error_callback=lambda e: show_error(e))
+
+sc4mp_rate_limiters = {"foreground": RateLimiter(), "background": RateLimiter()}
+
 
 # Functions
 
@@ -350,6 +382,10 @@ def cleanup():
 	
 	sc4mp_servers_database.end = True
 
+	sc4mp_savegame_cache.save()
+
+	sc4mp_cache_index.save()
+
 
 def load_config():
 	"""Loads settings from the configuration file."""
@@ -638,6 +674,14 @@ def load_database():
 	sc4mp_servers_database = DatabaseManager(Path(SC4MP_LAUNCHPATH) / "_Database" / "servers.json")
 	sc4mp_servers_database.start()
 
+	global sc4mp_savegame_cache
+	sc4mp_savegame_cache = SC4SavegameCache(Path(SC4MP_LAUNCHPATH) / "_Database" / "savegames.json", error_callback=lambda e: show_error(e, no_ui=True))
+
+	global sc4mp_cache_index
+	sc4mp_cache_index = CacheIndex(Path(SC4MP_LAUNCHPATH) / "_Cache", error_callback=lambda e: show_error(e, no_ui=True))
+	if not sc4mp_cache_index.migrated:
+		CacheMigrator(sc4mp_cache_index).start()
+
 
 def get_sc4_path() -> Optional[Path]:
 	"""Returns the path to the SimCity 4 executable if found."""
@@ -1120,6 +1164,150 @@ def request_header(s, server):
 	s.sendall(server.user_id.encode())
 
 
+def get_transfer_options() -> dict:
+	"""Returns the options offered to servers for file transfers."""
+
+	options = {}
+
+	if sc4mp_config["GENERAL"]["transfer_compression"]:
+		options["compression"] = get_codecs()
+
+	options["file_table"] = "binary"
+	options["resume"] = True
+
+	return options
+
+
+def get_transfer_codecs(result) -> list:
+	"""Returns the codecs the server agreed to use in its response to a transfer request, or an empty list for uncompressed transfers."""
+
+	if isinstance(result, dict):
+		return result.get("compression") or []
+	else:
+		return []
+
+
+def get_file_table_encoding(result) -> str:
+	"""Returns the file table encoding the server agreed to use in its response to a transfer request."""
+
+	if isinstance(result, dict) and result.get("file_table") in SC4MP_FILE_TABLE_ENCODINGS:
+		return result["file_table"]
+	else:
+		return "json"
+
+
+def receive_file_table(reader: FrameReader, encoding: str, codecs: list, stats=None) -> list:
+	"""Receives a file table from the server, refusing one larger than `SC4MP_MAX_FILE_TABLE_SIZE` once decompressed."""
+
+	try:
+		return reader.recv_file_table(encoding, compressed=bool(codecs), stats=stats)
+	except FileTableTooLarge as e:
+		raise ClientException(f"The server sent a file table larger than {SC4MP_MAX_FILE_TABLE_SIZE // (1024 * 1024)} MB.") from e
+
+
+def get_rate_limiter(background=False) -> RateLimiter:
+	"""Returns the rate limiter shared by foreground transfers (loading a server), or by background ones (while the game runs), set to the configured rate."""
+
+	if background:
+		limiter = sc4mp_rate_limiters["background"]
+		limiter.set_rate(1000 * int(sc4mp_config["GENERAL"]["background_rate_limit"]))
+	else:
+		limiter = sc4mp_rate_limiters["foreground"]
+		limiter.set_rate(1000 * int(sc4mp_config["GENERAL"]["foreground_rate_limit"]))
+
+	return limiter
+
+
+def report_throughput(size, seconds, limiter: RateLimiter, wire_size=None) -> None:
+	"""
+	Prints the size of a transfer, and how much of it went over the wire if 
+	it was compressed, with the rate on the wire and the rate it was limited 
+	to.
+	"""
+
+	if wire_size is None:
+		wire_size = size
+
+	rate = wire_size / seconds if seconds > 0 else 0
+	wire = f" ({format_filesize(wire_size)} on the wire)" if wire_size != size else ""
+	limit = f", limited to {format_filesize(limiter.rate)}/s" if limiter.rate else ""
+
+	print(f"- transferred {format_filesize(size)}{wire} in {seconds:.1f} s ({format_filesize(rate)}/s{limit})")
+
+
+def get_download_stream_count(file_table, server: Server) -> int:
+	"""
+	Returns the number of streams to download the files in a pruned file 
+	table over, allowing at least a few megabytes per stream. Servers without 
+	sessions get a single stream, since each extra stream would open a new 
+	connection and receive the whole file table again.
+	"""
+
+	if "session" not in server.capabilities:
+		return 1
+
+	size = sum(entry[1] for entry in file_table)
+	checksums = len(set(entry[0] for entry in file_table))
+
+	return max(1, min(int(sc4mp_config["GENERAL"]["download_streams"]), size // SC4MP_DOWNLOAD_STREAM_MIN_SIZE, checksums))
+
+
+def is_transfer_resumable(result) -> bool:
+	"""Returns whether the server agreed to continue partially received files in its response to a transfer request."""
+
+	return isinstance(result, dict) and result.get("resume") is True
+
+
+def get_resume_offsets(file_table, offsets: dict) -> list:
+	"""Returns the `[index, offset]` pairs of the entries of a pruned file table to continue from an offset."""
+
+	return [[index, offsets[entry[2]]] for index, entry in enumerate(file_table) if entry[2] in offsets]
+
+
+def split_file_table(file_table, count: int) -> list:
+	"""
+	Splits a file table into `count` file tables with about the same total 
+	size, keeping the original order within each. Entries with the same 
+	checksum stay together, so two streams never write the same cache file.
+	"""
+
+	# Group the entries by checksum
+	groups = {}
+	for index, entry in enumerate(file_table):
+		groups.setdefault(entry[0], []).append((index, entry))
+
+	# Hand out the largest groups first, each to the file table with the fewest bytes so far
+	file_tables = [[] for _ in range(count)]
+	sizes = [0] * count
+	for group in sorted(groups.values(), key=lambda group: sum(entry[1] for index, entry in group), reverse=True):
+		smallest = sizes.index(min(sizes))
+		file_tables[smallest].extend(group)
+		sizes[smallest] += sum(entry[1] for index, entry in group)
+
+	return [[entry for index, entry in sorted(file_table, key=lambda item: item[0])] for file_table in file_tables]
+
+
+def check_received_file(checksum: str, digest, mismatches: dict) -> bool:
+	"""
+	Returns whether a received file, hashed into `digest` as it was received, 
+	matches the checksum the server advertised for it. If not, raises 
+	`ChecksumMismatch` so that it is received again, unless it already failed 
+	to match `SC4MP_CHECKSUM_RETRIES` times, in which case it should be used 
+	without being cached.
+	"""
+
+	if digest.hexdigest() == checksum:
+		return True
+
+	mismatches[checksum] = mismatches.get(checksum, 0) + 1
+	if mismatches[checksum] <= SC4MP_CHECKSUM_RETRIES:
+		raise ChecksumMismatch(f"Received file does not match checksum \"{checksum}\".")
+
+	print(f'[WARNING] Received file still does not match checksum "{checksum}", using it without caching it.')
+
+	return False
+
+
 def set_server_data(entry, server):
 	"""Updates the json entry for a given server with the appropriate values."""
 	entry["host"] = server.host
@@ -1140,8 +1328,8 @@ def get_sc4_cfg_path() -> Path: #TODO can this find the cfg for the origin versi
 
 
 def get_sc4_cfg() -> dict:
-	"""Returns data parsed from the SimCity 4.cfg file"""
-	return SC4Config(get_sc4_cfg_path(), error_callback=show_error).get_simcity_4_cfg() 
+	"""Returns data parsed from the SimCity 4.cfg file (only parsed again if the file changed)"""
+	return sc4mp_sc4_cfg_cache.get_simcity_4_cfg(get_sc4_cfg_path())
 
 
 def get_last_region_name() -> str:
@@ -1374,6 +1562,10 @@ class Server:
 		self.password = None
 		self.user_id = None
 
+		# Set once the server advertises the session protocol
+		self.capabilities = []
+		self.sessions = None
+
 		self.categories = ["All"]
 		if self.host == SC4MP_SERVERS_DOMAIN:
 			self.categories.append("Official")
@@ -1387,11 +1579,7 @@ class Server:
 
 		# Request server info
 		try:
-			s = socket.socket()
-			s.settimeout(10)
-			s.connect((self.host, self.port))
-			s.send(b"info")
-			server_info = recv_json(s)
+			server_info = self.request("info", decode_json=True)
 		except Exception as e:
 			raise ClientException("Unable to find server. Check the IP address and port, then try again.") from e
 
@@ -1404,6 +1592,12 @@ class Server:
 		#		raise ClientException("Unable to fetch server info.")
 		#else:
 		#	raise ClientException("Unable to find server. Check the IP address and port, then try again.")
+
+		self.set_info(server_info)
+
+
+	def set_info(self, server_info):
+		"""Saves the server info as instance variables, and updates the json entry for the server if possible."""
 		
 		self.server_id = sanitize_directory_name(server_info["server_id"]) #self.request("server_id")
 		self.server_name = server_info["server_name"] #self.request("server_name")
@@ -1420,6 +1614,15 @@ class Server:
 		except KeyError:
 			pass
 
+		# Use persistent sessions if the server supports them
+		self.capabilities = server_info.get("capabilities", [])
+		if "session" in self.capabilities:
+			if self.sessions is None:
+				self.sessions = SessionPool((self.host, self.port))
+		elif self.sessions is not None:
+			self.sessions.close()
+			self.sessions = None
+
 		if self.server_id in sc4mp_servers_database.keys():
 			self.password = sc4mp_servers_database[self.server_id].get("password", None) # Needed for stat fetching private servers
 
@@ -1514,74 +1717,57 @@ class Server:
 		total_size = 0
 		download_size = 0
 
-		cache_files = os.listdir(os.path.join(SC4MP_LAUNCHPATH, "_Cache"))
-
 		for request, directory in zip(REQUESTS, DIRECTORIES):
 
 			# Set destination
 			destination = Path(SC4MP_LAUNCHPATH) / "_Temp" / "ServerList" / self.server_id / directory
 
-			# Create the socket
-			s = socket.socket()
-			s.settimeout(30)
-			s.connect((self.host, self.port))
-
 			# Request the type of data
-			if not self.private:
-				s.send(request.encode())
-			else:
-				s.send(f"{request} {SC4MP_VERSION} {self.user_id} {self.password}".encode())
+			with self.stream(request, authenticated=self.private, timeout=30) as (s, result):
 
-			# Receive file table
-			file_table = recv_json(s)
+				# Receive file table
+				reader = FrameReader(s, timeout=SC4MP_FILE_TABLE_DEADLINE)
+				file_table = reader.recv_json()
 
-			# Get total and download size
-			#size = sum([entry[1] for entry in file_table])
-			for entry in file_table:
-				total_size += entry[1]
-				if not entry[0] in cache_files:
-					download_size += entry[1]
+				# Get total and download size
+				#size = sum([entry[1] for entry in file_table])
+				for entry in file_table:
+					total_size += entry[1]
+					if not entry[0] in sc4mp_cache_index:
+						download_size += entry[1]
 
-			#size = sum([(0 if os.path.exists(os.path.join(SC4MP_LAUNCHPATH, "_Cache", entry[0])) else entry[1]) for entry in file_table])
+				#size = sum([(0 if os.path.exists(os.path.join(SC4MP_LAUNCHPATH, "_Cache", entry[0])) else entry[1]) for entry in file_table])
 
-			# Prune file table as necessary
-			ft = []
-			for entry in file_table:
-				filename = Path(entry[2]).name
-				if filename in ["region.json", "config.bmp"]:
-					ft.append(entry)
-			file_table = ft
+				# Prune file table as necessary
+				ft = []
+				for entry in file_table:
+					filename = Path(entry[2]).name
+					if filename in ["region.json", "config.bmp"]:
+						ft.append(entry)
+				file_table = ft
 
-			# Send pruned file table
-			send_json(s, file_table)
+				# Send pruned file table
+				send_json(s, file_table)
 
-			# Receive files
-			for entry in file_table:
+				# Receive files
+				for entry in file_table:
 
-				# Get necessary values from entry
-				filesize = entry[1]
-				relpath = Path(entry[2])
+					# Get necessary values from entry
+					filesize = entry[1]
+					relpath = Path(entry[2])
 
-				# Set the destination
-				d = sanitize_relpath(Path(destination), relpath)
+					# Set the destination
+					d = sanitize_relpath(Path(destination), relpath)
 
-				# Create the destination directory if necessary
-				d.parent.mkdir(parents=True, exist_ok=True)
+					# Create the destination directory if necessary
+					d.parent.mkdir(parents=True, exist_ok=True)
 
-				# Delete the destination file if it exists
-				d.unlink(missing_ok=True)
+					# Delete the destination file if it exists
+					d.unlink(missing_ok=True)
 
-				# Receive the file
-				filesize_read = 0
-				with d.open("wb") as dest:
-					while filesize_read < filesize:
-						filesize_remaining = filesize - filesize_read
-						buffersize = SC4MP_BUFFER_SIZE if filesize_remaining > SC4MP_BUFFER_SIZE else filesize_remaining
-						bytes_read = s.recv(buffersize)
-						if not bytes_read:
-							break
-						dest.write(bytes_read)
-						filesize_read += len(bytes_read)
+					# Receive the file
+					with d.open("wb") as dest:
+						reader.recv_file(filesize, dest)
 
 			#total_size += size
 
@@ -1626,25 +1812,64 @@ class Server:
 		set_server_data(entry, self)
 
 
-	def request(self, request):
-		"""Requests a given value from the server."""
+	def create_socket(self, timeout=10):
+		"""Connects a new socket to the server for a legacy one-shot request."""
 
-		if self.fetched == False:
-			return
+		return create_connection((self.host, self.port), timeout=timeout)
+
+
+	def get_credentials(self):
+		"""Returns the version, user ID and password sent with requests that require them."""
+
+		return (SC4MP_VERSION, self.user_id, self.password)
 
-		host = self.host
-		port = self.port
 
+	def get_legacy_request(self, request, args, authenticated):
+		"""Returns a request in the legacy format (eg. `"plugins {version} {user_id} {password}"`)."""
+
+		if authenticated:
+			args = self.get_credentials() + args
+
+		return " ".join([request] + [str(arg) for arg in args]).encode()
+
+
+	def request(self, request, *args, authenticated=False, decode_json=False, timeout=None):
+		"""Requests a given value from the server, over a pooled session if the server supports them, or else a new connection."""
+
+		if self.sessions is not None:
+			return self.sessions.request(request, *args, credentials=(self.get_credentials() if authenticated else None), timeout=timeout)
+
+		s = self.create_socket()
 		try:
-			s = socket.socket()
-			s.settimeout(10)
-			s.connect((host, port))
-			s.sendall(request.encode())
-			return s.recv(SC4MP_BUFFER_SIZE).decode()
-		except Exception:
-			self.fetched = False
-			print(f'[WARNING] Unable to fetch "{request}" from {host}:{port}')
-			return None
+			s.sendall(self.get_legacy_request(request, args, authenticated))
+			if decode_json:
+				return recv_json(s, timeout=timeout)
+			else:
+				return s.recv(SC4MP_BUFFER_SIZE).decode()
+		finally:
+			s.close()
+
+
+	@contextmanager
+	def stream(self, request, *args, authenticated=False, options=None, timeout=10):
+		"""
+		Sends a request followed by a data stream (eg. `plugins`), and yields 
+		the socket to complete the exchange on, along with the result (`None` 
+		on legacy connections, which are closed afterwards). The negotiation 
+		`options` are only sent over sessions.
+		"""
+
+		if self.sessions is not None:
+			with self.sessions.stream(request, *args, credentials=(self.get_credentials() if authenticated else None), options=options) as (s, result):
+				yield s, result
+			return
+
+		s = self.create_socket(timeout=timeout)
+		try:
+			s.sendall(self.get_legacy_request(request, args, authenticated))
+			yield s, None
+		finally:
+			s.close()
 
 
 	def authenticate(self):
@@ -1672,11 +1897,7 @@ class Server:
 		# Verify server can produce the user_id from the hash of the user_id and token combined
 		if token != None:
 			hash = hashlib.sha256(((hashlib.sha256(user_id.encode()).hexdigest()[:32]) + token).encode()).hexdigest()
-			s = socket.socket()
-			s.settimeout(10)
-			s.connect((self.host, self.port))
-			s.sendall(f"user_id {hash}".encode())
-			if s.recv(SC4MP_BUFFER_SIZE).decode() == hashlib.sha256(user_id.encode()).hexdigest()[:32]:
+			if self.request("user_id", hash) == hashlib.sha256(user_id.encode()).hexdigest()[:32]:
 				self.user_id = user_id
 			else:
 				if not sc4mp_config["GENERAL"]["ignore_token_errors"]:
@@ -1687,16 +1908,11 @@ class Server:
 							raise ClientException("Connection cancelled.")
 					else:
 						raise ClientException("Invalid token.") #"Authentication error."
-			s.close()
 		else:
 			self.user_id = user_id
 
 		# Get the new token
-		s = socket.socket()
-		s.settimeout(10)
-		s.connect((self.host, self.port))
-		s.sendall(f"token {SC4MP_VERSION} {self.user_id} {self.password}".encode())
-		token = s.recv(SC4MP_BUFFER_SIZE).decode()
+		token = self.request("token", authenticated=True)
 
 		# Raise exception if no token is received
 		if len(token) < 1:
@@ -1714,21 +1930,32 @@ class Server:
 		host = self.host
 		port = self.port
 
-		s = socket.socket()
-		
-		s.settimeout(10)
+		# Time the request alone, not the connection
+		if self.sessions is not None:
+			try:
+				session, result = self.sessions.start("ping")
+				self.sessions.release(session)
+				self.server_ping = round(1000 * session.rtt)
+				return self.server_ping
+			except (socket.error, SessionError):
+				return None
+
+		try:
+			s = create_connection((host, port), timeout=10)
+		except socket.error:
+			return None
 
 		try:
-			s.connect((host, port))
 			start = time.time()
 			s.sendall(b"ping")
 			s.recv(SC4MP_BUFFER_SIZE)
 			end = time.time()
-			s.close()
 			self.server_ping = round(1000 * (end - start))
 			return self.server_ping
 		except socket.error:
 			return None
+		finally:
+			s.close()
 
 
 	def time(self):
@@ -1736,12 +1963,7 @@ class Server:
 
 		try:
 
-			s = socket.socket()
-			s.settimeout(10)
-			s.connect((self.host, self.port))
-			s.sendall(b"time")
-
-			return datetime.strptime(s.recv(SC4MP_BUFFER_SIZE).decode(), "%Y-%m-%d %H:%M:%S")
+			return datetime.strptime(self.request("time"), "%Y-%m-%d %H:%M:%S")
 		
 		except Exception as e:
 
@@ -1750,6 +1972,709 @@ class Server:
 			return datetime.now()
 
 
+class AsyncServer:
+	"""
+	An asyncio interface for a `Server`. Each operation is a coroutine with its 
+	own timeout, and can be cancelled. Results are saved on the `Server`, as 
+	with its blocking methods. `sync` exposes the same operations as blocking 
+	methods, run on the shared event loop thread.
+	"""
+
+
+	def __init__(self, server: Server):
+
+		self.server = server
+
+		# One session per client, used for a request at a time
+		self.session = None
+		self.session_lock = None
+
+		self.sync = SyncFacade(self)
+
+
+	async def stream(self, request, *args, authenticated=False, handler=None):
+		"""Sends a request over a session if the server supports them, or else a new connection, and awaits `handler(reader, writer, result)` to complete the exchange."""
+
+		host = self.server.host
+		port = self.server.port
+
+		# Session
+		if "session" in self.server.capabilities:
+			if self.session_lock is None:
+				self.session_lock = asyncio.Lock()
+			async with self.session_lock:
+				if self.session is None or self.session.broken:
+					self.session = await AsyncSession.open((host, port))
+				try:
+					await self.session.authenticate(self.server.get_credentials() if authenticated else None)
+					result = await self.session.request(request, *args)
+					if handler is not None:
+						result = await handler(self.session.reader, self.session.writer, result)
+				except BaseException:
+					await self.session.close()
+					raise
+				return result
+
+		# Legacy connection
+		reader, writer = await async_open_connection((host, port))
+		try:
+			writer.write(self.server.get_legacy_request(request, args, authenticated))
+			await writer.drain()
+			return await handler(reader, writer, None)
+		finally:
+			await async_close(writer)
+
+
+	async def request(self, request, *args, authenticated=False, decode_json=False, timeout=10):
+		"""Requests a given value from the server."""
+
+		async def receive(reader, writer, result):
+			if result is not None:
+				return result
+			elif decode_json:
+				return await async_recv_json(reader)
+			else:
+				return (await reader.read(SC4MP_BUFFER_SIZE)).decode()
+
+		return await asyncio.wait_for(self.stream(request, *args, authenticated=authenticated, handler=receive), timeout)
+
+
+	async def fetch(self, timeout=10):
+		"""Retreives basic information from the server, as `Server.fetch` does."""
+
+		self.server.fetched = True
+
+		try:
+			server_info = await self.request("info", decode_json=True, timeout=timeout)
+		except Exception as e:
+			raise ClientException("Unable to find server. Check the IP address and port, then try again.") from e
+
+		self.server.set_info(server_info)
+
+
+	async def ping(self, timeout=10):
+		"""Returns the round-trip time of a request in milliseconds, or `None` if the server is unreachable."""
+
+		# Time the request alone, not the connection
+		async def receive(reader, writer, result):
+			if result is not None:
+				return self.session.rtt
+			start = time.perf_counter()
+			await reader.read(SC4MP_BUFFER_SIZE)
+			return time.perf_counter() - start
+
+		try:
+			rtt = await asyncio.wait_for(self.stream("ping", handler=receive), timeout)
+		except (socket.error, asyncio.TimeoutError, SessionError):
+			return None
+
+		self.server.server_ping = round(1000 * rtt)
+
+		return self.server.server_ping
+
+
+	async def time(self, timeout=10):
+
+		try:
+			return datetime.strptime(await self.request("time", timeout=timeout), "%Y-%m-%d %H:%M:%S")
+		except Exception as e:
+			show_error("Unable to get server time, using local time instead.", no_ui=True)
+			return datetime.now()
+
+
+	async def server_list(self, timeout=SC4MP_SERVER_LIST_DEADLINE):
+		"""Returns the `(host, port)` pairs of the servers known to the server."""
+
+		return [(host, port) for host, port in await self.request("server_list", decode_json=True, timeout=timeout)]
+
+
+	async def fetch_temp(self, timeout=30):
+		"""Downloads the region configs and databases used for server stats, as `Server.fetch_temp` does."""
+
+		total_size = 0
+		download_size = 0
+
+		def write_file(d, data):
+			d.parent.mkdir(parents=True, exist_ok=True)
+			d.unlink(missing_ok=True)
+			d.write_bytes(data)
+
+		async def receive(reader, writer, destination):
+
+			nonlocal total_size, download_size
+
+			# Receive file table
+			file_table = await async_recv_json(reader)
+
+			# Get total and download size
+			for entry in file_table:
+				total_size += entry[1]
+				if not entry[0] in sc4mp_cache_index:
+					download_size += entry[1]
+
+			# Prune file table as necessary
+			file_table = [entry for entry in file_table if Path(entry[2]).name in ["region.json", "config.bmp"]]
+
+			# Send pruned file table
+			await async_send_json(writer, file_table)
+
+			# Receive files, writing them on the default executor so the other servers on the loop are not held up
+			loop = asyncio.get_running_loop()
+			for entry in file_table:
+				d = sanitize_relpath(Path(destination), Path(entry[2]))
+				data = await async_recv_exactly(reader, entry[1])
+				await loop.run_in_executor(None, write_file, d, data)
+
+		async def fetch_temp():
+			for request, directory in zip(["plugins", "regions"], ["Plugins", "Regions"]):
+				destination = Path(SC4MP_LAUNCHPATH) / "_Temp" / "ServerList" / self.server.server_id / directory
+				await self.stream(request, authenticated=self.server.private, handler=lambda reader, writer, result: receive(reader, writer, destination))
+
+		await asyncio.wait_for(fetch_temp(), timeout)
+
+		return (total_size, download_size)
+
+
+	async def close(self):
+
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
+
+
+async def probe_servers(addresses, concurrency=1000, timeout=10):
+	"""Fetches and pings many servers concurrently on one event loop, returning a `(server, exception)` pair for each address, in order."""
+
+	semaphore = asyncio.Semaphore(concurrency)
+
+	async def probe(host, port):
+		server = Server(host, port)
+		client = AsyncServer(server)
+		async with semaphore:
+			try:
+				await client.fetch(timeout=timeout)
+				await client.ping(timeout=timeout)
+				return server, None
+			except Exception as e:
+				return server, e
+			finally:
+				await client.close()
+
+	return await asyncio.gather(*(probe(host, port) for host, port in addresses))
+
+
+class CacheIndex:
+	"""
+	A persistent index of the files in the download cache, so that the cache 
+	can be kept under its size limit without scanning it.
+
+	Entries are keyed by checksum and hold the size, last access time and 
+	origin server of each file. The total size is kept as files are added and 
+	removed, and the least recently used files are evicted first, off a heap. 
+	The index is rebuilt from the cache directory if its file is missing or 
+	unreadable. Thread-safe.
+
+	Files are sharded by the first two pairs of characters of their checksums 
+	(`ab/cd/abcd...`), so that no directory grows too large to list. Caches 
+	from before the sharding (index version 1) are moved into their shards by 
+	`migrate`, in the meantime files are looked up in both places.
+
+	The `.part` files of partially received files are tracked separately, 
+	and deleted by `clean_parts` once left untouched for too long, since 
+	they are only continued if the same checksum is requested again.
+	"""
+
+
+	def __init__(self, directory: Path, error_callback=None):
+
+		self.directory = Path(directory)
+		self.filename = self.directory / "index.json"
+		self.show_error = error_callback
+
+		self.lock = th.Lock()
+
+		self.files = {}
+		self.size = 0
+
+		# Checksums of the files with a `.part` file, which may have been abandoned
+		self.parts = set()
+
+		# `(accessed, checksum)` pairs, including outdated ones skipped when popped
+		self.heap = []
+
+		self.modified = False
+		self.saved = time.monotonic()
+
+		# Whether the files are all in their shards
+		self.migrated = True
+
+		# Whether the last eviction stopped short of the limit, with only files in use left
+		self.full = False
+
+		self.load()
+
+
+	def __contains__(self, checksum):
+
+		with self.lock:
+			return checksum in self.files
+
+
+	def load(self):
+		"""Loads the index file, or rebuilds the index from the cache directory if it cannot be loaded."""
+
+		try:
+			with open(self.filename, "r") as file:
+				data = json.load(file)
+			if not isinstance(data, dict) or data.get("version") not in (1, SC4MP_CACHE_INDEX_VERSION):
+				raise ValueError("Unsupported cache index version.")
+			files = {checksum: dict(entry) for checksum, entry in data["files"].items()}
+			parts = set(data.get("parts", []))
+			migrated = data["version"] == SC4MP_CACHE_INDEX_VERSION
+		except (OSError, ValueError, KeyError, TypeError, AttributeError):
+			print(f'Rebuilding the cache index at "{self.filename}"...')
+			files, parts, migrated = self.scan()
+			self.modified = True
+
+		with self.lock:
+			self.files = files
+			self.parts = parts
+			self.migrated = migrated
+			self.size = sum(entry["size"] for entry in files.values())
+			self.heap = [(entry["accessed"], checksum) for checksum, entry in files.items()]
+			heapq.heapify(self.heap)
+
+
+	def scan(self):
+		"""
+		Returns the entries of the files in the cache directory, taking their 
+		modification times as their access times, the checksums of their 
+		`.part` files, and whether they are all in their shards.
+		"""
+
+		files = {}
+		parts = set()
+		migrated = True
+
+		for directory, subdirectories, filenames in os.walk(self.directory):
+			for filename in filenames:
+				if re.fullmatch("[0-9a-f]{32}", filename):
+					path = Path(directory, filename)
+					stat = path.stat()
+					files[filename] = {"size": stat.st_size, "accessed": stat.st_mtime, "server_id": None}
+					if stat.st_nlink > 1:
+						files[filename]["linked"] = stat.st_mtime_ns
+					if path != self.get_path(filename):
+						migrated = False
+				elif re.fullmatch("[0-9a-f]{32}\\.part", filename):
+					parts.add(filename[:-len(".part")])
+
+		return files, parts, migrated
+
+
+	def save(self):
+		"""Writes the index file, if the index changed since it was last written."""
+
+		with self.lock:
+			if not self.modified:
+				return
+			data = {"version": SC4MP_CACHE_INDEX_VERSION if self.migrated else 1, "files": {checksum: dict(entry) for checksum, entry in self.files.items()}, "parts": sorted(self.parts)}
+			self.modified = False
+			self.saved = time.monotonic()
+
+		try:
+			temp_filename = self.filename.with_name(f"{self.filename.name}.tmp")
+			with open(temp_filename, "w") as file:
+				json.dump(data, file)
+			os.replace(temp_filename, self.filename)
+		except Exception as e:
+			if self.show_error is not None:
+				self.show_error(f"An error occurred while writing the cache index to \"{self.filename}\".\n\n{e}")
+
+
+	def get_path(self, checksum: str) -> Path:
+		"""Returns the path of a cached file, in its shard."""
+
+		return self.directory / checksum[:2] / checksum[2:4] / checksum
+
+
+	def stat(self, checksum: str):
+		"""Returns the `os.stat_result` of a cached file, or `None` if it is not cached."""
+
+		try:
+			return self.get_path(checksum).stat()
+		except OSError:
+			if self.migrated:
+				return None
+
+		# Move the file into its shard, if it was not yet
+		self.migrate_file(checksum)
+
+		try:
+			return self.get_path(checksum).stat()
+		except OSError:
+			return None
+
+
+	def use(self, checksum: str, size: int) -> bool:
+		"""Returns whether the cache has the file with a checksum and size, marking it as used if so."""
+
+		stat = self.stat(checksum)
+		actual_size = stat.st_size if stat is not None else None
+
+		# A file that was hard linked to may have been written to through the link, so check it against its checksum if it was modified since
+		with self.lock:
+			entry = self.files.get(checksum)
+			linked = entry.get("linked") if entry is not None else None
+		if linked is not None and actual_size == size and stat.st_mtime_ns != linked:
+			if md5(self.get_path(checksum)) != checksum:
+				print(f'[WARNING] Cached "{checksum}" was modified through a link, discarding it.')
+				self.remove(checksum)
+				return False
+			with self.lock:
+				if checksum in self.files:
+					self.files[checksum]["linked"] = stat.st_mtime_ns
+					self.modified = True
+
+		with self.lock:
+
+			# Correct the entry if the file changed or disappeared since it was indexed
+			entry = self.files.get(checksum)
+			if entry is not None and entry["size"] != actual_size:
+				self.forget(checksum)
+				entry = None
+			if entry is None and actual_size is not None:
+				self.files[checksum] = {"size": actual_size, "accessed": 0, "server_id": None}
+				self.size += actual_size
+				heapq.heappush(self.heap, (0, checksum))
+				self.modified = True
+
+			if actual_size == size:
+				self.touch(checksum)
+				return True
+
+		return False
+
+
+	def add(self, checksum: str, size: int, server_id=None):
+		"""Adds a file moved into the cache directory."""
+
+		with self.lock:
+			if checksum in self.files:
+				self.forget(checksum)
+			self.files[checksum] = {"size": size, "accessed": 0, "server_id": server_id}
+			self.size += size
+			self.touch(checksum)
+
+		# Write the index every so often, in case the client is closed abruptly
+		if time.monotonic() - self.saved > SC4MP_CACHE_INDEX_SAVE_INTERVAL:
+			self.save()
+
+
+	def set_linked(self, checksum: str):
+		"""Records the modification time of a cached file that was hard linked to, so that `use` can tell if it was written to through the link."""
+
+		stat = self.stat(checksum)
+
+		with self.lock:
+			entry = self.files.get(checksum)
+			if entry is not None and stat is not None:
+				entry["linked"] = stat.st_mtime_ns
+				self.modified = True
+
+
+	def remove(self, checksum: str):
+		"""Deletes a file from the cache."""
+
+		with self.lock:
+			self.delete_file(checksum)
+			if checksum in self.files:
+				self.forget(checksum)
+
+
+	def make_room(self, size: int, limit: int):
+		"""
+		Evicts the least recently used files until `size` more bytes fit under 
+		`limit`. Files still hard linked to elsewhere are kept, since deleting 
+		them would not free any space, and stay counted against the limit. If 
+		the limit cannot be met, `full` is set until it can.
+		"""
+
+		with self.lock:
+			linked = []
+			while self.size > limit - size and self.heap:
+				accessed, checksum = heapq.heappop(self.heap)
+				entry = self.files.get(checksum)
+				if entry is None or entry["accessed"] != accessed:
+					continue
+				if self.get_link_count(checksum) > 1:
+					linked.append((accessed, checksum))
+					continue
+				try:
+					self.delete_file(checksum)
+				except OSError as e:
+					print(f'[WARNING] Unable to evict "{checksum}" from the cache! {e}')
+					continue
+				self.forget(checksum)
+			for pair in linked:
+				heapq.heappush(self.heap, pair)
+
+			# Warn once when the limit can no longer be met
+			full = self.size > limit - size
+			if full and not self.full:
+				print(f"[WARNING] Unable to keep the cache under its size limit of {format_filesize(limit)} ({format_filesize(self.size)} used, {format_filesize(size)} needed), since the files left are in use. Files will be copied instead of linked until there is room.")
+			self.full = full
+
+
+	def add_part(self, checksum: str):
+		"""Tracks the `.part` file a file is being received to."""
+
+		with self.lock:
+			if checksum not in self.parts:
+				self.parts.add(checksum)
+				self.modified = True
+
+
+	def clean_parts(self, max_age=SC4MP_CACHE_PART_MAX_AGE):
+		"""Deletes the `.part` files left untouched for `max_age` seconds, and forgets those that were completed or deleted."""
+
+		with self.lock:
+			parts = list(self.parts)
+
+		now = time.time()
+		count = 0
+
+		for checksum in parts:
+
+			# Find the part, in its shard or where it was before the cache was sharded
+			path = None
+			for candidate in [self.get_path(checksum).with_name(f"{checksum}.part"), self.directory / f"{checksum}.part"]:
+				try:
+					modified = candidate.stat().st_mtime
+					path = candidate
+					break
+				except OSError:
+					pass
+
+			# Keep it if it was received to recently
+			if path is not None and now - modified <= max_age:
+				continue
+
+			# Delete it if it was abandoned
+			if path is not None:
+				try:
+					path.unlink()
+					count += 1
+				except OSError as e:
+					print(f'[WARNING] Unable to delete "{path}"! {e}')
+					continue
+
+			with self.lock:
+				self.parts.discard(checksum)
+				self.modified = True
+
+		if count > 0:
+			print(f"- {count} abandoned partial files deleted from the cache")
+
+
+	def clear(self):
+		"""Forgets every file, after the cache directory was purged."""
+
+		with self.lock:
+			self.files = {}
+			self.parts = set()
+			self.size = 0
+			self.heap = []
+			self.modified = True
+
+
+	def migrate(self):
+		"""Moves the files, and the parts of those being received, from the cache directory into their shards."""
+
+		if self.migrated:
+			return
+
+		print(f'Migrating the cache at "{self.directory}"...')
+
+		# Collect the checksums of the files and parts left in the cache directory
+		checksums = set()
+		for filename in os.listdir(self.directory):
+			checksum = filename[:-len(".part")] if filename.endswith(".part") else filename
+			if re.fullmatch("[0-9a-f]{32}", checksum) and (self.directory / filename).is_file():
+				checksums.add(checksum)
+
+		# Move them, once per checksum
+		count = 0
+		failed = 0
+		for checksum in checksums:
+			if self.migrate_file(checksum):
+				count += 1
+			else:
+				failed += 1
+
+		# Keep looking for files outside their shards until they all moved, so the next start retries the others
+		if failed == 0:
+			with self.lock:
+				self.migrated = True
+				self.modified = True
+			self.save()
+
+		print(f"- {count} files migrated")
+		if failed > 0:
+			print(f"[WARNING] {failed} files could not be migrated, retrying on the next start.")
+
+
+	def migrate_file(self, checksum) -> bool:
+		"""
+		Moves a file, and its part if being received, from the cache directory 
+		into its shard. Returns whether nothing was left behind.
+		"""
+
+		path = self.get_path(checksum)
+
+		success = True
+
+		with self.lock:
+			for source, destination in [(self.directory / checksum, path), (self.directory / f"{checksum}.part", path.with_name(f"{checksum}.part"))]:
+				try:
+					if source.exists():
+						destination.parent.mkdir(parents=True, exist_ok=True)
+						os.replace(source, destination)
+				except OSError as e:
+					print(f'[WARNING] Unable to migrate "{source}"! {e}')
+					success = False
+
+		return success
+
+
+	def get_link_count(self, checksum):
+
+		for path in [self.get_path(checksum), self.directory / checksum]:
+			try:
+				return path.stat().st_nlink
+			except OSError:
+				pass
+
+		return 0
+
+
+	def delete_file(self, checksum):
+
+		self.get_path(checksum).unlink(missing_ok=True)
+
+		if not self.migrated:
+			(self.directory / checksum).unlink(missing_ok=True)
+
+
+	def touch(self, checksum):
+
+		entry = self.files[checksum]
+		entry["accessed"] = max(time.time(), entry["accessed"])
+		heapq.heappush(self.heap, (entry["accessed"], checksum))
+		self.modified = True
+
+		# Drop the outdated pairs once they outnumber the files
+		if len(self.heap) > 2 * len(self.files) + 1000:
+			self.heap = [(entry["accessed"], checksum) for checksum, entry in self.files.items()]
+			heapq.heapify(self.heap)
+
+
+	def forget(self, checksum):
+
+		self.size -= self.files.pop(checksum)["size"]
+		self.modified = True
+
+
+class FileMaterializer:
+	"""
+	Places cached files at their destinations as cheaply as the filesystem 
+	allows: as hard links (if `link` is set, for files never written to), as 
+	copy-on-write clones, with `os.copy_file_range`, or as plain copies. 
+	Counts the files placed each way. A way that fails for a reason other 
+	than the file itself is not tried again. Thread-safe.
+	"""
+
+
+	METHODS = ["link", "clone", "copy_file_range", "copy"]
+
+	# Errors caused by the file rather than by the way it was placed
+	FILE_ERRNOS = [errno.ENOENT, errno.ENOSPC, errno.EMLINK, errno.EEXIST]
+
+
+	def __init__(self):
+
+		self.counts = dict.fromkeys(self.METHODS, 0)
+		self.unsupported = set()
+		self.lock = th.Lock()
+
+
+	def materialize(self, source: Path, destination: Path, link=True) -> str:
+		"""Places a copy of `source` at `destination`, which must not exist, and returns the way it was placed."""
+
+		for method in self.METHODS:
+
+			if method in self.unsupported or (method == "link" and not link):
+				continue
+
+			try:
+				getattr(self, f"materialize_{method}")(source, destination)
+			except OSError as e:
+				destination.unlink(missing_ok=True)
+				if method == "copy":
+					raise
+				if e.errno not in self.FILE_ERRNOS:
+					with self.lock:
+						reported = method in self.unsupported
+						self.unsupported.add(method)
+					if not reported:
+						print(f"- materializing files with {method} is not supported, falling back ({e})")
+				continue
+
+			with self.lock:
+				self.counts[method] += 1
+
+			return method
+
+
+	def materialize_link(self, source, destination):
+
+		os.link(source, destination)
+
+
+	def materialize_clone(self, source, destination):
+
+		if fcntl is None or not sys.platform.startswith("linux"):
+			raise OSError(errno.EOPNOTSUPP, "Cloning files is not supported on this platform.")
+
+		with open(source, "rb") as src, open(destination, "wb") as dest:
+			fcntl.ioctl(dest.fileno(), SC4MP_FICLONE, src.fileno())
+
+
+	def materialize_copy_file_range(self, source, destination):
+
+		if not hasattr(os, "copy_file_range"):
+			raise OSError(errno.EOPNOTSUPP, "`os.copy_file_range` is not supported on this platform.")
+
+		with open(source, "rb") as src, open(destination, "wb") as dest:
+			remaining = os.fstat(src.fileno()).st_size
+			while remaining > 0:
+				count = os.copy_file_range(src.fileno(), dest.fileno(), remaining)
+				if count == 0:
+					raise OSError(errno.EIO, f"\"{source}\" ended unexpectedly.")
+				remaining -= count
+
+
+	def materialize_copy(self, source, destination):
+
+		shutil.copy(source, destination)
+
+
+	def __str__(self):
+
+		with self.lock:
+			return ", ".join(f"{count} {method}" for method, count in self.counts.items() if count) or "none"
+
+
 # Workers
 
 class ServerList(th.Thread):
@@ -2378,6 +3303,9 @@ class ServerFetcher(th.Thread):
 		self.parent = parent
 		self.server = server
 
+		# Requests run on the shared event loop, so the fetchers wait on it instead of on sockets of their own
+		self.client = AsyncServer(server)
+
 		self.setDaemon(True)
 
 
@@ -2395,7 +3323,7 @@ class ServerFetcher(th.Thread):
 
 				try:
 
-					self.server.fetch()
+					self.client.sync.fetch()
 
 					if not self.server.fetched:
 						raise ClientException("Server is not fetched.")
@@ -2492,6 +3420,10 @@ class ServerFetcher(th.Thread):
 
 				print(f"[WARNING] Failed to fetch {self.server.host}:{self.server.port}! " + str(e))
 
+			finally:
+
+				self.client.sync.close()
+
 			self.parent.server_fetchers -= 1
 
 		except Exception as e:
@@ -2507,14 +3439,8 @@ class ServerFetcher(th.Thread):
 	def server_list(self):
 		
 		
-		# Create socket
-		s = self.create_socket(self.server)
-		
 		# Request server list
-		s.sendall(b"server_list")
-		
-		# Receive server list
-		servers = recv_json(s)
+		servers = self.client.sync.server_list()
 
 		# Loop through server list and append them to the unfetched servers
 		for host, port in servers:
@@ -2532,19 +3458,6 @@ class ServerFetcher(th.Thread):
 		#	self.parent.unfetched_servers.append((host, port))
 
 
-	def create_socket(self, server):
-		
-		host = server.host
-		port = server.port
-		try:
-			s = socket.socket()
-			s.settimeout(10)
-			s.connect((host, port))
-			return s
-		except Exception:
-			return None
-
-
 class ServerPinger(th.Thread):
 
 
@@ -2590,6 +3503,9 @@ class ServerLoader(th.Thread):
 		self.ui = ui
 		self.server: Server = server
 
+		self.compression_stats = CompressionStats()
+		self.materializer = FileMaterializer()
+
 		self.setDaemon(True)
 
 		if sc4mp_ui != None:
@@ -2822,11 +3738,9 @@ class ServerLoader(th.Thread):
 						return False
 			if self.server.password == "":
 				return True
-			s = self.create_socket()
 			if self.ui is not None:
 				self.ui.label['text'] = "Authenticating..."
-			s.sendall(f"check_password {self.server.password}".encode())
-			if s.recv(SC4MP_BUFFER_SIZE) == b'y':
+			if self.server.request("check_password", self.server.password) == 'y':
 				if sc4mp_config["GENERAL"]["save_server_passwords"]:
 					try:
 						sc4mp_servers_database[self.server.server_id]["password"] = self.server.password
@@ -2957,260 +3871,397 @@ class ServerLoader(th.Thread):
 		# For keeping track of number of times the download is attempter
 		tries = 0
 
+		# Files completed so far, kept when a dropped connection is retried
+		self.completed = set()
+		resuming = False
+
+		# Number of times each checksum was received corrupted
+		self.checksum_mismatches = {}
+
+		# Regions are written to by the game, so only plugins are hard linked to the cache (unless it is full of linked files)
+		self.link_files = target == "plugins"
+
 		# Loop broken when the loading is successful, an unexpected error occurs, or the amount of tries is exceeded
 		while True:
 
 			try:
 
-				# Purge the destination directory
+				# Purge the destination directory, unless resuming after a dropped connection
 				self.report("", f"Synchronizing {target}...") #"", "Purging " + type + " directory...")
-				try:
-					purge_directory(destination)
-				except ClientException as e: 											# This is stupid
-					raise ClientException("SimCity 4 is already running!") from e		# #TODO better to check if the process is actually running
-
-				# Create the socket
-				s = self.create_socket()
-				#s.settimeout(None)
+				if not resuming:
+					try:
+						purge_directory(destination)
+					except ClientException as e: 											# This is stupid
+						raise ClientException("SimCity 4 is already running!") from e		# #TODO better to check if the process is actually running
 
 				# Report
 				self.report("", f"Synchronizing {target}...")
 
 				# Request the type of data
-				if not self.server.private:
-					s.sendall(target.encode())
-				else:
-					s.sendall(f"{target} {SC4MP_VERSION} {self.server.user_id} {self.server.password}".encode())
+				with self.server.stream(target, authenticated=self.server.private, options=get_transfer_options()) as (s, result):
 
-				# Receive file table
-				file_table = recv_json(s)
+					# Compress the file tables and files, and encode the file tables, as the server agreed to
+					codecs = get_transfer_codecs(result)
+					encoding = get_file_table_encoding(result)
+
+					# Continue partially received files if the server agreed to
+					resumable = is_transfer_resumable(result)
+
+					# Receive file table
+					reader = FrameReader(s, timeout=SC4MP_FILE_TABLE_DEADLINE)
+					file_table = receive_file_table(reader, encoding, codecs, stats=self.compression_stats)
+
+					# Get total download size
+					size = sum([entry[1] for entry in file_table])
+
+					# Total size downloaded
+					size_downloaded = 0
+
+					# Download percent
+					percent = 0
+
+					# Set loading bar at 0%
+					self.report_progress(f"Synchronizing {target}... (0%)", 0, 100)
+
+					# Prune file table as necessary
+					ft = []
+					offsets = {}
+					pruned_checksums = set()
+					for entry in file_table:
+
+						# Get necessary values from entry
+						checksum = sanitize_directory_name(entry[0])
+						filesize = entry[1]
+						relpath = Path(entry[2])
+
+						# Skip files completed before the connection dropped
+						if entry[2] in self.completed:
+							size_downloaded += filesize
+							continue
+
+						# Handle risky file types
+						if not sc4mp_config["GENERAL"]["ignore_risky_file_warnings"]:
+							if sc4mp_ui:
+								if (relpath.suffix.lower() in SC4MP_RISKY_FILE_EXTENSIONS) and (sc4mp_servers_database[self.server.server_id].get("allowed_files", {}).get(checksum, "") != relpath.name.lower()):
+									choice = messagebox.askyesnocancel(title=SC4MP_TITLE, message=f"You are about to download \"{relpath.name}\". This file could potentially harm your computer.\n\nWould you like to download it anyway?", icon="warning")
+									if choice is True:
+										sc4mp_servers_database[self.server.server_id].setdefault("allowed_files", {})
+										sc4mp_servers_database[self.server.server_id]["allowed_files"][checksum] = relpath.name.lower()
+									elif choice is False:
+										size_downloaded += filesize
+										continue
+									else:
+										raise ClientException("Connection cancelled.")
+							else:
+								print(f"[WARNING] Downloading risky file: \"{relpath.name}\"")
+
+						# For DLL plugins
+						if relpath.suffix == ".dll":
+							self.dll_plugin_paths.append((Path(destination) / relpath, "server"))
+
+						# Get path of cached file
+						t = sc4mp_cache_index.get_path(checksum)
+
+						# Use the cached file if it exists and has the same size, otherwise append the entry to the new file table
+						if sc4mp_cache_index.use(checksum, filesize):
+						
+							# Report
+							print(f'- using cached "{checksum}"')
+
+							# Set the destination
+							d = sanitize_relpath(Path(destination), relpath)
+
+							# Display current file in UI
+							try:
+								self.ui.progress_label["text"] = d.name #.relative_to(destination)
+								self.ui.duration_label["text"] = "Cache 🡒 SC4" #"(cached)"
+							except Exception:
+								pass
+
+							# Create the destination directory if necessary
+							d.parent.mkdir(parents=True, exist_ok=True)
+
+							# Delete the destination file if it exists
+							d.unlink(missing_ok=True)
+
+							# Link or copy the cached file to the destination
+							if self.materializer.materialize(t, d, link=self.link_files and not sc4mp_cache_index.full) == "link":
+								sc4mp_cache_index.set_linked(checksum)
+							self.completed.add(entry[2])
+
+							# Update progress bar
+							size_downloaded += filesize
+							old_percent = percent
+							percent = math.floor(100 * (size_downloaded / (size + 1)))
+							if percent > old_percent:
+								self.report_progress(f"Synchronizing {target}... ({percent}%)", percent, 100)
+
+
+						else:
+
+							# Continue the file from where it was left, if part of it was received before (only once per checksum)
+							part = t.with_name(f"{checksum}.part")
+							if resumable and checksum not in pruned_checksums and part.exists() and 0 < part.stat().st_size < filesize:
+								offsets[entry[2]] = part.stat().st_size
+								size_downloaded += offsets[entry[2]]
+
+							# Append to new file table
+							ft.append(entry)
+							pruned_checksums.add(checksum)
+					
+					file_table = ft
+
+					if sc4mp_ui:
+						self.ui.duration_label["text"] = "Server 🡒 SC4" #"(downloading)"
+
+					# Split the pruned file table between the download streams, balanced by size
+					file_tables = split_file_table(file_table, get_download_stream_count(file_table, self.server))
+
+					# Send the pruned file table of the first stream, and where to continue its partially received files
+					send_file_table(s, file_tables[0], encoding, compressed=bool(codecs), stats=self.compression_stats)
+					if resumable:
+						send_json(s, get_resume_offsets(file_tables[0], offsets))
+
+					# The files can take as long as they need, as long as the connection stays alive
+					reader.set_deadline(None)
+
+					# Receive files, the first stream's over this connection and the others' over their own
+					self.download_files(target, destination, file_tables, reader, codecs, offsets if resumable else {}, size, size_downloaded)
+
+				# Delete the partially received files abandoned by earlier loads, then write the cache index
+				sc4mp_cache_index.clean_parts()
+				sc4mp_cache_index.save()
+
+				self.report_progress(f"Synchronizing {target}... (100%)", 100, 100)
+
+				# Report compression, and how the files were placed
+				if self.compression_stats.codecs:
+					print(f"- {self.compression_stats}")
+				print(f"- files materialized: {self.materializer}")
+
+				break
 
-				# Get total download size
-				size = sum([entry[1] for entry in file_table])
+			except ChecksumMismatch as e:
 
-				# Total size downloaded
-				size_downloaded = 0
+				# Receive the corrupted file again, keeping the files completed so far
+				resuming = True
 
-				# Download percent
-				percent = 0
+				show_error(e, no_ui=True)
 
-				# Set loading bar at 0%
-				self.report_progress(f"Synchronizing {target}... (0%)", 0, 100)
+			except (socket.error, socket.timeout) as e:
 
-				# Prune file table as necessary
-				ft = []
-				for entry in file_table:
+				#tries += 1
 
-					# Get necessary values from entry
-					checksum = sanitize_directory_name(entry[0])
-					filesize = entry[1]
-					relpath = Path(entry[2])
+				#if tries < 5:
 
-					# Handle risky file types
-					if not sc4mp_config["GENERAL"]["ignore_risky_file_warnings"]:
-						if sc4mp_ui:
-							if (relpath.suffix.lower() in SC4MP_RISKY_FILE_EXTENSIONS) and (sc4mp_servers_database[self.server.server_id].get("allowed_files", {}).get(checksum, "") != relpath.name.lower()):
-								choice = messagebox.askyesnocancel(title=SC4MP_TITLE, message=f"You are about to download \"{relpath.name}\". This file could potentially harm your computer.\n\nWould you like to download it anyway?", icon="warning")
-								if choice is True:
-									sc4mp_servers_database[self.server.server_id].setdefault("allowed_files", {})
-									sc4mp_servers_database[self.server.server_id]["allowed_files"][checksum] = relpath.name.lower()
-								elif choice is False:
-									size_downloaded += filesize
-									continue
-								else:
-									raise ClientException("Connection cancelled.")
-						else:
-							print(f"[WARNING] Downloading risky file: \"{relpath.name}\"")
+				# Keep the files completed so far, and continue the partially received ones
+				resuming = True
 
-					# For DLL plugins
-					if relpath.suffix == ".dll":
-						self.dll_plugin_paths.append((Path(destination) / relpath, "server"))
+				self.connection_failed_retrying(e)
 
-					# Get path of cached file
-					t = Path(SC4MP_LAUNCHPATH) / "_Cache" / checksum
+				#else:
 
-					# Use the cached file if it exists and has the same size, otherwise append the entry to the new file table
-					if t.exists() and t.stat().st_size == filesize:
-						
-						# Report
-						print(f'- using cached "{checksum}"')
+					#raise ClientException("Maximum connection attemps exceeded. Check your internet connection and firewall settings, then try again.\n\n" + str(e))
 
-						# Set the destination
-						d = sanitize_relpath(Path(destination), relpath)
 
-						# Display current file in UI
-						try:
-							self.ui.progress_label["text"] = d.name #.relative_to(destination)
-							self.ui.duration_label["text"] = "Cache 🡒 SC4" #"(cached)"
-						except Exception:
-							pass
+	def download_files(self, target, destination, file_tables, reader, codecs, offsets, size, size_downloaded):
+		"""
+		Downloads the files in each file table over a stream of its own, and 
+		reports the progress of all of them. `offsets` maps the relative paths 
+		of partially received files to where to continue them.
+		"""
 
-						# Create the destination directory if necessary
-						d.parent.mkdir(parents=True, exist_ok=True)
+		self.size_received = 0
+		self.wire_size_received = 0
+		self.receiving_name = None
+		self.receive_lock = th.Lock()
+		self.receive_cancelled = th.Event()
+		self.rate_limiter = get_rate_limiter()
 
-						# Delete the destination file if it exists
-						d.unlink(missing_ok=True)
+		total_size_to_download = sum(entry[1] for file_table in file_tables for entry in file_table) - sum(offsets.values())
 
-						# Copy the cached file to the destination
-						shutil.copy(t, d)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=len(file_tables)) as executor:
 
-						# Update progress bar
-						size_downloaded += filesize
-						old_percent = percent
-						percent = math.floor(100 * (size_downloaded / (size + 1)))
-						if percent > old_percent:
-							self.report_progress(f"Synchronizing {target}... ({percent}%)", percent, 100)
+			# The first stream uses the connection the file table came over
+			futures = [executor.submit(self.receive_files, reader, destination, file_tables[0], codecs, offsets)]
+			for file_table in file_tables[1:]:
+				futures.append(executor.submit(self.download_stream, target, destination, file_table, offsets))
 
+			percent = math.floor(100 * (size_downloaded / (size + 1)))
 
-					else:
+			download_start_time = time.time() + 2
 
-						# Append to new file table
-						ft.append(entry)
-					
-				file_table = ft
+			old_eta = None
+			old_eta_display_time = download_start_time + 2
 
-				if sc4mp_ui:
-					self.ui.duration_label["text"] = "Server 🡒 SC4" #"(downloading)"
+			try:
 
-				download_start_time = time.time() + 2
+				while True:
 
-				total_size_to_download = sum([entry[1] for entry in file_table])
-				total_size_already_downloaded = 0.0
+					done, not_done = concurrent.futures.wait(futures, timeout=SC4MP_DELAY, return_when=concurrent.futures.FIRST_EXCEPTION)
 
-				old_eta = None
-				old_eta_display_time = download_start_time + 2
+					with self.receive_lock:
+						total_size_already_downloaded = self.size_received
 
-				# Send pruned file table
-				send_json(s, file_table)
+					# Update progress bar
+					old_percent = percent
+					percent = math.floor(100 * ((size_downloaded + total_size_already_downloaded) / (size + 1)))
+					if percent > old_percent:
+						self.report_progress(f"Synchronizing {target}... ({percent}%)", percent, 100)
 
-				# Receive files
-				for entry in file_table:
+					# Display current file and ETA in UI
+					if sc4mp_ui is not None:
+						try:
+							if self.receiving_name is not None:
+								self.ui.progress_label["text"] = self.receiving_name
+							now = time.time()
+							if total_size_already_downloaded > 0 and now > download_start_time:
+								eta = int((total_size_to_download - total_size_already_downloaded) / (total_size_already_downloaded / float(now - download_start_time)))
+								if (eta < 86400) and (old_eta is None or (old_eta > eta or int(now - old_eta_display_time) > 5)) and float(now - old_eta_display_time) >= .8:
+									old_eta = eta
+									old_eta_display_time = now
+									hours = math.floor(eta / 3600)
+									eta -= hours * 3600
+									minutes = math.floor(eta / 60)
+									eta -= minutes * 60
+									seconds = eta
+									if hours > 0:
+										self.ui.duration_label["text"] = f"{hours}:{minutes:0>{2}}:{seconds:0>{2}}"
+									else:
+										self.ui.duration_label["text"] = f"{minutes}:{seconds:0>{2}}"
+						except Exception:
+							pass
 
-					# Get necessary values from entry
-					checksum = sanitize_directory_name(entry[0])
-					filesize = entry[1]
-					relpath = Path(entry[2])
+					if not not_done or any(future.exception() is not None for future in done):
+						break
 
-					# Report
-					print(f'- caching "{checksum}"...')
+			finally:
 
-					# Set the destination
-					d = sanitize_relpath(Path(destination), relpath)
+				# Stop the other streams if one failed
+				self.receive_cancelled.set()
 
-					# Display current file in UI
-					try:
-						self.ui.progress_label["text"] = d.name #.relative_to(destination)
-					except Exception:
-						pass
+		# Raise the error that stopped the download, rather than those of the streams stopped because of it
+		errors = [future.exception() for future in futures if future.exception() is not None]
+		if errors:
+			raise next((error for error in errors if not isinstance(error, DownloadCancelled)), errors[0])
 
-					# Set path of cached file
-					t = Path(SC4MP_LAUNCHPATH) / "_Cache" / checksum
+		# Report throughput
+		if self.size_received > 0:
+			report_throughput(self.size_received, time.time() - download_start_time + 2, self.rate_limiter, self.wire_size_received)
 
-					# Create the destination directory if necessary
-					d.parent.mkdir(parents=True, exist_ok=True)
 
-					# Delete the destination file if it exists
-					d.unlink(missing_ok=True)
+	def download_stream(self, target, destination, file_table, offsets):
+		"""Downloads the files in a file table over a new connection."""
 
-					# Delete the cache file if it exists
-					t.unlink(missing_ok=True)
-
-					# Delete cache files if cache too large to accomadate the new cache file
-					cache_directory = Path(SC4MP_LAUNCHPATH) / "_Cache"
-					while any(cache_directory.iterdir()) and directory_size(cache_directory) > (1000000 * int(sc4mp_config["STORAGE"]["cache_size"])) - filesize:
-						random_cache = random.choice(list(cache_directory.iterdir()))
-						random_cache.unlink()
-
-					# Receive the file. Write to both the destination and cache
-					filesize_read = 0
-					with d.open("wb") as dest, t.open("wb") as cache:
-						while filesize_read < filesize:
-							filesize_remaining = filesize - filesize_read
-							buffersize = SC4MP_BUFFER_SIZE if filesize_remaining > SC4MP_BUFFER_SIZE else filesize_remaining
-							bytes_read = s.recv(buffersize)
-							if not bytes_read:
-								break
-							for file in [dest, cache]:
-								file.write(bytes_read)
-							filesize_read += len(bytes_read)
-							total_size_already_downloaded += len(bytes_read)
-							size_downloaded += len(bytes_read)
-							old_percent = percent
-							percent = math.floor(100 * (size_downloaded / (size + 1)))
-							if percent > old_percent:
-								self.report_progress(f"Synchronizing {target}... ({percent}%)", percent, 100)
-							if sc4mp_ui is not None:
-								try:
-									now = time.time()
-									eta = int((total_size_to_download - total_size_already_downloaded) / (total_size_already_downloaded / float(now - download_start_time)))
-									if (eta < 86400) and (old_eta is None or (old_eta > eta or int(now - old_eta_display_time) > 5)) and float(now - old_eta_display_time) >= .8:
-										old_eta = eta
-										old_eta_display_time = now
-										hours = math.floor(eta / 3600)
-										eta -= hours * 3600
-										minutes = math.floor(eta / 60)
-										eta -= minutes * 60
-										seconds = eta
-										if hours > 0:
-											self.ui.duration_label["text"] = f"{hours}:{minutes:0>{2}}:{seconds:0>{2}}"
-										else:
-											self.ui.duration_label["text"] = f"{minutes}:{seconds:0>{2}}"
-								except ZeroDivisionError as e:
-									show_error(e, no_ui=True) # Lazy solution
+		with self.server.stream(target, authenticated=self.server.private, options=get_transfer_options()) as (s, result):
 
-				self.report_progress(f"Synchronizing {target}... (100%)", 100, 100)
+			codecs = get_transfer_codecs(result)
+			encoding = get_file_table_encoding(result)
 
-				break
+			# Receive the file table, which the first stream already has
+			reader = FrameReader(s, timeout=SC4MP_FILE_TABLE_DEADLINE)
+			receive_file_table(reader, encoding, codecs, stats=self.compression_stats)
 
-			except (socket.error, socket.timeout) as e:
+			# Send this stream's share of the pruned file table, and where to continue its partially received files
+			send_file_table(s, file_table, encoding, compressed=bool(codecs), stats=self.compression_stats)
+			if is_transfer_resumable(result):
+				send_json(s, get_resume_offsets(file_table, offsets))
+			else:
+				offsets = {}
 
-				#tries += 1
+			reader.set_deadline(None)
 
-				#if tries < 5:
+			self.receive_files(reader, destination, file_table, codecs, offsets)
 
-				self.connection_failed_retrying(e)
 
-				#else:
+	def receive_files(self, reader, destination, file_table, codecs, offsets):
+		"""
+		Receives the files in a pruned file table, writing them to a `.part` 
+		file in the cache, which is renamed once complete and verified against 
+		its checksum, then linked or copied to the destination. Files with an 
+		offset in `offsets` are continued from their `.part` file.
+		"""
 
-					#raise ClientException("Maximum connection attemps exceeded. Check your internet connection and firewall settings, then try again.\n\n" + str(e))
+		for entry in file_table:
 
+			# Get necessary values from entry
+			checksum = sanitize_directory_name(entry[0])
+			filesize = entry[1]
+			relpath = Path(entry[2])
 
-	def create_socket(self):
-		
+			# Report
+			print(f'- caching "{checksum}"...')
 
-		host = self.server.host
-		port = self.server.port
+			# Set the destination
+			d = sanitize_relpath(Path(destination), relpath)
 
-		s = socket.socket()
+			# Display current file in UI
+			self.receiving_name = d.name
 
-		s.settimeout(10)
+			# Set path of cached file, and of the part received so far
+			t = sc4mp_cache_index.get_path(checksum)
+			part = t.with_name(f"{checksum}.part")
+			offset = offsets.get(entry[2], 0)
 
-		#tries_left = 5
+			# Create the destination and cache directories if necessary
+			d.parent.mkdir(parents=True, exist_ok=True)
+			t.parent.mkdir(parents=True, exist_ok=True)
 
-		#while True:
+			# Track the part, in case it is abandoned
+			sc4mp_cache_index.add_part(checksum)
 
-		#	try:
+			# Delete the destination file if it exists
+			d.unlink(missing_ok=True)
 
-		self.report("", "Connecting...")
-		s.connect((host, port))
+			# Delete the cache file if it exists
+			sc4mp_cache_index.remove(checksum)
 
-		self.report("", "Connected.")
+			# Evict the least recently used cache files if the cache is too large to accomadate the new cache file
+			sc4mp_cache_index.make_room(filesize, 1000000 * int(sc4mp_config["STORAGE"]["cache_size"]))
 
-		#		break
+			# Hash the file as it is received, starting with the part received before
+			digest = hashlib.md5()
+			if offset:
+				print(f'- continuing "{checksum}" from {offset:,} bytes')
+				with part.open("rb") as received:
+					for chunk in read_chunks(received):
+						digest.update(chunk)
 
-		#	except socket.error as e:
-				
-		#		if tries_left > 0:
-				
-		#			self.connection_failed_retrying(e)
+			# Receive the rest of the file to the cache
+			with part.open("ab" if offset else "wb") as cache:
+				for chunk in reader.recv_file_chunks(filesize - offset, compressed=bool(codecs), stats=self.compression_stats, callback=self.received_from_wire, rate_limiter=self.rate_limiter):
+					if self.receive_cancelled.is_set():
+						raise DownloadCancelled("Download cancelled.")
+					digest.update(chunk)
+					cache.write(chunk)
+					with self.receive_lock:
+						self.size_received += len(chunk)
 
-		#			tries_left -= 1
+			# Cache the file only if it matches its checksum, otherwise receive it again
+			try:
+				verified = check_received_file(checksum, digest, self.checksum_mismatches)
+			except ChecksumMismatch:
+				part.unlink(missing_ok=True)
+				raise
+
+			# Link or copy the file to the destination, then move it into the cache (a link follows it)
+			method = self.materializer.materialize(part, d, link=self.link_files and not sc4mp_cache_index.full)
+			if verified:
+				part.replace(t)
+				sc4mp_cache_index.add(checksum, filesize, self.server.server_id)
+				if method == "link":
+					sc4mp_cache_index.set_linked(checksum)
+			else:
+				part.unlink()
+			with self.receive_lock:
+				self.completed.add(entry[2])
 
-		#		else:
 
-		#			raise ClientException("Maximum connection attempts exceeded. Check your internet connection and firewall settings, then try again.") from e
+	def received_from_wire(self, size):
+		"""Counts the bytes read from the socket, which are fewer than those written if compressed."""
 
-		return s
+		with self.receive_lock:
+			self.wire_size_received += size
 
 
 	def receive_file(self, s: socket.socket, filename: Path) -> None:
@@ -3472,8 +4523,8 @@ class GameMonitor(th.Thread):
 			# Declare variable to break loop after the game closes
 			end = False
 
-			# Used for refresh stuff (`cfg_hashcode` is the md5 of `SimCity 4.cfg`)
-			cfg_hashcode = None
+			# Used for refresh stuff (`cfg_signature` is the size, modification time and inode of `SimCity 4.cfg`)
+			cfg_signature = None
 			old_refresh_region_open = False
 
 			# Set initial status in UI
@@ -3575,15 +4626,11 @@ class GameMonitor(th.Thread):
 								# Filter the savegames if more than two are found
 								if len(save_city_paths) > 2:
 									try:
-										savegames = []
-										for save_city_path in save_city_paths:
-											savegame = SC4Savegame(save_city_path, error_callback=None)
-											savegame.get_SC4ReadRegionalCity()
-											savegames.append(savegame)
+										savegames = {save_city_path: sc4mp_savegame_cache.get_SC4ReadRegionalCity(save_city_path) for save_city_path in save_city_paths}
+										sc4mp_savegame_cache.save()
 										filtered_savegames = self.filter_bordering_tiles(savegames)
 										if len(filtered_savegames) == 1:
-											save_city_paths = [savegame.filename for savegame in filtered_savegames]
-											[savegame.close() for savegame in savegames]
+											save_city_paths = filtered_savegames
 											break
 									except Exception as e:
 										show_error(e, no_ui=True)
@@ -3635,8 +4682,8 @@ class GameMonitor(th.Thread):
 					# Refresh
 					cfg_path = get_sc4_cfg_path()
 					try:
-						new_cfg_hashcode = md5(cfg_path)
-						if cfg_hashcode != None and new_cfg_hashcode != cfg_hashcode:
+						new_cfg_signature = get_file_signature(cfg_path)
+						if cfg_signature != None and new_cfg_signature != cfg_signature:
 							#print("Region switched!")
 							sync_simcity_4_cfg()
 							new_refresh_region_open = refresh_region_open()
@@ -3664,7 +4711,7 @@ class GameMonitor(th.Thread):
 										self.set_overlay_state("refreshed")
 									#self.ui.label["text"] = old_text
 							old_refresh_region_open = new_refresh_region_open
-						cfg_hashcode = new_cfg_hashcode
+						cfg_signature = new_cfg_signature
 					except Exception as e:
 						show_error(f"An unexpected error occurred while refreshing regions.\n\n{e}", no_ui=True)
 					
@@ -3764,32 +4811,33 @@ class GameMonitor(th.Thread):
 				#print('Downloading "' + filename + '" (' + str(filesize_read) + " / " + str(filesize) + " bytes)...", int(filesize_read), int(filesize)) #os.path.basename(os.path.normpath(filename))
 
 
-	def filter_bordering_tiles(self, savegames):
+	def filter_bordering_tiles(self, savegames: dict[Path, dict]) -> list[Path]:
+		"""Takes the region view data of each savegame by path, and returns the paths of the savegames bordering all the others."""
 
 		#report("Savegame filter 1", self)
 
 		filtered_savegames = []
 
-		for savegame in savegames:
+		for savegame, regional_city in savegames.items():
 
 			add = True
 
-			savegameX = savegame.SC4ReadRegionalCity["tileXLocation"]
-			savegameY = savegame.SC4ReadRegionalCity["tileYLocation"]
+			savegameX = regional_city["tileXLocation"]
+			savegameY = regional_city["tileYLocation"]
 
-			savegameSizeX = savegame.SC4ReadRegionalCity["citySizeX"]
-			savegameSizeY = savegame.SC4ReadRegionalCity["citySizeY"]
+			savegameSizeX = regional_city["citySizeX"]
+			savegameSizeY = regional_city["citySizeY"]
 
-			for neighbor in savegames:
+			for neighbor, neighbor_regional_city in savegames.items():
 
 				if neighbor == savegame:
 					continue
 
-				neighborX = neighbor.SC4ReadRegionalCity["tileXLocation"]
-				neighborY = neighbor.SC4ReadRegionalCity["tileYLocation"]
+				neighborX = neighbor_regional_city["tileXLocation"]
+				neighborY = neighbor_regional_city["tileYLocation"]
 
-				neighborSizeX = neighbor.SC4ReadRegionalCity["citySizeX"]
-				neighborSizeY = neighbor.SC4ReadRegionalCity["citySizeY"]
+				neighborSizeX = neighbor_regional_city["citySizeX"]
+				neighborSizeY = neighbor_regional_city["citySizeY"]
 
 				conditionX1 = (neighborX == savegameX - neighborSizeX)
 				conditionX2 = (neighborX == savegameX + savegameSizeX)
@@ -3850,48 +4898,73 @@ class GameMonitor(th.Thread):
 		else:
 			region = list(regions)[0]
 
-		# Create socket
-		#self.report(self.PREFIX, 'Saving: connecting to server...')
-		s = self.create_socket()
-		if s == None:
-			self.report(self.PREFIX, 'Save push failed! Server unreachable.', color="red") #'Unable to save the city "' + new_city + '" because the server is unreachable.'
-			self.set_overlay_state("not-saved")
-			return
-
 		# Send save request
 		#self.report(self.PREFIX, 'Saving: sending save request...')
-		s.sendall(f"save {SC4MP_VERSION} {self.server.user_id} {self.server.password}".encode())
-		
+		with self.server.stream("save", authenticated=True, options=get_transfer_options()) as (s, result):
+			self.send_save(s, region, save_city_paths, salvage_directory, get_transfer_codecs(result))
+
+
+	def send_save(self, s: socket.socket, region: str, save_city_paths: list[Path], salvage_directory: Path, codecs: list) -> None:
+
 		# Separator
 		s.recv(SC4MP_BUFFER_SIZE)
 
 		# Send region name and file sizes
 		#self.report(self.PREFIX, 'Saving: sending metadata...')
+		filesizes = [os.path.getsize(save_city_path) for save_city_path in save_city_paths]
 		send_json(s, [
 			region,
-			[os.path.getsize(save_city_path) for save_city_path in save_city_paths]
+			filesizes
 		])
 
 		# Separator
 		s.recv(SC4MP_BUFFER_SIZE)
 
 		# Send file contents
-		total_filesize = sum([save_city_path.stat().st_size for save_city_path in save_city_paths])
+		total_filesize = sum(filesizes)
 		filesize_sent = 0
 		filesize_reported = None
 		#self.report(self.PREFIX, f'Saving: sending gamedata...') # ({format_filesize(total_filesize)})...')
-		for save_city_path in save_city_paths:
+		compression_stats = CompressionStats()
+		rate_limiter = get_rate_limiter(background=True)
+		send_start_time = time.time()
+
+		wire_size_sent = 0
+
+		def sent_over_wire(size):
+			nonlocal wire_size_sent
+			wire_size_sent += size
+
+		def report_sent(size):
+			nonlocal filesize_sent, filesize_reported
+			filesize_sent += size
+			if filesize_sent == total_filesize or filesize_reported is None or filesize_sent > filesize_reported + 100000:
+				filesize_reported = filesize_sent
+				self.report_quietly(f'Saving... ({round(filesize_sent / 1000):,}/{round(total_filesize / 1000):,}KB)') #self.report_quietly(f'Saving: sending gamedata ({format_filesize(filesize_sent, scale=total_filesize)[:-2]}/{format_filesize(total_filesize)})...')
+
+		def send_file_callback(size):
+			sent_over_wire(size)
+			report_sent(size)
+
+		def read_file(file):
+			for data in read_chunks(file):
+				yield data
+				report_sent(len(data))
+
+		for save_city_path, filesize in zip(save_city_paths, filesizes):
 			#self.report(self.PREFIX, f'Saving: sending files ({save_city_paths.index(save_city_path) + 1} of {len(save_city_paths)})...')
 			with open(save_city_path, "rb") as file:
-				while True:
-					data = file.read(SC4MP_BUFFER_SIZE)
-					if not data:
-						break
-					s.sendall(data)
-					filesize_sent += len(data)
-					if filesize_sent == total_filesize or filesize_reported is None or filesize_sent > filesize_reported + 100000:
-						filesize_reported = filesize_sent
-						self.report_quietly(f'Saving... ({round(filesize_sent / 1000):,}/{round(total_filesize / 1000):,}KB)') #self.report_quietly(f'Saving: sending gamedata ({format_filesize(filesize_sent, scale=total_filesize)[:-2]}/{format_filesize(total_filesize)})...')
+
+				# Compress the savegame if the server agreed to, otherwise send it straight from the file
+				if codecs:
+					send_compressed(s, read_file(file), choose_codec(save_city_path, filesize, codecs), compression_stats, callback=sent_over_wire, rate_limiter=rate_limiter)
+				else:
+					send_file(s, file, count=filesize, callback=send_file_callback, rate_limiter=rate_limiter)
+
+		# Report throughput and compression
+		report_throughput(filesize_sent, time.time() - send_start_time, rate_limiter, wire_size_sent)
+		if compression_stats.codecs:
+			print(f"- {compression_stats}")
 
 		# Send file count
 		#s.sendall(str(len(save_city_paths)).encode())
@@ -3930,9 +5003,6 @@ class GameMonitor(th.Thread):
 			self.report(self.PREFIX + "[WARNING] ", f"Save push failed! {response}", color="red")
 			self.set_overlay_state("not-saved")
 
-		# Close socket
-		s.close()
-
 
 	def backup_city(self, city_path: Path) -> None:
 		
@@ -3944,50 +5014,6 @@ class GameMonitor(th.Thread):
 		shutil.copy(city_path, destination.with_suffix(".sc4"))
 
 
-	def create_socket(self):
-		
-
-		host = self.server.host
-		port = self.server.port
-
-		s = socket.socket()
-
-		s.settimeout(10)
-
-		#tries_left = 3
-
-		#while True:
-
-		#	try:
-
-				#self.report("", "Connecting...")
-		s.connect((host, port))
-
-				#self.report("", "Connected.")
-
-		#		break
-
-		#	except socket.error as e:
-				
-		#		if tries_left > 0:
-				
-		#			show_error(e, no_ui=True)
-
-		#			count = 5
-		#			while count > 0:
-		#				self.report("[WARNING] ", f"Connection failed. Retrying in {count}...")
-		#				count = count - 1
-		#				time.sleep(1)
-
-		#			tries_left = tries_left - 1
-
-		#		else:
-
-		#			return None
-
-		return s
-
-
 	def send_file(self, s: socket.socket, filename: Path) -> None:
 		
 
@@ -4001,11 +5027,7 @@ class GameMonitor(th.Thread):
 		s.recv(SC4MP_BUFFER_SIZE)
 
 		with filename.open("rb") as f:
-			while True:
-				bytes_read = f.read(SC4MP_BUFFER_SIZE)
-				if not bytes_read:
-					break
-				s.sendall(bytes_read)
+			send_file(s, f, count=filesize)
 
 
 	def ping(self):
@@ -4077,6 +5099,12 @@ class RegionsRefresher(th.Thread):
 		self.ui = ui
 		self.server = server
 
+		self.compression_stats = CompressionStats()
+		self.materializer = FileMaterializer()
+
+		# Number of times each checksum was received corrupted
+		self.checksum_mismatches = {}
+
 		self.setDaemon(True)
 
 
@@ -4099,143 +5127,183 @@ class RegionsRefresher(th.Thread):
 				for region in self.server.regions:
 					purge_directory(destination / region)
 
-				# Create the socket
-				s = self.create_socket()
-
 				# Request regions
-				if not self.server.private:
-					s.sendall(b"regions")
-				else:
-					s.sendall(f"regions {SC4MP_VERSION} {self.server.user_id} {self.server.password}".encode())
+				with self.server.stream("regions", authenticated=self.server.private, options=get_transfer_options()) as (s, result):
 
-				# Receive file table
-				file_table = recv_json(s)
+					# Compress the file tables and files, and encode the file tables, as the server agreed to
+					codecs = get_transfer_codecs(result)
+					encoding = get_file_table_encoding(result)
 
-				# Get total download size
-				size = sum([entry[1] for entry in file_table])
+					# Receive file table
+					reader = FrameReader(s, timeout=SC4MP_FILE_TABLE_DEADLINE)
+					file_table = receive_file_table(reader, encoding, codecs, stats=self.compression_stats)
 
-				# Total size downloaded
-				size_downloaded = 0
+					# Get total download size
+					size = sum([entry[1] for entry in file_table])
 
-				# Download percent
-				percent = 0
+					# Total size downloaded
+					size_downloaded = 0
 
-				# Set loading bar at 0%
-				self.report_progress("Refreshing regions... (0%)", 0, 100)
+					# Download percent
+					percent = 0
 
-				# Prune file table as necessary
-				ft = []
-				for entry in file_table:
+					# Set loading bar at 0%
+					self.report_progress("Refreshing regions... (0%)", 0, 100)
 
-					# Get necessary values from entry
-					checksum = sanitize_directory_name(entry[0])
-					filesize = entry[1]
-					relpath = Path(entry[2])
+					# Prune file table as necessary
+					ft = []
+					for entry in file_table:
+
+						# Get necessary values from entry
+						checksum = sanitize_directory_name(entry[0])
+						filesize = entry[1]
+						relpath = Path(entry[2])
 
-					# Get path of cached file
-					t = Path(SC4MP_LAUNCHPATH) / "_Cache" / checksum
+						# Get path of cached file
+						t = sc4mp_cache_index.get_path(checksum)
 
-					# Use the cached file if it exists and has the same size, otherwise append the entry to the new file table
-					if t.exists() and t.stat().st_size == filesize:
+						# Use the cached file if it exists and has the same size, otherwise append the entry to the new file table
+						if sc4mp_cache_index.use(checksum, filesize):
 						
-						# Report
-						print(f'- using cached "{checksum}"')
+							# Report
+							print(f'- using cached "{checksum}"')
 
-						# Set the destination
-						d = sanitize_relpath(Path(destination), relpath)
+							# Set the destination
+							d = sanitize_relpath(Path(destination), relpath)
 
-						# Display current file in UI
-						try:
-							self.ui.progress_label["text"] = d.name #.relative_to(destination)
-							self.ui.duration_label["text"] = "Cache 🡒 SC4" #"(cached)"
-						except Exception:
-							pass
+							# Display current file in UI
+							try:
+								self.ui.progress_label["text"] = d.name #.relative_to(destination)
+								self.ui.duration_label["text"] = "Cache 🡒 SC4" #"(cached)"
+							except Exception:
+								pass
 
-						# Create the destination directory if necessary
-						d.parent.mkdir(parents=True, exist_ok=True)
+							# Create the destination directory if necessary
+							d.parent.mkdir(parents=True, exist_ok=True)
 
-						# Delete the destination file if it exists
-						d.unlink(missing_ok=True)
+							# Delete the destination file if it exists
+							d.unlink(missing_ok=True)
 
-						# Copy the cached file to the destination
-						shutil.copy(t, d)
+							# Copy the cached file to the destination (regions are written to by the game, so they are never linked)
+							self.materializer.materialize(t, d, link=False)
 
-						# Update progress bar
-						size_downloaded += filesize
-						old_percent = percent
-						percent = math.floor(100 * (size_downloaded / (size + 1)))
-						if percent > old_percent:
-							self.report_progress(f"Refreshing regions... ({percent}%)", percent, 100)
+							# Update progress bar
+							size_downloaded += filesize
+							old_percent = percent
+							percent = math.floor(100 * (size_downloaded / (size + 1)))
+							if percent > old_percent:
+								self.report_progress(f"Refreshing regions... ({percent}%)", percent, 100)
 
-					else:
+						else:
 
-						# Append to new file table
-						ft.append(entry)
+							# Append to new file table
+							ft.append(entry)
 					
-				file_table = ft
+					file_table = ft
 
-				# Send pruned file table
-				send_json(s, file_table)
+					# Send pruned file table
+					send_file_table(s, file_table, encoding, compressed=bool(codecs), stats=self.compression_stats)
 
-				# Receive files
-				for entry in file_table:
+					# Partially received files are not continued, since the regions are refreshed from scratch
+					if is_transfer_resumable(result):
+						send_json(s, [])
 
-					# Get necessary values from entry
-					checksum = sanitize_directory_name(entry[0])
-					filesize = entry[1]
-					relpath = Path(entry[2])
+					# The files can take as long as they need, as long as the connection stays alive
+					reader.set_deadline(None)
 
-					# Report
-					print(f'- caching "{checksum}"...')
+					# Hold the download to the background rate, since the game is running
+					rate_limiter = get_rate_limiter(background=True)
+					download_start_time = time.time()
+					size_received = 0
+					wire_size_received = 0
 
-					# Set the destination
-					d = sanitize_relpath(Path(destination), relpath)
+					def received_from_wire(size):
+						nonlocal wire_size_received
+						wire_size_received += size
 
-					# Display current file in UI
-					try:
-						self.ui.progress_label["text"] = d.name #.relative_to(destination)
-						self.ui.duration_label["text"] = "Server 🡒 SC4" #"(downloading)"
-					except Exception:
-						pass
+					# Receive files
+					for entry in file_table:
 
-					# Set path of cached file
-					t = Path(SC4MP_LAUNCHPATH) / "_Cache" / checksum
+						# Get necessary values from entry
+						checksum = sanitize_directory_name(entry[0])
+						filesize = entry[1]
+						relpath = Path(entry[2])
 
-					# Create the destination directory if necessary
-					d.parent.mkdir(parents=True, exist_ok=True)
+						# Report
+						print(f'- caching "{checksum}"...')
 
-					# Delete the destination file if it exists
-					d.unlink(missing_ok=True)
+						# Set the destination
+						d = sanitize_relpath(Path(destination), relpath)
 
-					# Delete the cache file if it exists
-					t.unlink(missing_ok=True)
-
-					# Delete cache files if cache too large to accomadate the new cache file
-					cache_directory = Path(SC4MP_LAUNCHPATH) / "_Cache"
-					while any(cache_directory.iterdir()) and directory_size(cache_directory) > (1000000 * int(sc4mp_config["STORAGE"]["cache_size"])) - filesize:
-						random_cache = random.choice(list(cache_directory.iterdir()))
-						random_cache.unlink()
-
-					# Receive the file. Write to both the destination and cache
-					filesize_read = 0
-					with d.open("wb") as dest, t.open("wb") as cache:
-						while filesize_read < filesize:
-							filesize_remaining = filesize - filesize_read
-							buffersize = SC4MP_BUFFER_SIZE if filesize_remaining > SC4MP_BUFFER_SIZE else filesize_remaining
-							bytes_read = s.recv(buffersize)
-							if not bytes_read:
-								break
-							for file in [dest, cache]:
-								file.write(bytes_read)
-							filesize_read += len(bytes_read)
-							size_downloaded += len(bytes_read)
-							old_percent = percent
-							percent = math.floor(100 * (size_downloaded / (size + 1)))
-							if percent > old_percent:
-								self.report_progress(f"Refreshing regions... ({percent}%)", percent, 100)
+						# Display current file in UI
+						try:
+							self.ui.progress_label["text"] = d.name #.relative_to(destination)
+							self.ui.duration_label["text"] = "Server 🡒 SC4" #"(downloading)"
+						except Exception:
+							pass
+
+						# Set path of cached file, and of the file it is received to
+						t = sc4mp_cache_index.get_path(checksum)
+						part = t.with_name(f"{checksum}.part")
+
+						# Create the destination and cache directories if necessary
+						d.parent.mkdir(parents=True, exist_ok=True)
+						t.parent.mkdir(parents=True, exist_ok=True)
+
+						# Track the part, in case it is abandoned
+						sc4mp_cache_index.add_part(checksum)
+
+						# Delete the destination file if it exists
+						d.unlink(missing_ok=True)
+
+						# Delete the cache file if it exists
+						sc4mp_cache_index.remove(checksum)
+
+						# Evict the least recently used cache files if the cache is too large to accomadate the new cache file
+						sc4mp_cache_index.make_room(filesize, 1000000 * int(sc4mp_config["STORAGE"]["cache_size"]))
+
+						# Receive the file to the cache, hashing it as it is received
+						digest = hashlib.md5()
+						with part.open("wb") as cache:
+							for chunk in reader.recv_file_chunks(filesize, compressed=bool(codecs), stats=self.compression_stats, callback=received_from_wire, rate_limiter=rate_limiter):
+								digest.update(chunk)
+								cache.write(chunk)
+								size_downloaded += len(chunk)
+								size_received += len(chunk)
+								old_percent = percent
+								percent = math.floor(100 * (size_downloaded / (size + 1)))
+								if percent > old_percent:
+									self.report_progress(f"Refreshing regions... ({percent}%)", percent, 100)
+
+						# Cache the file only if it matches its checksum, otherwise refresh again
+						try:
+							verified = check_received_file(checksum, digest, self.checksum_mismatches)
+						except ChecksumMismatch:
+							part.unlink(missing_ok=True)
+							raise
+
+						# Copy the file to the destination, then move it into the cache
+						self.materializer.materialize(part, d, link=False)
+						if verified:
+							part.replace(t)
+							sc4mp_cache_index.add(checksum, filesize, self.server.server_id)
+						else:
+							part.unlink()
+
+				# Write the cache index
+				sc4mp_cache_index.save()
 
 				self.report_progress("Refreshing regions... (100%)", 100, 100)
 
+				# Report throughput
+				if size_received > 0:
+					report_throughput(size_received, time.time() - download_start_time, rate_limiter, wire_size_received)
+
+				# Report compression, and how the files were placed
+				if self.compression_stats.codecs:
+					print(f"- {self.compression_stats}")
+				print(f"- files materialized: {self.materializer}")
+
 				# Receive file count
 				#file_count = int(s.recv(SC4MP_BUFFER_SIZE).decode())
 				#
@@ -4296,30 +5364,6 @@ class RegionsRefresher(th.Thread):
 		print(text)
 
 
-	def create_socket(self):
-		
-
-		host = self.server.host
-		port = self.server.port
-
-		s = socket.socket()
-
-		s.settimeout(10)
-
-		try:
-
-			self.report("", "Connecting...")
-			s.connect((host, port))
-
-			self.report("", "Connected.")
-
-		except socket.error as e:
-			
-			raise ClientException("Connection failed.\n\n" + str(e)) from e
-
-		return s
-
-
 class DatabaseManager(th.Thread):
 	
 
@@ -4405,6 +5449,32 @@ class DatabaseManager(th.Thread):
 		return self.data.__setitem__(key, value)
 
 
+class CacheMigrator(th.Thread):
+	"""Moves the files of a cache from before it was sharded into their shards, in the background."""
+
+
+	def __init__(self, cache_index: CacheIndex) -> None:
+
+		super().__init__()
+
+		self.cache_index = cache_index
+
+		self.setDaemon(True)
+
+
+	def run(self):
+
+		try:
+
+			set_thread_name("CmThread", enumerate=False)
+
+			self.cache_index.migrate()
+
+		except Exception as e:
+
+			show_error(f"An error occurred while migrating the cache.\n\n{e}", no_ui=True)
+
+
 # User Interfaces
 
 class UI(tk.Tk):
@@ -4887,6 +5957,7 @@ class StorageSettingsUI(tk.Toplevel):
 		
 		#if (messagebox.askokcancel(title=SC4MP_TITLE, message="Clear the download cache?", icon="warning")): #TODO make yes/no
 		purge_directory(Path(SC4MP_LAUNCHPATH) / "_Cache")
+		sc4mp_cache_index.clear()
 
 
 	def browse_path(self):
@@ -6146,25 +7217,23 @@ class ServerBackgroundUI(tk.Toplevel):
 
 		try:
 
-			s = socket.socket()
-			s.settimeout(10)
-			s.connect((self.server.host, self.server.port))
-		
-			s.send(b"background")
-
 			destination: Path = SC4MP_LAUNCHPATH / "_Temp" / "background.png"
 
 			if destination.exists():
 				os.unlink(destination)
 
-			with open(destination, "wb") as file:
-				while True:
-					data = s.recv(SC4MP_BUFFER_SIZE)
-					if not data:
-						break
-					if self.destroyed:
-						return
-					file.write(data)
+			# The image is sent until the connection closes, or over a session, after its size
+			with self.server.stream("background") as (s, size), open(destination, "wb") as file:
+				if size is None:
+					while True:
+						data = s.recv(SC4MP_BUFFER_SIZE)
+						if not data:
+							break
+						if self.destroyed:
+							return
+						file.write(data)
+				else:
+					FrameReader(s).recv_file(size, file)
 
 			if destination.stat().st_size > 0:
 
@@ -7013,18 +8082,10 @@ class ServerDetailsUI(tk.Toplevel):
 
 			for request in ["Plugins", "Regions"]:
 
-				s = socket.socket()
-				s.settimeout(10)
-				s.connect((self.server.host, self.server.port))
-
-				if not self.server.private:
-					s.send(request.lower().encode())
-				else:
-					s.send(f"{request.lower()} {SC4MP_VERSION} {self.server.user_id} {self.server.password}".encode())
-
-				file_table = recv_json(s)
-
-				s.close()
+				# Receive the file table, then request no files
+				with self.server.stream(request.lower(), authenticated=self.server.private) as (s, result):
+					file_table = recv_json(s)
+					send_json(s, [])
 
 				for entry in file_table:
 
@@ -7044,10 +8105,10 @@ class ServerDetailsUI(tk.Toplevel):
 					d = path.pop(0)
 
 					download_size = size
-					cached_file = SC4MP_LAUNCHPATH / "_Cache" / md5
+					cached_file = sc4mp_cache_index.stat(md5)
 
-					if cached_file.exists():
-						download_size -= cached_file.stat().st_size
+					if cached_file is not None:
+						download_size -= cached_file.st_size
 
 					entry[d] = [
 						download_size
@@ -8079,6 +9140,14 @@ class ClientException(Exception):
 		return self.message
 
 
+class DownloadCancelled(ConnectionAbortedError):
+	"""Raised by a download stream stopped because another one failed."""
+
+
+class ChecksumMismatch(ConnectionError):
+	"""Raised when a received file does not match its checksum, so that it is received again."""
+
+
 # Logger
 
 class Logger:
@@ -0,0 +1,597 @@
+import argparse
+import hashlib
+import os
+import random
+import secrets
+import socket
+import socketserver
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from core.networking import *
+
+
+STANDIN_VERSION = "0.0.0"
+
+STANDIN_SESSION_IDLE_TIMEOUT = 60
+STANDIN_EMULATION_SLICE_SIZE = 64 * 1024
+
+
+class NetworkEmulator:
+	"""
+	Emulated network conditions for the connections to a stand-in server.
+
+	Replies are delayed by `latency` seconds plus up to `jitter` seconds either 
+	way, each direction is capped at `bandwidth` bytes per second for the whole 
+	server and at `stream_bandwidth` for each connection, and `drop_rate` of 
+	the connections are reset somewhere in their first `drop_window` bytes sent.
+	"""
+
+
+	def __init__(self, latency=0, jitter=0, bandwidth=None, stream_bandwidth=None, drop_rate=0, drop_window=1000000, seed=None):
+
+		self.latency = latency
+		self.jitter = jitter
+		self.stream_bandwidth = stream_bandwidth
+		self.drop_rate = drop_rate
+		self.drop_window = drop_window
+
+		self.send_limiter = RateLimiter(bandwidth)
+		self.recv_limiter = RateLimiter(bandwidth)
+
+		# Separate generators, so the drops from a seed do not depend on how many replies were delayed
+		self.jitter_random = random.Random(None if seed is None else f"jitter-{seed}")
+		self.drop_random = random.Random(None if seed is None else f"drops-{seed}")
+		self.drops = 0
+		self.lock = threading.Lock()
+
+
+	@property
+	def enabled(self):
+
+		return bool(self.latency or self.jitter or self.send_limiter.rate or self.stream_bandwidth or self.drop_rate)
+
+
+	def get_delay(self):
+
+		if not self.jitter:
+			return self.latency
+
+		with self.lock:
+			return max(0, self.latency + self.jitter_random.uniform(-self.jitter, self.jitter))
+
+
+	def get_drop_position(self):
+		"""Returns how many bytes to send before resetting a new connection, or `None` to keep it."""
+
+		with self.lock:
+			if self.drop_random.random() < self.drop_rate:
+				return self.drop_random.randint(0, self.drop_window)
+
+
+	def wrap(self, s):
+
+		return EmulatedSocket(s, self) if self.enabled else s
+
+
+class EmulatedSocket:
+	"""Wraps an accepted socket, applying the conditions of a `NetworkEmulator` to it."""
+
+
+	def __init__(self, s, emulator):
+
+		self.socket = s
+		self.emulator = emulator
+
+		self.send_limiter = RateLimiter(emulator.stream_bandwidth)
+		self.recv_limiter = RateLimiter(emulator.stream_bandwidth)
+
+		self.drop_position = emulator.get_drop_position()
+
+		# Whether the next send is the reply to a request
+		self.replying = False
+
+
+	def __getattr__(self, name):
+
+		return getattr(self.socket, name)
+
+
+	def recv(self, size, *flags):
+
+		data = self.socket.recv(size, *flags)
+		self.received(len(data))
+
+		return data
+
+
+	def recv_into(self, buffer, size=0, *flags):
+
+		count = self.socket.recv_into(buffer, size, *flags)
+		self.received(count)
+
+		return count
+
+
+	def received(self, size):
+
+		self.replying = True
+
+		self.recv_limiter.consume(size)
+		self.emulator.recv_limiter.consume(size)
+
+
+	def send(self, data, *flags):
+
+		data = memoryview(data)[:STANDIN_EMULATION_SLICE_SIZE]
+		self.sendall(data)
+
+		return len(data)
+
+
+	def sendall(self, data, *flags):
+
+		# Wait out the round trip before the reply
+		if self.replying:
+			self.replying = False
+			time.sleep(self.emulator.get_delay())
+
+		view = memoryview(data)
+		for position in range(0, len(view), STANDIN_EMULATION_SLICE_SIZE):
+			self.transmit(view[position:position + STANDIN_EMULATION_SLICE_SIZE])
+
+
+	def sendfile(self, file, offset=0, count=None):
+
+		file.seek(offset)
+
+		sent = 0
+		while count is None or sent < count:
+			data = file.read(STANDIN_EMULATION_SLICE_SIZE if count is None else min(STANDIN_EMULATION_SLICE_SIZE, count - sent))
+			if not data:
+				break
+			self.sendall(data)
+			sent += len(data)
+
+		return sent
+
+
+	def transmit(self, data):
+
+		# Reset the connection once the drop position is reached
+		if self.drop_position is not None:
+			if len(data) >= self.drop_position:
+				self.socket.sendall(data[:self.drop_position])
+				self.drop()
+			self.drop_position -= len(data)
+
+		self.send_limiter.consume(len(data))
+		self.emulator.send_limiter.consume(len(data))
+
+		self.socket.sendall(data)
+
+
+	def drop(self):
+
+		with self.emulator.lock:
+			self.emulator.drops += 1
+
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+		self.socket.close()
+
+		raise ConnectionResetError("Connection dropped by the network emulator.")
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+	"""
+	A stand-in SC4MP server for testing and benchmarking the client locally.
+
+	Serves the files in the `Plugins` and `Regions` folders of `root` (eg. a
+	corpus written by `benchmark.py corpus`), and speaks both the legacy
+	one-shot protocol and the session protocol (unless `sessions` is `False`,
+	as with servers that predate it). Over sessions, file tables, files and 
+	saves are compressed if the client asks for it, unless `compression` is 
+	`False`, file tables are sent in the binary encoding and partially 
+	received files are continued if the client asks for it. Saves are 
+	received and discarded. Network conditions are emulated by `emulator`, 
+	if given.
+	"""
+
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 1024
+
+
+	def __init__(self, root, host="127.0.0.1", port=0, password=None, private=False, sessions=True, compression=True, server_list=None, server_id="standin", emulator=None):
+
+		self.root = Path(root)
+		self.password = password
+		self.private = private
+		self.sessions = sessions
+		self.compression = compression
+		self.server_list = server_list or []
+		self.server_id = server_id
+		self.emulator = emulator or NetworkEmulator()
+
+		# Hashed user IDs and their tokens
+		self.users = {}
+		self.users_lock = threading.Lock()
+
+		# Request counts, by command
+		self.requests = {}
+		self.connections = 0
+		self.stats_lock = threading.Lock()
+		self.compression_stats = CompressionStats()
+
+		self.file_tables = {
+			"plugins": self.get_file_table(self.root / "Plugins"),
+			"regions": self.get_file_table(self.root / "Regions"),
+		}
+
+		super().__init__((host, port), StandInHandler)
+
+		self.thread = None
+
+
+	@property
+	def address(self):
+
+		return self.server_address[:2]
+
+
+	def start(self):
+		"""Serves in a background thread."""
+
+		self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+		self.thread.start()
+
+		return self
+
+
+	def stop(self):
+
+		self.shutdown()
+		self.server_close()
+
+
+	def __enter__(self):
+
+		return self.start()
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+
+		self.stop()
+
+
+	def get_file_table(self, directory):
+		"""Returns the `[md5, size, relpath]` entries for the files in a directory."""
+
+		file_table = []
+
+		if not directory.exists():
+			return file_table
+
+		for path in sorted(directory.rglob("*")):
+			if path.is_file():
+				md5 = hashlib.md5()
+				with path.open("rb") as file:
+					while True:
+						data = file.read(1024 * 1024)
+						if not data:
+							break
+						md5.update(data)
+				file_table.append([md5.hexdigest(), path.stat().st_size, path.relative_to(directory).as_posix()])
+
+		return file_table
+
+
+	def get_info(self):
+
+		return {
+			"server_id": self.server_id,
+			"server_name": "Stand-in Server",
+			"server_description": "A local stand-in server for testing the client.",
+			"server_url": "",
+			"server_version": STANDIN_VERSION,
+			"password_enabled": self.password is not None,
+			"private": self.private,
+			"user_plugins_enabled": False,
+			"claim_duration": 30,
+			"max_region_claims": 0,
+			"godmode_filter": False,
+			"capabilities": (["session"] + (["compression"] if self.compression else [])) if self.sessions else [],
+		}
+
+
+	def check_credentials(self, credentials):
+		"""Checks the `(version, user_id, password)` sent with requests to a private or password protected server."""
+
+		if self.password is not None and (credentials is None or credentials[2] != self.password):
+			return False
+
+		if self.private and (credentials is None or hashlib.sha256(str(credentials[1]).encode()).hexdigest()[:32] not in self.users):
+			return False
+
+		return True
+
+
+	def count_request(self, command):
+
+		with self.stats_lock:
+			self.requests[command] = self.requests.get(command, 0) + 1
+
+
+class StandInHandler(socketserver.BaseRequestHandler):
+	"""Handles a connection to the stand-in server."""
+
+	# Commands answered by a single value
+	VALUE_COMMANDS = ["info", "ping", "time", "server_list", "token", "user_id", "check_password"]
+
+	# Commands followed by a data stream, and whether they require credentials
+	STREAM_COMMANDS = {"plugins": False, "regions": False, "save": True, "background": False}
+
+	# Commands sent with the version, user ID and password in the legacy protocol
+	CREDENTIAL_COMMANDS = ["token", "save"]
+
+
+	def handle(self):
+
+		s = self.server.emulator.wrap(self.request)
+		s.settimeout(STANDIN_SESSION_IDLE_TIMEOUT)
+
+		with self.server.stats_lock:
+			self.server.connections += 1
+
+		try:
+			command = s.recv(SC4MP_BUFFER_SIZE).decode()
+			if command == "session" and self.server.sessions:
+				self.handle_session(s)
+			else:
+				self.handle_legacy(s, command)
+		except (OSError, ValueError):
+			pass
+
+
+	def handle_legacy(self, s, command):
+
+		args = command.split(" ")
+		command = args.pop(0)
+
+		# Take the credentials sent with the request
+		credentials = None
+		if command in self.CREDENTIAL_COMMANDS or (command in ["plugins", "regions"] and len(args) >= 3):
+			credentials = tuple(args[:3])
+			args = args[3:]
+
+		self.server.count_request(command)
+
+		if command in self.VALUE_COMMANDS:
+			result = self.get_value(command, args, credentials)
+			if isinstance(result, str):
+				s.sendall(result.encode())
+			else:
+				send_json(s, result)
+		elif command in self.STREAM_COMMANDS:
+			if self.STREAM_COMMANDS[command] or self.server.private:
+				if not self.server.check_credentials(credentials):
+					return
+			if command == "background":
+				self.send_background(s)
+			else:
+				getattr(self, f"stream_{command}")(s, FrameReader(s), credentials, {})
+
+
+	def handle_session(self, s):
+
+		s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+		send_json(s, {"capabilities": ["session"], "server_version": STANDIN_VERSION})
+
+		reader = FrameReader(s)
+		credentials = None
+
+		while True:
+
+			try:
+				request = reader.recv_json()
+			except ConnectionClosed:
+				return
+
+			request_id = request.get("id")
+			command = request.get("command")
+			args = request.get("args", [])
+
+			self.server.count_request(command)
+
+			if command == "auth":
+				credentials = tuple(args[:3])
+				send_json(s, {"id": request_id, "result": None})
+			elif command in self.VALUE_COMMANDS:
+				send_json(s, {"id": request_id, "result": self.get_value(command, args, credentials)})
+			elif command in self.STREAM_COMMANDS:
+				if (self.STREAM_COMMANDS[command] or self.server.private) and not self.server.check_credentials(credentials):
+					send_json(s, {"id": request_id, "error": "Authentication failed."})
+				elif command == "background":
+					data = self.get_background()
+					send_json(s, {"id": request_id, "result": len(data)})
+					s.sendall(data)
+				else:
+					options = self.get_transfer_options(request)
+					send_json(s, {"id": request_id, "result": options or None})
+					getattr(self, f"stream_{command}")(s, reader, credentials, options)
+			else:
+				send_json(s, {"id": request_id, "error": f"Unknown command \"{command}\"."})
+
+
+	def get_transfer_options(self, request):
+		"""Returns the transfer options to use, out of those offered with a session request."""
+
+		options = {}
+
+		codecs = [codec for codec in request.get("compression", []) if codec in get_codecs()] if self.server.compression else []
+		if codecs:
+			options["compression"] = codecs
+
+		if request.get("file_table") in SC4MP_FILE_TABLE_ENCODINGS:
+			options["file_table"] = request["file_table"]
+
+		if request.get("resume") is True:
+			options["resume"] = True
+
+		return options
+
+
+	def get_value(self, command, args, credentials):
+
+		if command == "info":
+			return self.server.get_info()
+		elif command == "ping":
+			return "pong"
+		elif command == "time":
+			return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+		elif command == "server_list":
+			return [list(server) for server in self.server.server_list]
+		elif command == "check_password":
+			return "y" if self.server.password is None or (args and args[0] == self.server.password) else "n"
+		elif command == "token":
+			if credentials is None or (self.server.password is not None and credentials[2] != self.server.password):
+				return ""
+			hashed_user_id = hashlib.sha256(str(credentials[1]).encode()).hexdigest()[:32]
+			token = secrets.token_hex(16)
+			with self.server.users_lock:
+				self.server.users[hashed_user_id] = token
+			return token
+		elif command == "user_id":
+			with self.server.users_lock:
+				for hashed_user_id, token in self.server.users.items():
+					if hashlib.sha256((hashed_user_id + token).encode()).hexdigest() == args[0]:
+						return hashed_user_id
+			return ""
+
+
+	def stream_plugins(self, s, reader, credentials, options):
+
+		self.send_files(s, reader, "plugins", self.server.root / "Plugins", options)
+
+
+	def stream_regions(self, s, reader, credentials, options):
+
+		self.send_files(s, reader, "regions", self.server.root / "Regions", options)
+
+
+	def send_files(self, s, reader, request, directory, options):
+		"""
+		Sends the file table, receives the pruned file table (and, if resuming, 
+		the offsets to continue files from), then sends the files in it.
+		"""
+
+		stats = self.server.compression_stats
+		codecs = options.get("compression", [])
+		encoding = options.get("file_table", "json")
+
+		file_table = self.server.file_tables[request]
+		send_file_table(s, file_table, encoding, compressed=bool(codecs), stats=stats)
+		pruned_file_table = reader.recv_file_table(encoding, compressed=bool(codecs), stats=stats)
+		offsets = dict(reader.recv_json()) if options.get("resume") else {}
+
+		relpaths = set(entry[2] for entry in file_table)
+		for index, (checksum, size, relpath) in enumerate(pruned_file_table):
+			offset = offsets.get(index, 0)
+			if relpath not in relpaths or not 0 <= offset <= size:
+				return
+			with (directory / relpath).open("rb") as file:
+				if codecs:
+					file.seek(offset)
+					send_compressed(s, read_chunks(file), choose_codec(relpath, size, codecs), stats)
+				elif size > offset:
+					s.sendfile(file, offset, size - offset)
+
+
+	def stream_save(self, s, reader, credentials, options):
+		"""Receives the region name, file sizes and files of a save push, then discards them."""
+
+		codecs = options.get("compression", [])
+
+		s.sendall(b"ok")
+		region, sizes = reader.recv_json()
+		s.sendall(b"ok")
+		for size in sizes:
+			for chunk in reader.recv_file_chunks(size, compressed=bool(codecs), stats=self.server.compression_stats):
+				pass
+		s.sendall(b"ok")
+
+
+	def get_background(self):
+
+		try:
+			return (self.server.root / "background.png").read_bytes()
+		except OSError:
+			return b""
+
+
+	def send_background(self, s):
+
+		s.sendall(self.get_background())
+
+
+def add_emulator_arguments(parser):
+	"""Adds the network emulation options to an argument parser."""
+
+	parser.add_argument("--latency", type=float, default=0, help="delay before each reply, in milliseconds")
+	parser.add_argument("--jitter", type=float, default=0, help="random variation of the delay either way, in milliseconds")
+	parser.add_argument("--bandwidth", type=int, default=0, help="bandwidth cap for the whole server, in KB/s each way (0 for unlimited)")
+	parser.add_argument("--stream-bandwidth", type=int, default=0, help="bandwidth cap for each connection, in KB/s each way (0 for unlimited)")
+	parser.add_argument("--drop-rate", type=float, default=0, help="fraction of the connections to reset")
+	parser.add_argument("--drop-window", type=int, default=1000000, help="dropped connections are reset within this many bytes sent")
+	parser.add_argument("--seed", type=int, default=None, help="random seed for the jitter and drops")
+
+
+def get_emulator(args):
+
+	return NetworkEmulator(
+		latency=args.latency / 1000,
+		jitter=args.jitter / 1000,
+		bandwidth=args.bandwidth * 1000,
+		stream_bandwidth=args.stream_bandwidth * 1000,
+		drop_rate=args.drop_rate,
+		drop_window=args.drop_window,
+		seed=args.seed,
+	)
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Runs a local stand-in SC4MP server for testing and benchmarking the client.")
+	parser.add_argument("root", help="directory with the `Plugins` and `Regions` folders to serve (eg. one written by `benchmark.py corpus`)")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=7240)
+	parser.add_argument("--password", default=None, help="require a password")
+	parser.add_argument("--private", action="store_true", help="require authentication to download plugins and regions")
+	parser.add_argument("--legacy", action="store_true", help="only speak the legacy one-shot protocol")
+	parser.add_argument("--no-compression", action="store_true", help="refuse transfer compression")
+	add_emulator_arguments(parser)
+	args = parser.parse_args()
+
+	server = StandInServer(args.root, host=args.host, port=args.port, password=args.password, private=args.private, sessions=not args.legacy, compression=not args.no_compression, emulator=get_emulator(args))
+
+	print(f"Serving \"{args.root}\" on {args.host}:{server.address[1]} ({len(server.file_tables['plugins'])} plugins, {len(server.file_tables['regions'])} region files).")
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		print(f"{server.connections} connections, requests: {server.requests}")
+		if server.compression_stats.codecs:
+			print(f"Compression: {server.compression_stats}")
+		if server.emulator.drops:
+			print(f"{server.emulator.drops} connections dropped")
+
+
+if __name__ == "__main__":
+	main()